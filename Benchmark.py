@@ -0,0 +1,293 @@
+import json
+import os
+import tracemalloc
+from argparse import ArgumentParser
+from itertools import cycle
+from time import perf_counter_ns
+
+import numpy as np
+from PIL import Image
+
+from CSHelperUtils import *
+from CaptureBuffers import FrameRing
+from DigitReader import DigitReader, build_templates_from_font
+from FrameSources import SyntheticSource
+
+STAGES = ["frame_conversion", "ring_capture", "model_forward", "post_filter", "below_threshold", "read_numbers",
+          "draw_rects"]
+
+
+def make_fixture_frame(width, height, minion_count, seed, hp_lower, hp_upper, hp_bar_length):
+    """
+    Builds a deterministic frame with minions in a grid and an HP bar above each of them
+    :param width: Frame width
+    :param height: Frame height
+    :param minion_count: Number of minions to place
+    :param seed: Seed for the background noise and HP values
+    :param hp_lower: From the config, [R, G, B] of the lower bounds for the HP pixel
+    :param hp_upper: From the config, [R, G, B] of the upper bounds for the HP pixel
+    :param hp_bar_length: From the config, pixel length of the HP bar
+    :return: Frame array, the model style detections [x0, y0, x1, y1, confidence, label] of the minions, and the HP
+             pixel count drawn for each of them
+    """
+    rng = np.random.default_rng(seed)
+    # Dark noise never falls inside the HP color range
+    frame_arr = rng.integers(0, 80, size=(height, width, 3), dtype=np.uint8)
+    hp_color = (np.asarray(hp_lower, dtype=int) + np.asarray(hp_upper, dtype=int)) // 2
+    minion_size = 80
+    columns = max(1, int(np.ceil(np.sqrt(minion_count))))
+    cell_w = width // (columns + 1)
+    cell_h = height // (columns + 1)
+    detections = []
+    hp_counts = []
+    for i in range(minion_count):
+        x0 = cell_w * (i % columns + 1) - minion_size // 2
+        y0 = cell_h * (i // columns + 1) - minion_size // 2
+        label = i % 3
+        hp = int(rng.integers(1, hp_bar_length))
+        bar_x = x0 + minion_size // 2 - hp_bar_length // 2
+        frame_arr[y0 - 10, bar_x:bar_x + hp] = hp_color
+        detections.append([x0, y0, x0 + minion_size, y0 + minion_size, 0.9, label])
+        hp_counts.append(hp)
+    return frame_arr, np.array(detections, dtype=np.float32).reshape(-1, 6), hp_counts
+
+
+def load_dataset_fixtures(dataset_dir, limit):
+    """
+    Loads frames generated by dataset/generate_dataset/bootstrap.py with their labels as detections
+    :param dataset_dir: bootstrap.py output directory
+    :param limit: Maximum number of frames to load
+    :return: List of (name, frame array, detections, None), the HP of the minions is not known
+    """
+    fixtures = []
+    source = SyntheticSource(dataset_dir)
+    while len(fixtures) < limit:
+        frame_arr = source.read()
+        if frame_arr is None:
+            break
+        detections = [[x0, y0, x0 + w, y0 + h, 1.0, label] for x0, y0, w, h, label in source.labels()]
+        fixtures.append((os.path.basename(source.current_path), frame_arr,
+                         np.array(detections, dtype=np.float32).reshape(-1, 6), None))
+    return fixtures
+
+
+def time_stage(func, repeats):
+    """
+    Runs a stage repeatedly after one warm-up call
+    :param func: Stage to run, taking no arguments
+    :param repeats: Number of timed calls
+    :return: List of latencies in nanoseconds
+    """
+    func()
+    latencies = []
+    for _ in range(repeats):
+        s = perf_counter_ns()
+        func()
+        latencies.append(perf_counter_ns() - s)
+    return latencies
+
+
+def measure_allocations(func):
+    """
+    Runs a stage once while tracing memory allocations
+    :param func: Stage to run, taking no arguments
+    :return: Number of allocations still alive after the call (e.g. the returned frame), and the peak number of bytes
+             allocated during the call
+    """
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    tracemalloc.reset_peak()
+    result = func()
+    _, peak_bytes = tracemalloc.get_traced_memory()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    del result
+    allocations = sum(stat.count_diff for stat in after.compare_to(before, "lineno") if stat.count_diff > 0)
+    return allocations, peak_bytes
+
+
+def summarize(latencies, allocations, peak_bytes, bytes_copied):
+    """
+    :param latencies: List of latencies in nanoseconds
+    :param allocations: Allocations per call from measure_allocations
+    :param peak_bytes: Peak bytes allocated per call from measure_allocations
+    :param bytes_copied: Bytes of frame data copied per call, if the stage tracks it
+    :return: Dictionary of the latency percentiles in milliseconds, the throughput in calls per second, and the
+             memory traffic per call
+    """
+    latencies_ms = np.asarray(latencies) / 1e6
+    return {"p50_ms": float(np.percentile(latencies_ms, 50)),
+            "p95_ms": float(np.percentile(latencies_ms, 95)),
+            "p99_ms": float(np.percentile(latencies_ms, 99)),
+            "per_second": float(1000 / latencies_ms.mean()),
+            "allocations": allocations,
+            "alloc_bytes": peak_bytes,
+            "bytes_copied": bytes_copied,
+            "samples": len(latencies)}
+
+
+def verify_fixture(frame_arr, detections, expected_hp_counts, config):
+    """
+    Checks the stages' results on a fixture against the known minions, so a faster but wrong stage cannot pass as an
+    improvement
+    :param frame_arr: Fixture frame
+    :param detections: Model style detections of the minions
+    :param expected_hp_counts: HP pixel count drawn for each detection, None if not known
+    :param config: Result of load_config
+    :return: List of error messages, empty if every stage returned the expected values
+    """
+    errors = []
+    # The detections are all confident and large enough, so only the ones in the UI are dropped
+    expected = [i for i, d in enumerate(detections)
+                if not in_ui([d[0], d[1], d[2] - d[0], d[3] - d[1]], config.ui_list)]
+    minion_pos_list = filter_detections(detections, config.ui_boxes)
+    expected_pos = [[detections[i][0], detections[i][1], detections[i][2] - detections[i][0],
+                     detections[i][3] - detections[i][1], int(detections[i][5])] for i in expected]
+    if not np.allclose(np.asarray(minion_pos_list, dtype=np.float64).reshape(-1, 5),
+                       np.asarray(expected_pos, dtype=np.float64).reshape(-1, 5)):
+        errors.append(f"post_filter kept {len(minion_pos_list)} minions, expected {len(expected_pos)}")
+        return errors
+    if expected_hp_counts is None:
+        return errors
+    expected_hp = [expected_hp_counts[i] for i in expected]
+    hp_counts = minions_hp_counts(minion_pos_list, frame_arr, config.hp_search_padding, config.hp_lower,
+                                  config.hp_upper, config.hp_bar_length)
+    if list(hp_counts) != expected_hp:
+        errors.append(f"minions_hp_counts returned {list(hp_counts)}, expected {expected_hp}")
+    expected_below = [bool(hp <= config.minion_thresholds[pos[4]]) for pos, hp in zip(minion_pos_list, expected_hp)]
+    below = minions_below_threshold(minion_pos_list, frame_arr, config.hp_search_padding, config.hp_lower,
+                                    config.hp_upper, config.hp_bar_length, config.minion_thresholds)
+    if [bool(b) for b in below] != expected_below:
+        errors.append(f"below_threshold returned {below}, expected {expected_below}")
+    return errors
+
+
+def run_benchmarks(fixtures, model, screen, repeats, config):
+    """
+    Times every stage of the frame loop on every fixture
+    :param fixtures: List of (name, frame array, detections, expected HP counts or None)
+    :param model: Loaded model, or None to skip the model stage
+    :param screen: pygame Surface to draw on
+    :param repeats: Number of timed calls per stage and fixture
+    :param config: Result of load_config
+    :return: Dictionary of stage -> fixture -> summary
+    """
+    ui_list, ad_bbox, hp_lower, hp_upper = config.ui_boxes, config.ad_bbox, config.hp_lower, config.hp_upper
+    hp_bar_length, minion_thresholds, hp_search_padding = config.hp_bar_length, config.minion_thresholds, \
+        config.hp_search_padding
+    results = {stage: {} for stage in STAGES}
+    ad_reader = DigitReader(build_templates_from_font())
+    for name, frame_arr, detections, _ in fixtures:
+        frame = Image.fromarray(frame_arr)
+        ring = FrameRing(*frame_arr.shape, slots=2)
+        minion_pos_list = filter_detections(detections, ui_list)
+        draw_cycle = cycle([[minion_pos[:4] for minion_pos in minion_pos_list], []])
+        stage_funcs = {
+            "frame_conversion": lambda: np.array(frame),
+            "ring_capture": lambda: ring.release(ring.write(frame_arr)),
+            "model_forward": (lambda: model(frame_arr)) if model is not None else None,
+            "post_filter": lambda: filter_detections(detections, ui_list),
+            "below_threshold": lambda: minions_below_threshold(minion_pos_list, frame_arr, hp_search_padding, hp_lower,
+                                                               hp_upper, hp_bar_length, minion_thresholds),
+            # Forget the last region every call, a cached read would only measure the hash
+            "read_numbers": lambda: (ad_reader.reset(), read_numbers(frame_arr, ad_bbox, ad_reader)),
+            # Alternate with an empty overlay, otherwise every call after the first would be skipped as unchanged
+            "draw_rects": lambda: draw_rects(screen, next(draw_cycle), (0, 255, 0), 1, rescale=False),
+        }
+        for stage in STAGES:
+            if stage_funcs[stage] is None:
+                continue
+            latencies = time_stage(stage_funcs[stage], repeats)
+            copied_before, calls_before = ring.bytes_copied, ring.frames_written
+            allocations, peak_bytes = measure_allocations(stage_funcs[stage])
+            bytes_copied = np.array(frame).nbytes if stage == "frame_conversion" else \
+                (ring.bytes_copied - copied_before) // max(1, ring.frames_written - calls_before)
+            results[stage][name] = summarize(latencies, allocations, peak_bytes, bytes_copied)
+        ring.close()
+    return results
+
+
+def compare_to_baseline(results, baseline, tolerance):
+    """
+    Finds the stages that got slower than the baseline
+    :param results: Result of run_benchmarks
+    :param baseline: Previously saved result of run_benchmarks
+    :param tolerance: Allowed relative slowdown of the p50 latency, e.g. 0.1 for 10%
+    :return: List of (stage, fixture, baseline p50, current p50)
+    """
+    regressions = []
+    for stage, fixtures in results.items():
+        for name, summary in fixtures.items():
+            if name not in baseline.get(stage, {}):
+                continue
+            baseline_p50 = baseline[stage][name]["p50_ms"]
+            if summary["p50_ms"] > baseline_p50 * (1 + tolerance):
+                regressions.append((stage, name, baseline_p50, summary["p50_ms"]))
+    return regressions
+
+
+def print_results(results):
+    print(f"{'stage':<18}{'fixture':<28}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'per sec':>10}"
+          f"{'allocs':>8}{'alloc KB':>10}{'copied KB':>11}")
+    for stage, fixtures in results.items():
+        for name, summary in fixtures.items():
+            print(f"{stage:<18}{name:<28}{summary['p50_ms']:>10.3f}{summary['p95_ms']:>10.3f}"
+                  f"{summary['p99_ms']:>10.3f}{summary['per_second']:>10.1f}{summary['allocations']:>8}"
+                  f"{summary['alloc_bytes'] / 1024:>10.0f}{summary['bytes_copied'] / 1024:>11.0f}")
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description="Benchmarks each stage of the League CS Helper frame loop")
+    parser.add_argument("--repeats", type=int, default=50, help="Timed calls per stage and fixture")
+    parser.add_argument("--minion_counts", type=int, nargs="+", default=[1, 5, 10, 20],
+                        help="Number of minions in each generated fixture frame")
+    parser.add_argument("--dataset", default=None, help="bootstrap.py output directory to add as fixtures")
+    parser.add_argument("--dataset_frames", type=int, default=5, help="How many dataset frames to use")
+    parser.add_argument("--model", default=False, action="store_true", help="Also benchmark the model forward pass")
+    parser.add_argument("--baseline", default=None, help="Saved results to compare against")
+    parser.add_argument("--save_baseline", default=None, help="Where to save the results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="Allowed relative p50 slowdown")
+    args = parser.parse_args()
+
+    config = load_config()
+    screen_width, screen_height = config.screen_width, config.screen_height
+    hp_lower, hp_upper, hp_bar_length = config.hp_lower, config.hp_upper, config.hp_bar_length
+    fixtures = []
+    for minion_count in args.minion_counts:
+        frame_arr, detections, hp_counts = make_fixture_frame(screen_width, screen_height, minion_count, minion_count,
+                                                              hp_lower, hp_upper, hp_bar_length)
+        fixtures.append((f"grid_{minion_count}_minions", frame_arr, detections, hp_counts))
+    if args.dataset is not None:
+        fixtures += load_dataset_fixtures(args.dataset, args.dataset_frames)
+
+    failed = False
+    for name, frame_arr, detections, hp_counts in fixtures:
+        for error in verify_fixture(frame_arr, detections, hp_counts, config):
+            print(f"WRONG RESULT on {name}: {error}")
+            failed = True
+    if failed:
+        exit(1)
+
+    model = None
+    if args.model:
+        from ModelLoader import load_model
+        model, _ = load_model(screen_width=screen_width, screen_height=screen_height)
+
+    # Draw off-screen so the benchmark does not need the overlay
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    pygame.init()
+    screen = pygame.display.set_mode((screen_width, screen_height))
+
+    results = run_benchmarks(fixtures, model, screen, args.repeats, config)
+    print_results(results)
+
+    if args.save_baseline is not None:
+        with open(args.save_baseline, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            regressions = compare_to_baseline(results, json.load(f), args.tolerance)
+        for stage, name, baseline_p50, p50 in regressions:
+            print(f"REGRESSION {stage} on {name}: {baseline_p50:.3f} ms -> {p50:.3f} ms")
+        if len(regressions) > 0:
+            exit(1)
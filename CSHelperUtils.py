@@ -1,27 +1,51 @@
-import math
-from configparser import ConfigParser
-from ctypes import windll
+import os
+from configparser import ConfigParser, Error as ConfigError
+from dataclasses import dataclass
+from time import perf_counter
 
+import numpy as np
 import pygame
-from pytesseract import pytesseract
-from win32api import RGB
-from win32con import HWND_TOPMOST, GWL_EXSTYLE, SWP_NOMOVE, SWP_NOSIZE, WS_EX_TRANSPARENT, LWA_COLORKEY, WS_EX_LAYERED
-from win32gui import SetWindowLong, SetLayeredWindowAttributes, GetWindowLong
+from PIL import Image
+
+from Metrics import stage_timer
+
+# The overlay and OCR only exist on Windows, the rest of the pipeline can run anywhere (e.g. on recorded frames)
+try:
+    from ctypes import windll
+    from win32api import RGB
+    from win32con import HWND_TOPMOST, GWL_EXSTYLE, SWP_NOMOVE, SWP_NOSIZE, WS_EX_TRANSPARENT, LWA_COLORKEY, \
+        WS_EX_LAYERED
+    from win32gui import SetWindowLong, SetLayeredWindowAttributes, GetWindowLong
+except ImportError:
+    windll = None
+try:
+    from pytesseract import pytesseract
+    pytesseract.tesseract_cmd = r'C:\Program Files\Tesseract-OCR\tesseract'
+except ImportError:
+    pytesseract = None
 
 CONFIG_LOC = "config.ini"
 transparent_color = '#000000'
-pytesseract.tesseract_cmd = r'C:\Program Files\Tesseract-OCR\tesseract'
 global rescale_w
 global rescale_h
+# Rectangles currently on the overlay as (pygame.Rect, color, thickness), so only changes need to be redrawn
+drawn_rects = []
+# Draw on an off-screen surface without a display, e.g. for tests and benchmarks
+headless = False
 
 
-def read_numbers(screenshot, bbox):
+def read_numbers(screenshot, bbox, reader=None):
     """
     Crops the screen and returns the integer from it.
-    :param screenshot: PIL Image of the screen
+    :param screenshot: PIL Image or numpy array of the screen
     :param bbox: [x0, y0, x1, y1] of where to crop
+    :param reader: DigitReader to match the digits in-process, None to run Tesseract
     :return: Integer from captured area
     """
+    if reader is not None:
+        return reader.read(np.asarray(screenshot), bbox)
+    if isinstance(screenshot, np.ndarray):
+        screenshot = Image.fromarray(screenshot)
     crop = screenshot.crop(bbox)
     num_string = pytesseract.image_to_string(crop.convert("L"), lang='eng', config='digits')
     num_val = -1
@@ -33,54 +57,161 @@ def read_numbers(screenshot, bbox):
     return num_val
 
 
-def load_config():
+@dataclass(frozen=True)
+class Config:
+    """
+    Values from config.ini, converted once into the structures the frame loop uses
+    """
+    screen_width: int
+    screen_height: int
+    fps_cap: int
+    # [x0, y0, x1, y1] of the UI elements, as a tuple of tuples and as an (N, 4) array for vectorized checks
+    ui_list: tuple
+    ui_boxes: np.ndarray
+    ad_bbox: tuple
+    ad_rect: tuple
+    # [R, G, B] bounds of the HP pixels as uint8 arrays
+    hp_lower: np.ndarray
+    hp_upper: np.ndarray
+    hp_bar_length: int
+    # HP pixel threshold indexed by the minion label (melee, caster, cannon)
+    minion_thresholds: np.ndarray
+    hp_search_padding: int
+
+
+def read_only(values, dtype):
+    """
+    Converts config values into an array the frame loop cannot modify by accident, since a Config is shared
+    :param values: Values to convert
+    :param dtype: Numpy dtype of the array
+    :return: Read-only numpy array of the values
+    """
+    arr = np.array(values, dtype=dtype)
+    arr.flags.writeable = False
+    return arr
+
+
+def load_config(config_loc=CONFIG_LOC, screen_size=None):
     """
     Loads config.ini and returns all the constructed objects from it
-    :return: All config values in their respective data structures
+    :param config_loc: Path to the config file
+    :param screen_size: (width, height) to use instead of the file's, e.g. the size the overlay was opened with
+    :return: Config
     """
     config = ConfigParser()
-    config.read(CONFIG_LOC)
+    if len(config.read(config_loc)) == 0:
+        raise FileNotFoundError(f"Could not read {config_loc}")
     settings = config["settings"]
     regions = config["regions"]
     hp_bar = config["hp_bar"]
     screen_width = int(settings["screen_width"])
     screen_height = int(settings["screen_height"])
+    if screen_size is not None:
+        screen_width, screen_height = screen_size
     fps_cap = int(settings["fps_cap"])
     ad_x0 = float(regions["ad_x0"])
     ad_y0 = float(regions["ad_y0"])
     ad_w = float(regions["ad_w"])
     ad_h = float(regions["ad_h"])
-    ui_0 = [int(regions["ui0_x0"]), int(regions["ui0_y0"]), int(regions["ui0_x1"]), int(regions["ui0_y1"])]
-    ui_1 = [int(regions["ui1_x0"]), int(regions["ui1_y0"]), int(regions["ui1_x1"]), int(regions["ui1_y1"])]
-    ui_list = [ui_0, ui_1]
-    ad_bbox = [int(ad_x0 * screen_width), int(ad_y0 * screen_height),
-               int(screen_width * (ad_w + ad_x0)), int(screen_height * (ad_h + ad_y0))]
-    ad_rect = [int(ad_x0 * screen_width), int(ad_y0 * screen_height),
-               int(ad_w * screen_width), int(ad_h * screen_height)]
+    ui_0 = (int(regions["ui0_x0"]), int(regions["ui0_y0"]), int(regions["ui0_x1"]), int(regions["ui0_y1"]))
+    ui_1 = (int(regions["ui1_x0"]), int(regions["ui1_y0"]), int(regions["ui1_x1"]), int(regions["ui1_y1"]))
+    ui_list = (ui_0, ui_1)
+    ad_bbox = (int(ad_x0 * screen_width), int(ad_y0 * screen_height),
+               int(screen_width * (ad_w + ad_x0)), int(screen_height * (ad_h + ad_y0)))
+    ad_rect = (int(ad_x0 * screen_width), int(ad_y0 * screen_height),
+               int(ad_w * screen_width), int(ad_h * screen_height))
     hp_lower = [int(hp_bar["hp_lower_r"]), int(hp_bar["hp_lower_g"]), int(hp_bar["hp_lower_b"])]
     hp_upper = [int(hp_bar["hp_upper_r"]), int(hp_bar["hp_upper_g"]), int(hp_bar["hp_upper_b"])]
+    if not all(0 <= lower <= upper <= 255 for lower, upper in zip(hp_lower, hp_upper)):
+        raise ValueError(f"HP bounds {hp_lower} - {hp_upper} must be 0-255 with the lower bound at most the upper one")
     hp_bar_length = int(hp_bar["hp_bar_length"])
     minion_thresholds = [int(hp_bar["melee_threshold"]), int(hp_bar["caster_threshold"]),
                          int(hp_bar["cannon_threshold"])]
     hp_search_padding = int(hp_bar["hp_search_padding"])
-    return screen_width, screen_height, fps_cap, ui_list, ad_bbox, ad_rect, hp_lower, hp_upper, hp_bar_length, \
-           minion_thresholds, hp_search_padding
+    return Config(screen_width, screen_height, fps_cap, ui_list, read_only(ui_list, np.int32), ad_bbox, ad_rect,
+                  read_only(hp_lower, np.uint8), read_only(hp_upper, np.uint8), hp_bar_length,
+                  read_only(minion_thresholds, np.int32), hp_search_padding)
 
 
-def init_overlay(screen_width, screen_height):
+class ConfigWatcher:
+    """
+    Reloads the config when its file changes, so it can be tuned while the helper runs
+    """
+
+    def __init__(self, config_loc=CONFIG_LOC, interval=1.0):
+        """
+        :param config_loc: Path to the config file
+        :param interval: Minimum number of seconds between two checks of the file
+        """
+        self.config_loc = config_loc
+        self.interval = interval
+        self.config = load_config(config_loc)
+        self.stamp = self.file_stamp()
+        self.last_check = perf_counter()
+        self.reloads = 0
+
+    def file_stamp(self):
+        stat = os.stat(self.config_loc)
+        return stat.st_mtime_ns, stat.st_size
+
+    def poll(self):
+        """
+        Call between frames, the new config is built completely before it replaces the old one
+        :return: The current Config
+        """
+        now = perf_counter()
+        if now - self.last_check < self.interval:
+            return self.config
+        self.last_check = now
+        try:
+            stamp = self.file_stamp()
+            if stamp == self.stamp:
+                return self.config
+            config = load_config(self.config_loc)
+            screen_size = (self.config.screen_width, self.config.screen_height)
+            if (config.screen_width, config.screen_height) != screen_size:
+                # The overlay and capture keep their size, so the regions stay scaled to it
+                print("The screen size only takes effect after a restart")
+                config = load_config(self.config_loc, screen_size)
+        except (OSError, KeyError, ValueError, ConfigError) as e:
+            # The file may be half written, keep the old config and try again on the next check
+            print(f"Could not reload {self.config_loc}: {e!r}")
+            return self.config
+        self.stamp = stamp
+        self.config = config
+        self.reloads += 1
+        print(f"Reloaded {self.config_loc}")
+        return self.config
+
+
+def init_overlay(screen_width, screen_height, headless_surface=False):
     """
     Initializes the pygame overlay to be transparent, always on top, and click-through-able
     :param screen_width: Screen width from config
     :param screen_height: Screen height from config
+    :param headless_surface: Draw on an off-screen surface instead of opening a window
     :returns: pygame Screen and hwnd
     """
-    global rescale_h, rescale_w
+    global rescale_h, rescale_w, drawn_rects, headless
+    drawn_rects = []
+    headless = headless_surface
+    if headless:
+        rescale_w = rescale_h = 1
+        screen = pygame.Surface((screen_width, screen_height))
+        screen.fill(transparent_color)
+        return screen, None
     # Mostly taken from https://github.com/LtqxWYEG/PoopStuckToYourMouse to make the overlay work as intended
 
     pygame.init()
     info = pygame.display.Info()  # get screen information like size, to set in pygame.display.set_mode
     rescale_w = info.current_w / screen_width
     rescale_h = info.current_h / screen_height
+    if windll is None:
+        # Not on Windows, fall back to a regular window so frames can still be replayed and drawn
+        rescale_w = rescale_h = 1
+        screen = pygame.display.set_mode((screen_width, screen_height))
+        screen.fill(transparent_color)
+        return screen, None
     setWindowPos = windll.user32.SetWindowPos  # see setWindowAttributes()
     flags = pygame.FULLSCREEN  # | pygame.DOUBLEBUF | pygame.HWSURFACE  # flags to set in pygame.display.set_mode
     transparentColorTuple = tuple(int(transparent_color.lstrip('#')[i:i + 2], 16) for i in (
@@ -108,25 +239,35 @@ def init_overlay(screen_width, screen_height):
 
 def draw_rects(screen, rects, rect_color, thickness, rescale=True):
     """
-    Draws a list of rectangles to the screen
+    Draws a list of rectangles to the screen, only redrawing and updating the areas that changed since the last call
     :param screen: pygame Screen
     :param rects: List of rectangles defined as [x0, y0, width, height]
     :param rect_color: Color of the rectangles
     :param thickness: Thickness to draw the rectangles
     :param rescale: Rescale to fix Window's screen adjustment
+    :return: List of the pygame.Rect areas of the screen that changed
     """
-    # Clear pygame screen
-    screen.fill(transparent_color)
+    global drawn_rects
+    scale_w, scale_h = (rescale_w, rescale_h) if rescale else (1, 1)
+    new_rects = [(pygame.Rect(float(rect[0] * scale_w), float(rect[1] * scale_h),
+                              float(rect[2] * scale_w), float(rect[3] * scale_h)), rect_color, thickness)
+                 for rect in rects]
+    if new_rects == drawn_rects:
+        return []
 
-    # Draw the rectangles
-    for rect in rects:
-        if rescale:
-            pygame.draw.rect(screen, rect_color, pygame.Rect(rect[0] * rescale_w, rect[1] * rescale_h,
-                                                             rect[2] * rescale_w, rect[3] * rescale_h), thickness)
-        else:
-            pygame.draw.rect(screen, rect_color, pygame.Rect(rect[0], rect[1], rect[2], rect[3]), thickness)
+    # Clear the rectangles that are gone, then draw the new ones and redraw any kept ones the clearing cut into
+    dirty = []
+    for drawn_rect in drawn_rects:
+        if drawn_rect not in new_rects:
+            dirty.append(screen.fill(transparent_color, drawn_rect[0]))
+    for new_rect in new_rects:
+        if new_rect not in drawn_rects or new_rect[0].collidelist(dirty) != -1:
+            dirty.append(pygame.draw.rect(screen, new_rect[1], new_rect[0], new_rect[2]))
+    drawn_rects = new_rects
 
-    pygame.display.update()
+    if not headless:
+        pygame.display.update(dirty)
+    return dirty
 
 
 def is_hp(pixel, hp_lower, hp_upper):
@@ -142,6 +283,153 @@ def is_hp(pixel, hp_lower, hp_upper):
            hp_lower[2] <= pixel[2] <= hp_upper[2]
 
 
+def find_hp_bars(frame_arr, hp_lower, hp_upper):
+    """
+    Finds every horizontal run of HP pixels in the frame in a single pass
+    :param frame_arr: Numpy array from the frame
+    :param hp_lower: From the config, [R, G, B] of the lower bounds for the HP pixel to check
+    :param hp_upper: From the config, [R, G, B] of the upper bounds for the HP pixel to check
+    :return: (bar_x, bar_y, bar_len) arrays of the left-most pixel and length of each run, in row-major order
+    """
+    # Signed bounds, the config arrays are uint8 and their difference would wrap around
+    lower = [max(0, int(v)) for v in hp_lower[:3]]
+    upper = [min(255, int(v)) for v in hp_upper[:3]]
+    if any(lo > hi for lo, hi in zip(lower, upper)):
+        # Like is_hp, an empty range matches no pixel
+        empty = np.zeros(0, dtype=np.intp)
+        return empty, empty, empty
+    # With lower <= upper, unsigned wraparound turns lower <= value <= upper into a single comparison per channel
+    hp_mask = (frame_arr[..., 0] - np.uint8(lower[0])) <= np.uint8(upper[0] - lower[0])
+    for c in (1, 2):
+        hp_mask &= (frame_arr[..., c] - np.uint8(lower[c])) <= np.uint8(upper[c] - lower[c])
+    # HP pixels are sparse, so find the runs from the HP pixel indices instead of the whole mask
+    width = hp_mask.shape[1]
+    hp_index = np.flatnonzero(hp_mask)
+    run_start = np.ones(len(hp_index), dtype=bool)
+    run_start[1:] = (np.diff(hp_index) != 1) | (hp_index[1:] % width == 0)
+    start_index = np.flatnonzero(run_start)
+    bar_len = np.diff(np.append(start_index, len(hp_index)))
+    start_y, start_x = np.divmod(hp_index[start_index], width)
+    return start_x, start_y, bar_len
+
+
+def hp_search_box(minion_pos, frame_shape, hp_search_padding):
+    """
+    Creates the padded search box to look for a minion's HP bar
+    :param minion_pos: [x0, y0, w, h, label]
+    :param frame_shape: Shape of the frame array
+    :param hp_search_padding: From the config, how large to make the search window from the minion's position
+    :return: [x0, y0, x1, y1] of the search box
+    """
+    search_box = []
+    if int(minion_pos[0]) > hp_search_padding:
+        search_box.append(int(minion_pos[0]) - hp_search_padding)
+    else:
+        search_box.append(int(minion_pos[0]))
+    if int(minion_pos[1]) > hp_search_padding:
+        search_box.append(int(minion_pos[1]) - hp_search_padding)
+    else:
+        search_box.append(int(minion_pos[1]))
+    if int(minion_pos[0] + minion_pos[2]) + hp_search_padding < frame_shape[1] - 1:
+        search_box.append(int(minion_pos[0] + minion_pos[2]) + hp_search_padding)
+    else:
+        search_box.append(int(minion_pos[0] + minion_pos[2]))
+    search_box.append(int(minion_pos[1] + minion_pos[2] / 2))
+    return search_box
+
+
+def minion_hp_count(minion_pos, hp_bars, frame_shape, hp_search_padding, hp_bar_length):
+    """
+    Matches a minion to the closest HP bar in its search box and counts the HP pixels in it
+    :param minion_pos: [x0, y0, w, h, label]
+    :param hp_bars: Result of find_hp_bars for the frame
+    :param frame_shape: Shape of the frame array
+    :param hp_search_padding: From the config, how large to make the search window from the minion's position
+    :param hp_bar_length: From the config, pixel length of the HP bar
+    :return: Number of HP pixels in the minion's HP bar
+    """
+    bar_x, bar_y, bar_len = hp_bars
+    search_box = hp_search_box(minion_pos, frame_shape, hp_search_padding)
+    half_hp_bar_length = int(hp_bar_length / 2)
+    # The per-pixel search failed on any box reaching past the bottom or right edge, as long as it scanned a pixel.
+    # Boxes reaching past the top or left edge are searched within the frame only, the per-pixel search wrapped
+    # around to the opposite edge there
+    if (search_box[3] > frame_shape[0] or search_box[2] > frame_shape[1]) and \
+            search_box[0] < search_box[2] and search_box[1] < search_box[3]:
+        raise Exception("HP search box is outside of the frame!")
+
+    # Bars must start inside the box and leave room for half of the bar before the right edge
+    in_box = (bar_y >= search_box[1]) & (bar_y < search_box[3]) & \
+             (bar_x >= search_box[0]) & (bar_x < search_box[2]) & (bar_x + half_hp_bar_length <= search_box[2])
+    candidates = np.flatnonzero(in_box)
+    if len(candidates) == 0:
+        raise Exception("Could not find HP!")
+
+    # Only the left-most bar start of each row is considered
+    _, first_in_row = np.unique(bar_y[candidates], return_index=True)
+    candidates = candidates[first_in_row]
+
+    # Find the closest HP bar to the center of the minion in case there are multiple HP bars found
+    minion_center_x = int(minion_pos[0] + minion_pos[2] / 2)
+    dx = np.abs(bar_x[candidates] + half_hp_bar_length - minion_center_x)
+    dy = np.abs(bar_y[candidates] - minion_pos[1])
+    dist_to_minion = np.sqrt(dx ** 2 + dy ** 2)
+    closest = candidates[np.argmin(dist_to_minion)] if dist_to_minion.min() < 10000 else candidates[-1]
+
+    # Count number of HP pixels from left to right
+    hp_pixel_count = min(int(bar_len[closest]), 80)
+    if hp_pixel_count < 80 and bar_x[closest] + hp_pixel_count >= frame_shape[1]:
+        raise Exception("HP bar runs off the frame!")
+    return hp_pixel_count
+
+
+def minions_hp_counts(minion_pos_list, frame_arr, hp_search_padding, hp_lower, hp_upper, hp_bar_length, hp_bars=None):
+    """
+    Counts the HP pixels of every minion in the frame using one HP bar pass over the frame
+    :param minion_pos_list: List of [x0, y0, w, h, label]
+    :param frame_arr: Numpy array from the frame
+    :param hp_search_padding: From the config, how large to make the search window from the minion's position
+    :param hp_lower: From the config, [R, G, B] of the lower bounds for the HP pixel to check
+    :param hp_upper: From the config, [R, G, B] of the upper bounds for the HP pixel to check
+    :param hp_bar_length: From the config, pixel length of the HP bar
+    :param hp_bars: Result of find_hp_bars if it was already computed for this frame
+    :return: List of each minion's HP pixel count, None where its HP bar could not be found
+    """
+    if len(minion_pos_list) == 0:
+        return []
+    if hp_bars is None:
+        hp_bars = find_hp_bars(frame_arr, hp_lower, hp_upper)
+    hp_counts = []
+    for minion_pos in minion_pos_list:
+        try:
+            hp_counts.append(minion_hp_count(minion_pos, hp_bars, frame_arr.shape, hp_search_padding, hp_bar_length))
+        except Exception as e:
+            print(e)
+            hp_counts.append(None)
+    return hp_counts
+
+
+def minions_below_threshold(minion_pos_list, frame_arr, hp_search_padding, hp_lower, hp_upper, hp_bar_length,
+                            minion_thresholds, hp_bars=None):
+    """
+    Checks every minion in the frame against its threshold using one HP bar pass over the frame
+    :param minion_pos_list: List of [x0, y0, w, h, label]
+    :param frame_arr: Numpy array from the frame
+    :param hp_search_padding: From the config, how large to make the search window from the minion's position
+    :param hp_lower: From the config, [R, G, B] of the lower bounds for the HP pixel to check
+    :param hp_upper: From the config, [R, G, B] of the upper bounds for the HP pixel to check
+    :param hp_bar_length: From the config, pixel length of the HP bar
+    :param minion_thresholds: From the config, [melee, caster, cannon] pixel values of when the player should attack it
+    :param hp_bars: Result of find_hp_bars if it was already computed for this frame
+    :return: List of whether each minion's health is below the threshold
+    """
+    hp_counts = minions_hp_counts(minion_pos_list, frame_arr, hp_search_padding, hp_lower, hp_upper, hp_bar_length,
+                                  hp_bars)
+    # Check if the HP pixels are at or below threshold (means the player should attack minion)
+    return [hp_pixel_count is not None and hp_pixel_count <= minion_thresholds[minion_pos[4]]
+            for minion_pos, hp_pixel_count in zip(minion_pos_list, hp_counts)]
+
+
 def below_threshold(minion_pos, frame_arr, hp_search_padding, hp_lower, hp_upper, hp_bar_length, minion_thresholds):
     """
     Finds the minion's HP bar and checks if it is below it's threshold
@@ -154,76 +442,8 @@ def below_threshold(minion_pos, frame_arr, hp_search_padding, hp_lower, hp_upper
     :param minion_thresholds: From the config, [melee, caster, cannon] pixel values of when the player should attack it
     :return: If the minion's health is below the threshold (meaning the player should attack it)
     """
-    try:
-        # Create the padded search box to look for HP bars
-        search_box = []
-        if int(minion_pos[0]) > hp_search_padding:
-            search_box.append(int(minion_pos[0]) - hp_search_padding)
-        else:
-            search_box.append(int(minion_pos[0]))
-        if int(minion_pos[1]) > hp_search_padding:
-            search_box.append(int(minion_pos[1]) - hp_search_padding)
-        else:
-            search_box.append(int(minion_pos[1]))
-        if int(minion_pos[0] + minion_pos[2]) + hp_search_padding < frame_arr.shape[1] - 1:
-            search_box.append(int(minion_pos[0] + minion_pos[2]) + hp_search_padding)
-        else:
-            search_box.append(int(minion_pos[0] + minion_pos[2]))
-        search_box.append(int(minion_pos[1] + minion_pos[2] / 2))
-
-        # Search for unique starting coordinates of HP bars (this will find the left-most pixel in it)
-        found_hp_y_list = []
-        found_hp_x_list = []
-        half_hp_bar_length = int(hp_bar_length / 2)
-        for y in range(search_box[1], search_box[3]):
-            for x in range(search_box[0], search_box[2]):
-                pixel = frame_arr[y][x]
-                if is_hp(pixel, hp_lower, hp_upper) and y not in found_hp_y_list and x + half_hp_bar_length <= \
-                        search_box[2]:
-                    if x - 1 >= 0:
-                        if not is_hp(frame_arr[y][x - 1], hp_lower, hp_upper):
-                            found_hp_y_list.append(y)
-                            found_hp_x_list.append(x)
-                    else:
-                        found_hp_y_list.append(y)
-                        found_hp_x_list.append(x)
-
-        if len(found_hp_y_list) == 0:
-            raise Exception("Could not find HP!")
-
-        # Determine starting pixel position in case their are multiple HP bars found
-        if len(found_hp_y_list) > 1:
-            # Find the closest HP bar to the center of the minion
-            closest_to_center_index = -1
-            closest_to_center_val = 10000
-            minion_center_x = int(minion_pos[0] + minion_pos[2] / 2)
-            for found_hp_index, found_hp_x in enumerate(found_hp_x_list):
-                center = found_hp_x + half_hp_bar_length
-                dx = abs(center - minion_center_x)
-                dy = abs(found_hp_y_list[found_hp_index] - minion_pos[1])
-                dist_to_minion = math.sqrt(dx ** 2 + dy ** 2)
-                if dist_to_minion < closest_to_center_val:
-                    closest_to_center_val = dist_to_minion
-                    closest_to_center_index = found_hp_index
-            starting_pixel = [found_hp_x_list[closest_to_center_index], found_hp_y_list[closest_to_center_index]]
-        else:
-            starting_pixel = [found_hp_x_list[0], found_hp_y_list[0]]
-
-        # Count number of HP pixels from left to right
-        hp_pixel_count = 0
-        for _ in range(80):
-            pixel = frame_arr[starting_pixel[1], starting_pixel[0]]
-            if is_hp(pixel, hp_lower, hp_upper):
-                hp_pixel_count += 1
-                starting_pixel[0] += 1
-            else:
-                break
-
-        # Check if the HP pixels are at or below threshold (means the player should attack minion)
-        return hp_pixel_count <= minion_thresholds[minion_pos[4]]
-    except Exception as e:
-        print(e)
-        return False
+    return minions_below_threshold([minion_pos], frame_arr, hp_search_padding, hp_lower, hp_upper, hp_bar_length,
+                                   minion_thresholds)[0]
 
 
 def in_ui(minion_pos, ui_list):
@@ -242,3 +462,59 @@ def in_ui(minion_pos, ui_list):
         if x_match and y_match:
             return True
     return False
+
+
+def boxes_in_ui(boxes, ui_list):
+    """
+    Vectorized in_ui for many boxes at once
+    :param boxes: Array of [x0, y0, x1, y1] rows
+    :param ui_list: From the config, [x0, y0, x1, y1] positions of the UI elements, e.g. Config.ui_boxes
+    :return: Boolean array, True for the boxes that overlap the UI like in_ui decides it
+    """
+    ui_boxes = np.asarray(ui_list).reshape(-1, 4)[None]
+    boxes = np.asarray(boxes)[:, None]
+
+    def inside(v, lo, hi):
+        return (ui_boxes[..., lo] < boxes[..., v]) & (boxes[..., v] < ui_boxes[..., hi])
+
+    x_match = inside(0, 0, 2) | inside(2, 0, 2)
+    y_match = inside(1, 1, 3) | inside(3, 1, 3)
+    return (x_match & y_match).any(axis=1)
+
+
+def filter_detections(all_detected_objs, ui_list, min_confidence=.6, min_size=50):
+    """
+    Turns the model's detections into minion positions, dropping unsure, tiny, or UI detections
+    :param all_detected_objs: Model output rows of [x0, y0, x1, y1, confidence, label]
+    :param ui_list: From the config, list of [x0, y0, x1, y1] positions of the UI elements on the screen
+    :param min_confidence: Detections at or below this confidence are dropped
+    :param min_size: Detections with a width or height at or below this are dropped
+    :return: List of [x0, y0, w, h, label] of the minions
+    """
+    all_detected_objs = np.asarray(all_detected_objs).reshape(-1, 6)
+    w = all_detected_objs[:, 2] - all_detected_objs[:, 0]
+    h = all_detected_objs[:, 3] - all_detected_objs[:, 1]
+    keep = (all_detected_objs[:, 4] > min_confidence) & (w > min_size) & (h > min_size)
+    # x0 + w instead of x1 so the edges are exactly the ones in_ui checks
+    corners = np.column_stack([all_detected_objs[:, 0], all_detected_objs[:, 1], all_detected_objs[:, 0] + w,
+                               all_detected_objs[:, 1] + h])
+    keep &= ~boxes_in_ui(corners, ui_list)
+    return [[all_detected_objs[i, 0], all_detected_objs[i, 1], w[i], h[i], int(all_detected_objs[i, 5])]
+            for i in np.flatnonzero(keep)]
+
+
+def detect_minions(model, frame_arr, ui_list, metrics=None, size=None):
+    """
+    Runs the model on the frame and keeps the usable minion detections
+    :param model: Loaded YOLOv5 model
+    :param frame_arr: Numpy array from the frame
+    :param ui_list: From the config, list of [x0, y0, x1, y1] positions of the UI elements on the screen
+    :param metrics: Metrics the inference and post_filter times are recorded into, None to not time them
+    :param size: Model input size, None for the model's default (fixed shape backends ignore it)
+    :return: List of [x0, y0, w, h, label] of the minions
+    """
+    with stage_timer(metrics, "inference"):
+        results = model(frame_arr) if size is None else model(frame_arr, size=size)
+        all_detected_objs = results.xyxy[0].cpu().numpy()
+    with stage_timer(metrics, "post_filter"):
+        return filter_detections(all_detected_objs, ui_list)
@@ -0,0 +1,158 @@
+import ctypes
+import threading
+from collections import deque
+from multiprocessing import shared_memory
+
+import numpy as np
+
+try:
+    from ctypes import windll, wintypes
+except ImportError:
+    windll = None
+
+SRCCOPY = 0x00CC0020
+CAPTUREBLT = 0x40000000
+DIB_RGB_COLORS = 0
+BI_RGB = 0
+
+
+class FrameRing:
+    """
+    Preallocated ring of frame buffers in shared memory, so capturing a frame reuses memory instead of allocating
+    A buffer handed out by next_slot or write stays in use until the frame is released, so a frame is never
+    overwritten while a stage is still reading it
+    """
+
+    def __init__(self, height, width, channels=3, slots=4):
+        """
+        :param height: Frame height
+        :param width: Frame width
+        :param channels: Channels per pixel
+        :param slots: Number of buffers, ideally more than the number of frames in use at once (e.g. waiting in the
+                      pipeline's queues), otherwise the capture waits for a frame to be released
+        """
+        self.shape = (height, width, channels)
+        self.slots = max(1, slots)
+        self.slot_bytes = height * width * channels
+        self.memory = shared_memory.SharedMemory(create=True, size=self.slots * self.slot_bytes)
+        self.frames = np.ndarray((self.slots, height, width, channels), dtype=np.uint8, buffer=self.memory.buf)
+        self.address = self.frames.ctypes.data
+        self.free = deque(range(self.slots))
+        self.condition = threading.Condition()
+        self.closed = False
+        self.frames_written = 0
+        self.bytes_copied = 0
+        self.fallbacks = 0
+
+    def next_slot(self, timeout=0.1):
+        """
+        Takes a free buffer to write a frame into
+        :param timeout: Seconds to wait for a frame to be released when every buffer is in use
+        :return: View of the buffer, or None if none was released in time, the caller then allocates the frame itself
+        """
+        with self.condition:
+            if not self.condition.wait_for(lambda: len(self.free) > 0, timeout):
+                self.fallbacks += 1
+                return None
+            index = self.free.popleft()
+        self.frames_written += 1
+        return self.frames[index]
+
+    def write(self, frame_arr):
+        """
+        Copies a frame that was decoded elsewhere into a free buffer
+        :param frame_arr: Numpy array of the frame, with the ring's shape
+        :return: View of the buffer holding the frame, or the frame itself if no buffer was released in time
+        """
+        slot = self.next_slot()
+        if slot is None:
+            return frame_arr[..., :self.shape[2]]
+        np.copyto(slot, frame_arr[..., :self.shape[2]])
+        self.bytes_copied += slot.nbytes
+        return slot
+
+    def slot_index(self, frame_arr):
+        """
+        :param frame_arr: Numpy array of a frame, or any view of it (e.g. a BGR buffer viewed as RGB)
+        :return: Index of the buffer holding the frame, or None if the frame is not in the ring
+        """
+        offset = frame_arr.ctypes.data - self.address
+        if 0 <= offset < self.slots * self.slot_bytes:
+            return offset // self.slot_bytes
+        return None
+
+    def release(self, frame_arr):
+        """
+        Hands the frame's buffer back once every stage is done with the frame, frames not in the ring are ignored
+        :param frame_arr: Frame returned by next_slot or write, or a view of it
+        """
+        if self.closed:
+            return
+        index = self.slot_index(frame_arr)
+        if index is None:
+            return
+        with self.condition:
+            if index not in self.free:
+                self.free.append(index)
+                self.condition.notify()
+
+    def close(self):
+        """
+        Releases the shared memory, no views of the ring may be used afterwards
+        """
+        self.closed = True
+        del self.frames
+        self.memory.close()
+        self.memory.unlink()
+
+
+class BITMAPINFOHEADER(ctypes.Structure):
+    _fields_ = [("biSize", ctypes.c_uint32), ("biWidth", ctypes.c_int32), ("biHeight", ctypes.c_int32),
+                ("biPlanes", ctypes.c_uint16), ("biBitCount", ctypes.c_uint16), ("biCompression", ctypes.c_uint32),
+                ("biSizeImage", ctypes.c_uint32), ("biXPelsPerMeter", ctypes.c_int32),
+                ("biYPelsPerMeter", ctypes.c_int32), ("biClrUsed", ctypes.c_uint32),
+                ("biClrImportant", ctypes.c_uint32)]
+
+
+class GdiCapture:
+    """
+    Copies the screen with GDI straight into a caller-provided BGRA buffer, without any Python-side allocation
+    """
+
+    def __init__(self):
+        user32, gdi32 = windll.user32, windll.gdi32
+        user32.GetDC.restype = wintypes.HDC
+        user32.ReleaseDC.argtypes = [wintypes.HWND, wintypes.HDC]
+        gdi32.CreateCompatibleDC.argtypes = [wintypes.HDC]
+        gdi32.CreateCompatibleDC.restype = wintypes.HDC
+        gdi32.CreateCompatibleBitmap.argtypes = [wintypes.HDC, ctypes.c_int, ctypes.c_int]
+        gdi32.CreateCompatibleBitmap.restype = wintypes.HBITMAP
+        gdi32.SelectObject.argtypes = [wintypes.HDC, wintypes.HGDIOBJ]
+        gdi32.BitBlt.argtypes = [wintypes.HDC, ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_int, wintypes.HDC,
+                                 ctypes.c_int, ctypes.c_int, wintypes.DWORD]
+        gdi32.GetDIBits.argtypes = [wintypes.HDC, wintypes.HBITMAP, wintypes.UINT, wintypes.UINT, ctypes.c_void_p,
+                                    ctypes.c_void_p, wintypes.UINT]
+        gdi32.DeleteObject.argtypes = [wintypes.HGDIOBJ]
+        gdi32.DeleteDC.argtypes = [wintypes.HDC]
+        self.user32, self.gdi32 = user32, gdi32
+        self.width, self.height = user32.GetSystemMetrics(0), user32.GetSystemMetrics(1)
+        self.screen_dc = user32.GetDC(None)
+        self.memory_dc = gdi32.CreateCompatibleDC(self.screen_dc)
+        self.bitmap = gdi32.CreateCompatibleBitmap(self.screen_dc, self.width, self.height)
+        gdi32.SelectObject(self.memory_dc, self.bitmap)
+        # Negative height asks for top-down rows, matching numpy's layout
+        self.bitmap_info = BITMAPINFOHEADER(ctypes.sizeof(BITMAPINFOHEADER), self.width, -self.height, 1, 32, BI_RGB,
+                                            0, 0, 0, 0, 0)
+
+    def grab_into(self, out):
+        """
+        :param out: C-contiguous uint8 array of shape (height, width, 4) receiving the screen as BGRA
+        """
+        self.gdi32.BitBlt(self.memory_dc, 0, 0, self.width, self.height, self.screen_dc, 0, 0, SRCCOPY | CAPTUREBLT)
+        self.gdi32.GetDIBits(self.memory_dc, self.bitmap, 0, self.height, out.ctypes.data,
+                             ctypes.byref(self.bitmap_info), DIB_RGB_COLORS)
+
+    def close(self):
+        self.gdi32.DeleteObject(self.bitmap)
+        self.gdi32.DeleteDC(self.memory_dc)
+        self.user32.ReleaseDC(None, self.screen_dc)
@@ -0,0 +1,192 @@
+import zlib
+from argparse import ArgumentParser
+from time import perf_counter
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+DIGITS = "0123456789"
+# Every glyph is resized to this (height, width) before it is compared with the templates
+GLYPH_SHAPE = (16, 10)
+DEFAULT_TEMPLATES = "custom-weights/digit_templates.npz"
+
+
+def to_gray(region):
+    """
+    :param region: Numpy array (RGB or grayscale) of the cropped region
+    :return: Float32 grayscale array
+    """
+    region = np.asarray(region)
+    if region.ndim == 3:
+        return region[..., :3] @ np.array([0.299, 0.587, 0.114], dtype=np.float32)
+    return region.astype(np.float32)
+
+
+def segment_glyphs(gray, min_contrast=40):
+    """
+    Splits bright text on a dark background into glyphs, one per run of columns containing text
+    :param gray: Grayscale array of the region
+    :param min_contrast: Minimum difference between the brightest and darkest pixel for the region to contain text
+    :return: List of boolean arrays, each cropped tightly to one glyph
+    """
+    if gray.size == 0 or gray.max() - gray.min() < min_contrast:
+        return []
+    mask = gray > (gray.max() + gray.min()) / 2
+    columns = np.flatnonzero(mask.any(axis=0))
+    if len(columns) == 0:
+        return []
+    # Split the text columns wherever a column without text separates them
+    breaks = np.flatnonzero(np.diff(columns) > 1)
+    starts = np.concatenate([[columns[0]], columns[breaks + 1]])
+    ends = np.concatenate([columns[breaks], [columns[-1]]]) + 1
+    glyphs = []
+    for start, end in zip(starts, ends):
+        glyph = mask[:, start:end]
+        rows = np.flatnonzero(glyph.any(axis=1))
+        glyphs.append(glyph[rows[0]:rows[-1] + 1])
+    return glyphs
+
+
+def normalize_glyphs(glyphs, shape=GLYPH_SHAPE):
+    """
+    Resizes the glyphs to the same shape and normalizes them so a dot product is their correlation
+    :param glyphs: List of boolean glyph arrays
+    :param shape: (height, width) to resize to
+    :return: Float32 array of shape (len(glyphs), height * width)
+    """
+    normalized = np.zeros((len(glyphs), shape[0] * shape[1]), dtype=np.float32)
+    for i, glyph in enumerate(glyphs):
+        # Nearest neighbour resize with index arrays
+        rows = np.arange(shape[0]) * glyph.shape[0] // shape[0]
+        cols = np.arange(shape[1]) * glyph.shape[1] // shape[1]
+        normalized[i] = glyph[rows[:, None], cols[None, :]].ravel()
+    normalized -= normalized.mean(axis=1, keepdims=True)
+    norms = np.linalg.norm(normalized, axis=1, keepdims=True)
+    return normalized / np.maximum(norms, 1e-6)
+
+
+def build_templates_from_crop(region, digits):
+    """
+    Extracts the templates from a screenshot crop of known digits, e.g. a crop of the stats panel reading 0123456789
+    :param region: Numpy array of the crop
+    :param digits: The digits shown in the crop, in order
+    :return: Float32 array of shape (10, height * width), the average glyph of each digit
+    """
+    glyphs = segment_glyphs(to_gray(region))
+    if len(glyphs) != len(digits):
+        raise ValueError(f"Found {len(glyphs)} glyphs in the crop but {len(digits)} digits were given")
+    normalized = normalize_glyphs(glyphs)
+    templates = np.zeros((len(DIGITS), normalized.shape[1]), dtype=np.float32)
+    for i, digit in enumerate(DIGITS):
+        matches = [j for j, d in enumerate(digits) if d == digit]
+        if len(matches) == 0:
+            raise ValueError(f"The crop does not contain the digit {digit}")
+        templates[i] = normalized[matches].mean(axis=0)
+    return templates
+
+
+def build_templates_from_font(font_path=None, size=20):
+    """
+    Renders the templates from the game font
+    :param font_path: TrueType font file, None for PIL's default font
+    :param size: Font size in pixels
+    :return: Float32 array of shape (10, height * width)
+    """
+    font = ImageFont.truetype(font_path, size) if font_path is not None else ImageFont.load_default()
+    image = Image.new("L", (size * 2 * len(DIGITS), size * 2), 0)
+    # Spaces keep the rendered digits from touching
+    ImageDraw.Draw(image).text((size // 2, size // 2), " ".join(DIGITS), fill=255, font=font)
+    return build_templates_from_crop(np.asarray(image), DIGITS)
+
+
+def save_templates(path, templates):
+    np.savez(path, templates=templates, shape=np.array(GLYPH_SHAPE))
+
+
+def load_templates(path):
+    """
+    :param path: File written by save_templates
+    :return: Float32 array of shape (10, height * width)
+    """
+    with np.load(path) as data:
+        if tuple(data["shape"]) != GLYPH_SHAPE:
+            raise ValueError(f"{path} was built for glyphs of shape {tuple(data['shape'])}, expected {GLYPH_SHAPE}")
+        return data["templates"].astype(np.float32)
+
+
+class DigitReader:
+    """
+    Reads an integer from a screen region by matching its glyphs against digit templates, without leaving the process
+    """
+
+    def __init__(self, templates, min_score=0.6):
+        """
+        :param templates: Result of build_templates_from_crop, build_templates_from_font or load_templates
+        :param min_score: Minimum correlation of every glyph with its best template, otherwise the read fails
+        """
+        self.templates = templates
+        self.min_score = min_score
+        self.last_hash = None
+        self.last_value = -1
+        self.last_latency = 0.0
+        self.reads = 0
+        self.cache_hits = 0
+
+    def match(self, region):
+        """
+        :param region: Numpy array of the cropped region
+        :return: The integer shown in the region, or -1 if it could not be read
+        """
+        glyphs = segment_glyphs(to_gray(region))
+        if len(glyphs) == 0:
+            return -1
+        # Correlation of every glyph with every template in one matrix product
+        scores = normalize_glyphs(glyphs) @ self.templates.T
+        best = scores.argmax(axis=1)
+        if scores[np.arange(len(best)), best].min() < self.min_score:
+            return -1
+        return int("".join(DIGITS[i] for i in best))
+
+    def read(self, frame_arr, bbox):
+        """
+        Reads the integer in the region, reusing the last result while the region's pixels do not change
+        :param frame_arr: Numpy array of the frame
+        :param bbox: [x0, y0, x1, y1] of the region
+        :return: The integer shown in the region, or -1 if it could not be read
+        """
+        s = perf_counter()
+        region = np.ascontiguousarray(frame_arr[bbox[1]:bbox[3], bbox[0]:bbox[2]])
+        region_hash = (region.shape, zlib.crc32(region))
+        self.reads += 1
+        if region_hash == self.last_hash:
+            self.cache_hits += 1
+        else:
+            self.last_value = self.match(region)
+            self.last_hash = region_hash
+        self.last_latency = perf_counter() - s
+        return self.last_value
+
+    def reset(self):
+        """
+        Forgets the last region so the next read matches again
+        """
+        self.last_hash = None
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description="Builds the digit templates used to read the AD stat")
+    parser.add_argument("--font", default=None, help="Game font (TrueType) to render the digits with")
+    parser.add_argument("--font_size", type=int, default=20, help="Font size in pixels, close to the size on screen")
+    parser.add_argument("--crop", default=None, help="Screenshot crop of known digits to extract the templates from "
+                                                     "instead of a font")
+    parser.add_argument("--digits", default=DIGITS, help="The digits shown in the crop, in order")
+    parser.add_argument("--output", default=DEFAULT_TEMPLATES, help="Where to save the templates")
+    args = parser.parse_args()
+
+    if args.crop is not None:
+        with Image.open(args.crop) as crop:
+            templates = build_templates_from_crop(np.asarray(crop.convert("RGB")), args.digits)
+    else:
+        templates = build_templates_from_font(args.font, args.font_size)
+    save_templates(args.output, templates)
+    print(f"Saved the digit templates to {args.output}")
@@ -0,0 +1,265 @@
+from os import listdir, path, walk
+
+import numpy as np
+from PIL import Image
+
+from CaptureBuffers import FrameRing, GdiCapture, windll
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg")
+FRAME_SOURCES = ["screen", "images", "video", "synthetic"]
+
+
+def write_to_ring(source, frame_arr):
+    """
+    Copies a decoded frame into the source's preallocated ring, creating the ring on the first frame
+    :param source: Frame source with ring and ring_slots attributes
+    :param frame_arr: Numpy array of the frame
+    :return: View of the frame in the ring, or frame_arr itself if the source does not use a ring
+    """
+    if source.ring_slots <= 0:
+        return frame_arr
+    if source.ring is None:
+        source.ring = FrameRing(*frame_arr.shape, slots=source.ring_slots)
+    if frame_arr.shape != source.ring.shape:
+        return frame_arr
+    return source.ring.write(frame_arr)
+
+
+def release_to_ring(source, frame_arr):
+    """
+    Hands a frame's buffer back to the source's ring, call it once every stage is done with the frame
+    :param source: Frame source with a ring attribute
+    :param frame_arr: Frame returned by the source's read()
+    """
+    if source.ring is not None:
+        source.ring.release(frame_arr)
+
+
+class ScreenSource:
+    """
+    Grabs frames from the live desktop
+    """
+
+    def __init__(self, ring_slots=0):
+        """
+        :param ring_slots: Capture into a preallocated ring of this many shared memory buffers, 0 to allocate a new
+                           array per frame
+        """
+        from PIL import ImageGrab
+        self.grab = ImageGrab.grab
+        self.ring_slots = ring_slots
+        self.ring = None
+        self.gdi = None
+        if ring_slots > 0 and windll is not None:
+            # GDI writes the screen straight into the ring, so there is no per-frame allocation or copy in Python
+            self.gdi = GdiCapture()
+            self.ring = FrameRing(self.gdi.height, self.gdi.width, 4, ring_slots)
+
+    def read(self):
+        """
+        :return: Numpy array (RGB) of the current screen
+        """
+        if self.gdi is not None:
+            slot = self.ring.next_slot()
+            if slot is None:
+                # Every buffer is still in use, capture into a new array instead of overwriting one
+                slot = np.empty(self.ring.shape, dtype=np.uint8)
+            self.gdi.grab_into(slot)
+            # View the BGRA buffer as RGB without copying it
+            return slot[..., 2::-1]
+        if self.ring_slots > 0:
+            return write_to_ring(self, np.asarray(self.grab()))
+        return np.array(self.grab())
+
+    def release(self, frame_arr):
+        release_to_ring(self, frame_arr)
+
+    def close(self):
+        if self.gdi is not None:
+            self.gdi.close()
+        if self.ring is not None:
+            self.ring.close()
+
+
+class ImageDirectorySource:
+    """
+    Replays a directory of PNG/JPEG frames in sorted order
+    """
+
+    def __init__(self, image_dir, loop=False, ring_slots=0):
+        """
+        :param image_dir: Directory containing the frames, or a list of directories replayed one after another
+        :param loop: Start over from the first frame after the last one
+        :param ring_slots: Hand out frames from a preallocated ring of this many shared memory buffers
+        """
+        image_dirs = [image_dir] if isinstance(image_dir, str) else image_dir
+        self.image_paths = [path.join(d, f) for d in image_dirs for f in sorted(listdir(d))
+                            if f.lower().endswith(IMAGE_EXTENSIONS)]
+        if len(self.image_paths) == 0:
+            raise ValueError(f"No frames found in {image_dir}")
+        self.loop = loop
+        self.index = 0
+        self.current_path = None
+        self.ring_slots = ring_slots
+        self.ring = None
+
+    def read(self):
+        """
+        :return: Numpy array of the next frame, or None once the directory is exhausted
+        """
+        if self.index >= len(self.image_paths):
+            if not self.loop:
+                return None
+            self.index = 0
+        self.current_path = self.image_paths[self.index]
+        self.index += 1
+        with Image.open(self.current_path) as frame:
+            return write_to_ring(self, np.asarray(frame.convert("RGB")))
+
+    def release(self, frame_arr):
+        release_to_ring(self, frame_arr)
+
+    def close(self):
+        if self.ring is not None:
+            self.ring.close()
+
+
+class VideoSource:
+    """
+    Decodes a video file as a stream of frames
+    """
+
+    def __init__(self, video_path, loop=False, ring_slots=0):
+        """
+        :param video_path: Path to the video file
+        :param loop: Seek back to the start once the video ends
+        :param ring_slots: Decode straight into a preallocated ring of this many shared memory buffers
+        """
+        import cv2
+        self.cv2 = cv2
+        self.capture = cv2.VideoCapture(video_path)
+        if not self.capture.isOpened():
+            raise ValueError(f"Error opening video stream {video_path}")
+        self.loop = loop
+        self.ring = None
+        if ring_slots > 0:
+            self.ring = FrameRing(int(self.capture.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+                                  int(self.capture.get(cv2.CAP_PROP_FRAME_WIDTH)), 3, ring_slots)
+
+    def read(self):
+        """
+        :return: Numpy array (RGB) of the next frame, or None once the video ends
+        """
+        slot = self.ring.next_slot() if self.ring is not None else None
+        ret, frame = self.capture.read(slot)
+        if not ret and self.loop:
+            self.capture.set(self.cv2.CAP_PROP_POS_FRAMES, 0)
+            ret, frame = self.capture.read(slot)
+        if not ret:
+            return None
+        if slot is not None and frame is not None and frame.ctypes.data == slot.ctypes.data:
+            # Decoded in place, view the BGR buffer as RGB without copying it
+            return slot[..., ::-1]
+        return self.cv2.cvtColor(frame, self.cv2.COLOR_BGR2RGB)
+
+    def release(self, frame_arr):
+        release_to_ring(self, frame_arr)
+
+    def close(self):
+        self.capture.release()
+        if self.ring is not None:
+            self.ring.close()
+
+
+class SyntheticSource(ImageDirectorySource):
+    """
+    Replays a dataset generated by dataset/generate_dataset/bootstrap.py along with its known minion positions
+    """
+
+    def __init__(self, dataset_dir, loop=False, ring_slots=0):
+        """
+        :param dataset_dir: bootstrap.py output directory, containing the images and labels subdirectories directly or
+                            in one shard directory each (e.g. shard_000/images)
+        :param loop: Start over from the first frame after the last one
+        :param ring_slots: Hand out frames from a preallocated ring of this many shared memory buffers
+        """
+        image_dirs = dataset_image_dirs(dataset_dir)
+        if len(image_dirs) == 0:
+            raise ValueError(f"No images and labels directories found in {dataset_dir}, packed shards have to be "
+                             f"unpacked with packed_dataset.py first")
+        super().__init__(image_dirs, loop, ring_slots)
+        self.frame_shape = None
+
+    def read(self):
+        frame_arr = super().read()
+        if frame_arr is not None:
+            self.frame_shape = frame_arr.shape
+        return frame_arr
+
+    def labels(self):
+        """
+        Reads the labels of the last frame returned by read
+        :return: List of [x0, y0, w, h, label] in pixels, the same layout the main loop uses for minions
+        """
+        fname = path.splitext(path.basename(self.current_path))[0]
+        labels_dir = path.join(path.dirname(path.dirname(self.current_path)), "labels")
+        return read_labels(path.join(labels_dir, fname + ".txt"), self.frame_shape[1], self.frame_shape[0])
+
+
+def dataset_image_dirs(dataset_dir):
+    """
+    :param dataset_dir: bootstrap.py output directory
+    :return: Sorted paths of every images directory next to a labels directory, the dataset_dir's own or its shards'
+    """
+    image_dirs = []
+    for dir_path, dir_names, _ in walk(dataset_dir):
+        dir_names.sort()
+        if "images" in dir_names and "labels" in dir_names:
+            image_dirs.append(path.join(dir_path, "images"))
+            dir_names[:] = [d for d in dir_names if d not in ("images", "labels")]
+    return image_dirs
+
+
+def read_labels(labels_path, image_w, image_h):
+    """
+    Reads a darknet/YOLO labels file
+    :param labels_path: Path to the labels txt file
+    :param image_w: Width of the labelled image
+    :param image_h: Height of the labelled image
+    :return: List of [x0, y0, w, h, label] in pixels
+    """
+    minion_pos_list = []
+    if not path.exists(labels_path):
+        return minion_pos_list
+    with open(labels_path) as f:
+        for line in f:
+            values = line.split()
+            if len(values) != 5:
+                continue
+            label = int(values[0])
+            x_center, y_center = float(values[1]) * image_w, float(values[2]) * image_h
+            w, h = float(values[3]) * image_w, float(values[4]) * image_h
+            minion_pos_list.append([x_center - w / 2, y_center - h / 2, w, h, label])
+    return minion_pos_list
+
+
+def create_frame_source(source, source_path=None, loop=False, ring_slots=0):
+    """
+    Creates the frame source selected on the command line
+    :param source: One of FRAME_SOURCES
+    :param source_path: Directory or file to read the frames from (unused for the screen)
+    :param loop: Replay file based sources forever
+    :param ring_slots: Capture into a preallocated ring of this many shared memory buffers, 0 to allocate per frame
+    :return: Frame source with read(), release() and close()
+    """
+    if source == "screen":
+        return ScreenSource(ring_slots)
+    if source_path is None:
+        raise ValueError(f"The {source} frame source needs a path")
+    if source == "images":
+        return ImageDirectorySource(source_path, loop, ring_slots)
+    if source == "video":
+        return VideoSource(source_path, loop, ring_slots)
+    if source == "synthetic":
+        return SyntheticSource(source_path, loop, ring_slots)
+    raise ValueError(f"Unknown frame source {source}")
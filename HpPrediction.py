@@ -0,0 +1,105 @@
+class HpHistory:
+    """
+    Fixed-size ring buffer of a minion's HP pixel counts over time
+    """
+
+    def __init__(self, size):
+        """
+        :param size: Number of HP readings to keep, the damage rate is measured over this window
+        """
+        self.size = max(2, size)
+        self.times = [0.0] * self.size
+        self.hp_counts = [0] * self.size
+        self.index = 0
+        self.count = 0
+
+    def add(self, t, hp_pixel_count):
+        """
+        Adds an HP reading, overwriting the oldest one once the buffer is full
+        :param t: Time of the reading in seconds
+        :param hp_pixel_count: HP pixel count of the minion
+        """
+        self.times[self.index] = t
+        self.hp_counts[self.index] = hp_pixel_count
+        self.index = (self.index + 1) % self.size
+        self.count = min(self.count + 1, self.size)
+
+    def newest(self):
+        """
+        :return: (time, HP pixel count) of the newest reading
+        """
+        i = (self.index - 1) % self.size
+        return self.times[i], self.hp_counts[i]
+
+    def oldest(self):
+        """
+        :return: (time, HP pixel count) of the oldest reading still in the buffer
+        """
+        i = (self.index - self.count) % self.size
+        return self.times[i], self.hp_counts[i]
+
+    def damage_rate(self):
+        """
+        :return: HP pixels lost per second over the buffered window, 0 if the minion is not losing HP
+        """
+        if self.count < 2:
+            return 0.0
+        t0, hp0 = self.oldest()
+        t1, hp1 = self.newest()
+        if t1 <= t0:
+            return 0.0
+        return max(0.0, (hp0 - hp1) / (t1 - t0))
+
+    def predicted_hp(self, t):
+        """
+        :param t: Time in seconds to predict the HP for
+        :return: Expected HP pixel count at that time if the damage rate holds
+        """
+        t1, hp1 = self.newest()
+        return hp1 - self.damage_rate() * (t - t1)
+
+
+class HpPredictor:
+    """
+    Keeps an HP history per tracked minion and flags minions that will reach their threshold soon
+    """
+
+    def __init__(self, lead_time, history_size=8):
+        """
+        :param lead_time: Seconds ahead of the threshold crossing to flag a minion
+        :param history_size: Number of HP readings kept per minion
+        """
+        self.lead_time = lead_time
+        self.history_size = history_size
+        self.histories = {}
+
+    def update(self, tracks, hp_counts, t):
+        """
+        Adds this frame's HP readings and forgets minions that are no longer tracked
+        :param tracks: Tracks of the minions on this frame
+        :param hp_counts: HP pixel count of each track, None where the HP bar was not found
+        :param t: Time of the frame in seconds
+        """
+        for track, hp_pixel_count in zip(tracks, hp_counts):
+            if hp_pixel_count is None:
+                continue
+            if track.track_id not in self.histories:
+                self.histories[track.track_id] = HpHistory(self.history_size)
+            self.histories[track.track_id].add(t, hp_pixel_count)
+        if len(self.histories) > 2 * len(tracks) + 16:
+            track_ids = {track.track_id for track in tracks}
+            self.histories = {track_id: history for track_id, history in self.histories.items()
+                              if track_id in track_ids}
+
+    def should_attack(self, track, minion_thresholds, t):
+        """
+        :param track: Track of the minion
+        :param minion_thresholds: From the config, [melee, caster, cannon] pixel values of when the player should
+                                  attack it
+        :param t: Time of the frame in seconds
+        :return: If the minion is at or below its threshold, or predicted to be within the lead time
+        """
+        history = self.histories.get(track.track_id)
+        if history is None:
+            return False
+        return history.predicted_hp(t + self.lead_time) <= minion_thresholds[track.minion_pos[4]]
@@ -1,10 +1,17 @@
 from CSHelperUtils import *
 import pygame
-from ctypes import windll
-from PIL import Image, ImageGrab
-import numpy as np
-from time import time
-import torch
+from FrameSources import FRAME_SOURCES, create_frame_source
+from Pipeline import start_pipeline, stop_pipeline
+from RoiInference import ROI_MODES, make_tiles, detect_minions_roi
+from MinionTracker import MinionTracker
+from HpPrediction import HpPredictor
+from ModelLoader import BACKENDS, DEFAULT_WEIGHTS, load_model
+from OnnxBackend import QUANTIZATION_MODES
+from DigitReader import DigitReader, load_templates
+from Metrics import Metrics, MetricsReporter, SamplingProfiler, install_profiler_signal
+from Scheduler import AdaptiveScheduler, build_ladder
+from queue import Empty
+from time import perf_counter, perf_counter_ns
 from argparse import ArgumentParser
 
 if __name__ == '__main__':
@@ -13,69 +20,337 @@ if __name__ == '__main__':
     parser.add_argument("--print_times",
                         default=False,
                         action="store_true",
-                        help="Prints how long each phase took in a frame")
+                        help="Prints the p50/p95/p99 of how long each phase took every --metrics_interval seconds")
+    parser.add_argument("--metrics_file",
+                        default=None,
+                        help="Writes the per-stage latency percentiles to this file every --metrics_interval seconds, "
+                             "as JSON if it ends with .json and as a text table otherwise")
+    parser.add_argument("--metrics_port",
+                        default=None,
+                        type=int,
+                        help="Serves the per-stage latency percentiles on http://127.0.0.1:<port>/metrics")
+    parser.add_argument("--metrics_interval",
+                        default=5.0,
+                        type=float,
+                        help="Seconds between two metrics reports")
+    parser.add_argument("--metrics_window",
+                        default=1000,
+                        type=int,
+                        help="Number of latest frames per stage the percentiles are measured over")
+    parser.add_argument("--profile_seconds",
+                        default=10.0,
+                        type=float,
+                        help="Samples every thread's stack for this many seconds when F9 is pressed in the overlay or "
+                             "on SIGUSR1 (Ctrl+Break on Windows), and writes the profile to --profile_dir")
+    parser.add_argument("--profile_dir",
+                        default="profiles",
+                        help="Directory the profiles are written to")
     parser.add_argument("--debug_display",
                         default=False,
                         action="store_true",
                         help="Shows all minions regardless of HP")
+    parser.add_argument("--source",
+                        default="screen",
+                        choices=FRAME_SOURCES,
+                        help="Where to read frames from: the live screen, a directory of PNG/JPEG frames, "
+                             "a video file, or a bootstrap.py dataset directory")
+    parser.add_argument("--source_path",
+                        default=None,
+                        help="Directory or file for the images, video and synthetic sources")
+    parser.add_argument("--loop",
+                        default=False,
+                        action="store_true",
+                        help="Replay file based sources forever instead of exiting at the end")
+    parser.add_argument("--uncapped",
+                        default=False,
+                        action="store_true",
+                        help="Ignores the fps_cap from the config, useful to measure throughput on recorded frames")
+    parser.add_argument("--pipelined",
+                        default=False,
+                        action="store_true",
+                        help="Runs capture and inference on their own threads, overlapping them with HP analysis "
+                             "and drawing")
+    parser.add_argument("--queue_depth",
+                        default=1,
+                        type=int,
+                        help="Number of frames that can wait between two pipelined stages")
+    parser.add_argument("--latest_frame_only",
+                        default=False,
+                        action="store_true",
+                        help="Drops stale frames in the pipelined mode so every stage works on the newest frame")
+    parser.add_argument("--roi",
+                        default="off",
+                        choices=ROI_MODES,
+                        help="Runs the model on only the playable area: 'mask' blacks out the UI, 'tile' also splits "
+                             "the playable area into tiles at the model's input size")
+    parser.add_argument("--tile_size",
+                        default=640,
+                        type=int,
+                        help="Tile width and height for --roi tile, ideally the model's input size")
+    parser.add_argument("--tile_overlap",
+                        default=100,
+                        type=int,
+                        help="Pixels shared by neighboring tiles, should be larger than a minion")
+    parser.add_argument("--detect_every",
+                        default=1,
+                        type=int,
+                        help="Runs the model only every N frames and tracks the minions in between, reading just "
+                             "their HP bars (serial loop only)")
+    parser.add_argument("--lead_time",
+                        default=None,
+                        type=float,
+                        help="Tracks each minion's HP over time and also shows minions predicted to reach their "
+                             "threshold within this many seconds (serial loop only)")
+    parser.add_argument("--hp_history",
+                        default=8,
+                        type=int,
+                        help="Number of HP readings per minion used to estimate its damage rate with --lead_time")
+    parser.add_argument("--budget_ms",
+                        default=None,
+                        type=float,
+                        help="Adapts the model input size, how often the model runs and how often the HP bars are "
+                             "read to keep the frame time within this many milliseconds, e.g. 1000 / fps_cap "
+                             "(serial loop only)")
+    parser.add_argument("--min_img_size",
+                        default=320,
+                        type=int,
+                        help="Smallest model input size the scheduler may use with --budget_ms (torch backend "
+                             "without --roi tile only, the other backends have a fixed input size)")
+    parser.add_argument("--max_detect_every",
+                        default=4,
+                        type=int,
+                        help="Longest detection cadence in frames the scheduler may use with --budget_ms")
+    parser.add_argument("--max_hp_every",
+                        default=3,
+                        type=int,
+                        help="Longest HP analysis cadence in frames the scheduler may use with --budget_ms")
+    parser.add_argument("--scheduler_log",
+                        default=None,
+                        help="Appends every scheduler decision to this file as a JSON line")
+    parser.add_argument("--weights",
+                        default=DEFAULT_WEIGHTS,
+                        help="Path to the model weights")
+    parser.add_argument("--img_size",
+                        default=640,
+                        type=int,
+                        help="Length of the longer side of the model input")
+    parser.add_argument("--backend",
+                        default="torch",
+                        choices=BACKENDS,
+                        help="Runs the model eagerly in PyTorch, as a cached TorchScript trace, or through "
+                             "onnxruntime on the CPU")
+    parser.add_argument("--quantize",
+                        default="none",
+                        choices=QUANTIZATION_MODES,
+                        help="INT8 quantization for the onnx backend")
+    parser.add_argument("--calibration_dir",
+                        default=None,
+                        help="Directory of frames (e.g. bootstrap.py's output/images) for static quantization")
+    parser.add_argument("--hub_dir",
+                        default=None,
+                        help="Local yolov5 repo to load the model code from, defaults to torch.hub's cached copy. "
+                             "The model code is never downloaded, one of the two must exist")
+    parser.add_argument("--capture_ring",
+                        default=False,
+                        action="store_true",
+                        help="Captures into a preallocated ring of shared memory frame buffers instead of allocating "
+                             "new arrays every frame")
+    parser.add_argument("--headless",
+                        default=False,
+                        action="store_true",
+                        help="Draws the overlay on an off-screen surface instead of a window")
+    parser.add_argument("--ad_templates",
+                        default=None,
+                        help="Digit templates built by DigitReader.py, reads the AD stat every frame without "
+                             "Tesseract")
     args = parser.parse_args()
 
     # Load data and overlay
     print("Loading config...")
-    screen_width, screen_height, fps_cap, ui_list, ad_bbox, ad_rect, \
-        hp_lower, hp_upper, hp_bar_length, minion_thresholds, hp_search_padding = load_config()
-    screen, hwnd = init_overlay(screen_width, screen_height)
+    # config.ini is reloaded between frames when it changes, the screen size only applies at startup
+    config_watcher = ConfigWatcher()
+    config = config_watcher.config
+    screen_width, screen_height = config.screen_width, config.screen_height
+    screen, hwnd = init_overlay(screen_width, screen_height, args.headless)
     fps_clock = pygame.time.Clock()
+    # Every frame waiting in a queue or being worked on by a stage needs its own buffer
+    ring_slots = 2 * args.queue_depth + 3 if args.capture_ring else 0
+    frame_source = create_frame_source(args.source, args.source_path, args.loop, ring_slots)
     print("Loading model...")
-    model = torch.hub.load('ultralytics/yolov5', 'custom', path="custom-weights/10kv2.pt")
-    model.eval()
-
-    while True:
-        t = time()
-        for event in pygame.event.get():
-            windll.user32.SetFocus(hwnd)  # Brings window back to focus if any key or mouse button is pressed.
-
-        # Take screenshot
-        s = time()
-        frame = ImageGrab.grab()
-        frame_arr = np.array(frame)
-        if args.print_times:
-            print(f"Screenshot took: {time() - s}")
-
-        # Run model on screenshot
-        s = time()
-        results = model(frame_arr)
-        all_detected_objs = results.xyxy[0].cpu().numpy()
-        minion_pos_list = []
-        for detected_obj in all_detected_objs:
-            w = detected_obj[2] - detected_obj[0]
-            h = detected_obj[3] - detected_obj[1]
-            pos = [detected_obj[0], detected_obj[1], w, h, int(detected_obj[5])]
-            if detected_obj[4] > .6 and w > 50 and h > 50 and not in_ui(pos, ui_list):
-                minion_pos_list.append(pos)
-        if args.print_times:
-            print(f"Model took: {time() - s}")
-
-        # Determine if the found minions are below the threshold
-        display_minions = []
-        if args.debug_display:
-            display_minions = minion_pos_list
-        else:
-            s = time()
-            for minion_pos in minion_pos_list:
-                if below_threshold(minion_pos, frame_arr, hp_search_padding,
-                                   hp_lower, hp_upper, hp_bar_length, minion_thresholds):
-                    display_minions.append(minion_pos)
-            if args.print_times:
-                print(f"Determining thresholds took: {time() - s}")
-
-        # Draw the rectangles
-        s = time()
-        draw_rects(screen, display_minions, (0, 255, 0), 1)
-        if args.print_times:
-            print(f"Drawing took: {time() - s}")
-
-        if args.print_times:
-            print(f"Total time: {time() - t}")
-            print("-"*30)
-        fps_clock.tick(fps_cap)
+    model_width, model_height, model_size = screen_width, screen_height, args.img_size
+    if args.roi == "tile" and args.backend != "torch":
+        # Fixed shape backends ignore the size of each call, so build them for the tiles instead of the whole screen
+        model_width = model_height = model_size = args.tile_size
+    model, startup_times = load_model(args.weights, model_width, model_height, model_size, args.backend,
+                                      hub_dir=args.hub_dir, quantization=args.quantize,
+                                      calibration_dir=args.calibration_dir)
+    print(f"Importing torch took: {startup_times['import']}")
+    print(f"Loading the model took: {startup_times['load']}")
+    print(f"Warming up the model took: {startup_times['warmup']}")
+
+    # (frame width, frame height, ui_list) the tiles were made for, and the tiles
+    tiles = None
+
+    # Stage latencies are always recorded, they are only formatted and written by the reporter's thread
+    metrics = Metrics(args.metrics_window)
+    reporter = None
+    if args.print_times or args.metrics_file is not None or args.metrics_port is not None:
+        reporter = MetricsReporter(metrics, args.metrics_interval, args.metrics_file, args.metrics_port,
+                                   args.print_times).start()
+    profiler = SamplingProfiler(args.profile_seconds, output_dir=args.profile_dir)
+    profiler_signal = install_profiler_signal(profiler)
+    triggers = ([] if args.headless else ["press F9 in the overlay"]) + \
+        ([f"send {profiler_signal}"] if profiler_signal else [])
+    if len(triggers) > 0:
+        print(f"To profile for {args.profile_seconds}s, {' or '.join(triggers)}")
+
+    scheduler = None
+    if args.budget_ms is not None and not args.pipelined:
+        # Only the eager model resizes its input per call, the other backends are built for one input shape
+        min_img_size = args.min_img_size if args.backend == "torch" and args.roi != "tile" else args.img_size
+        ladder = build_ladder(args.img_size, min_img_size, detect_every=args.detect_every,
+                              max_detect_every=args.max_detect_every, max_hp_every=args.max_hp_every)
+        scheduler = AdaptiveScheduler(args.budget_ms, ladder, log_path=args.scheduler_log)
+        print(f"Scheduling {len(ladder)} levels to stay within {args.budget_ms}ms per frame")
+    elif args.budget_ms is not None:
+        print("--budget_ms only applies to the serial loop, ignoring it")
+
+    def detect(frame_arr):
+        global tiles
+        # Reads config and tiles once, so a reload in between cannot mix two configs in one frame
+        current_config, current_tiles = config, None
+        if args.roi == "tile":
+            # The tiles follow the frames actually captured, which may not match the screen size in the config
+            tiles_key = (frame_arr.shape[1], frame_arr.shape[0], current_config.ui_list)
+            if tiles is None or tiles[0] != tiles_key:
+                if tiles_key[:2] != (screen_width, screen_height):
+                    print(f"The frames are {tiles_key[0]}x{tiles_key[1]} but the config's screen size is "
+                          f"{screen_width}x{screen_height}, the tiles are made for the frames")
+                tiles = (tiles_key, make_tiles(tiles_key[0], tiles_key[1], args.tile_size, args.tile_overlap,
+                                               current_config.ui_list))
+                print(f"Running the model on {len(tiles[1])} tiles")
+            current_tiles = tiles[1]
+        # The eager model defaults to 640 without a size, the fixed-shape backends ignore it
+        size = scheduler.img_size if scheduler is not None else args.img_size
+        if args.roi == "off":
+            return detect_minions(model, frame_arr, current_config.ui_boxes, metrics, size)
+        return detect_minions_roi(model, frame_arr, current_config.ui_list, args.roi, current_tiles, args.tile_size,
+                                  metrics=metrics, size=size)
+
+    ad_reader = None
+    if args.ad_templates is not None:
+        ad_reader = DigitReader(load_templates(args.ad_templates))
+
+    tracker = None
+    hp_predictor = None
+    if not args.pipelined and (args.detect_every > 1 or args.lead_time is not None or scheduler is not None):
+        tracker = MinionTracker(args.detect_every)
+    # Last HP reading of every tracked minion, reused on the frames the scheduler skips the HP analysis on
+    last_hp_counts = {}
+    if tracker is not None and args.lead_time is not None:
+        hp_predictor = HpPredictor(args.lead_time, args.hp_history)
+
+    if args.pipelined:
+        frame_queue, detection_queue, stop_event, workers = start_pipeline(frame_source, detect, args.queue_depth,
+                                                                           args.latest_frame_only, metrics)
+
+    try:
+        while True:
+            t = perf_counter_ns()
+            # detect remakes the tiles if the UI boxes changed
+            config = config_watcher.poll()
+            # The headless surface has no window, so pygame's display and its event queue are never initialized
+            for event in pygame.event.get() if not args.headless else []:
+                if event.type == pygame.KEYDOWN and event.key == pygame.K_F9:
+                    profiler.request()
+                if hwnd is not None:
+                    windll.user32.SetFocus(hwnd)  # Brings window back to focus if any key or mouse button is pressed.
+
+            if args.pipelined:
+                # Capture and model already ran on the worker threads, take the newest result
+                try:
+                    detected = detection_queue.get(timeout=1 / config.fps_cap)
+                except Empty:
+                    continue
+                if detected is None:
+                    break
+                frame_arr, minion_pos_list = detected
+            else:
+                # Take screenshot
+                with metrics.time("capture"):
+                    frame_arr = frame_source.read()
+                if frame_arr is None:
+                    break
+
+                # Run model on screenshot, or move the tracked minions if this is not a keyframe
+                if scheduler is not None:
+                    tracker.detect_every = scheduler.detect_every
+                keyframe = tracker is None or tracker.needs_detection()
+                if keyframe:
+                    minion_pos_list = detect(frame_arr)
+                    if tracker is not None:
+                        with metrics.time("tracking"):
+                            tracks = tracker.update(minion_pos_list)
+                else:
+                    with metrics.time("tracking"):
+                        tracks, minion_pos_list = tracker.predict()
+
+            if ad_reader is not None:
+                with metrics.time("read_numbers"):
+                    ad = read_numbers(frame_arr, config.ad_bbox, ad_reader)
+                metrics.set_counter("ad", ad)
+
+            # Determine if the found minions are below the threshold
+            display_minions = []
+            if args.debug_display:
+                display_minions = minion_pos_list
+            else:
+                hp_start = perf_counter_ns()
+                hp_read = scheduler is None or scheduler.run_hp_analysis()
+                if hp_read:
+                    hp_counts = minions_hp_counts(minion_pos_list, frame_arr, config.hp_search_padding,
+                                                  config.hp_lower, config.hp_upper, config.hp_bar_length)
+                    if scheduler is not None:
+                        last_hp_counts = {track.track_id: hp_count for track, hp_count in zip(tracks, hp_counts)}
+                else:
+                    # The boxes still follow the tracker, only their HP readings are from an earlier frame
+                    hp_counts = [last_hp_counts.get(track.track_id) for track in tracks]
+                if hp_predictor is not None:
+                    # Also show minions whose HP is predicted to reach the threshold within the lead time
+                    now = perf_counter()
+                    if hp_read:
+                        hp_predictor.update(tracks, hp_counts, now)
+                    display_minions = [minion_pos for minion_pos, track in zip(minion_pos_list, tracks)
+                                       if hp_predictor.should_attack(track, config.minion_thresholds, now)]
+                else:
+                    # Check if the HP pixels are at or below threshold (means the player should attack minion)
+                    display_minions = [minion_pos for minion_pos, hp_pixel_count in zip(minion_pos_list, hp_counts)
+                                       if hp_pixel_count is not None and
+                                       hp_pixel_count <= config.minion_thresholds[minion_pos[4]]]
+                if tracker is not None and not keyframe and hp_read and None in hp_counts:
+                    # A tracked minion's HP bar is gone, so its predicted position can no longer be trusted
+                    tracker.mark_lost()
+                metrics.record("hp_analysis", perf_counter_ns() - hp_start)
+
+            # Draw the rectangles
+            with metrics.time("drawing"):
+                draw_rects(screen, display_minions, (0, 255, 0), 1)
+
+            # Every stage is done with the frame, its capture buffer can be reused
+            frame_source.release(frame_arr)
+            frame_ns = perf_counter_ns() - t
+            metrics.record("frame", frame_ns)
+            if scheduler is not None and scheduler.observe(frame_ns):
+                metrics.set_counter("scheduler_level", scheduler.level)
+            if args.pipelined:
+                metrics.set_counter("dropped_frames", frame_queue.dropped + detection_queue.dropped)
+            if args.uncapped:
+                fps_clock.tick()
+            else:
+                fps_clock.tick(config.fps_cap)
+    finally:
+        if args.pipelined:
+            stop_pipeline(stop_event, workers)
+        frame_source.close()
+        if reporter is not None:
+            reporter.stop()
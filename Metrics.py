@@ -0,0 +1,369 @@
+import json
+import os
+import signal
+import sys
+import threading
+from collections import Counter
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import perf_counter_ns, sleep
+
+import numpy as np
+
+# Stages timed by the main loop and the pipeline workers, in the order they run in a frame
+STAGES = ["capture", "inference", "post_filter", "tracking", "read_numbers", "hp_analysis", "drawing", "frame"]
+QUANTILES = [50, 95, 99]
+
+
+class RollingHistogram:
+    """
+    Fixed-size ring buffer of the latest latencies of one stage, the percentiles are only computed when reported
+    """
+
+    def __init__(self, size):
+        """
+        :param size: Number of latencies to keep, the percentiles are measured over this window
+        """
+        self.size = max(1, size)
+        self.latencies = np.zeros(self.size, dtype=np.int64)
+        self.index = 0
+        self.count = 0
+        self.total = 0
+        self.lock = threading.Lock()
+
+    def add(self, ns):
+        """
+        :param ns: Latency in nanoseconds
+        """
+        with self.lock:
+            self.latencies[self.index] = ns
+            self.index = (self.index + 1) % self.size
+            self.count = min(self.count + 1, self.size)
+            self.total += 1
+
+    def summary(self):
+        """
+        :return: Dictionary with the total count and the p50/p95/p99, mean and max in milliseconds of the window
+        """
+        with self.lock:
+            window = self.latencies[:self.count].copy()
+            total = self.total
+        if len(window) == 0:
+            return {"count": total}
+        percentiles = np.percentile(window, QUANTILES) / 1e6
+        result = {"count": total}
+        result.update({f"p{q}_ms": round(float(p), 3) for q, p in zip(QUANTILES, percentiles)})
+        result["mean_ms"] = round(float(window.mean()) / 1e6, 3)
+        result["max_ms"] = round(float(window.max()) / 1e6, 3)
+        return result
+
+
+class StageTimer:
+    """
+    Context manager adding the time spent in its block to one stage
+    """
+    __slots__ = ("histogram", "start")
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+        self.start = 0
+
+    def __enter__(self):
+        self.start = perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.add(perf_counter_ns() - self.start)
+
+
+class NullTimer:
+    """
+    Stands in for StageTimer when there are no metrics to record
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+NULL_TIMER = NullTimer()
+
+
+def stage_timer(metrics, stage):
+    """
+    :param metrics: Metrics, or None to not time the stage
+    :param stage: Name of the stage
+    :return: Context manager timing its block
+    """
+    return NULL_TIMER if metrics is None else metrics.time(stage)
+
+
+class Metrics:
+    """
+    Per-stage latency histograms and counters, safe to record into from the pipeline's worker threads
+    """
+
+    def __init__(self, window=1000):
+        """
+        :param window: Number of latencies per stage the percentiles are measured over
+        """
+        self.window = window
+        self.histograms = {stage: RollingHistogram(window) for stage in STAGES}
+        self.counters = {}
+        self.lock = threading.Lock()
+        self.started = perf_counter_ns()
+
+    def histogram(self, stage):
+        histogram = self.histograms.get(stage)
+        if histogram is None:
+            with self.lock:
+                histogram = self.histograms.setdefault(stage, RollingHistogram(self.window))
+        return histogram
+
+    def time(self, stage):
+        """
+        :param stage: Name of the stage
+        :return: Context manager adding the time spent in its block to the stage
+        """
+        return StageTimer(self.histogram(stage))
+
+    def record(self, stage, ns):
+        """
+        :param stage: Name of the stage
+        :param ns: Latency in nanoseconds, measured with perf_counter_ns
+        """
+        self.histogram(stage).add(ns)
+
+    def set_counter(self, name, value):
+        self.counters[name] = value
+
+    def snapshot(self):
+        """
+        :return: Dictionary of the uptime, the summary of every stage that ran, and the counters
+        """
+        stages = {}
+        for stage, histogram in list(self.histograms.items()):
+            summary = histogram.summary()
+            if summary["count"] > 0:
+                stages[stage] = summary
+        return {"uptime_s": round((perf_counter_ns() - self.started) / 1e9, 1), "stages": stages,
+                "counters": dict(self.counters)}
+
+
+def format_text(snapshot):
+    """
+    :param snapshot: Result of Metrics.snapshot
+    :return: Plain text table of the snapshot, one stage per line
+    """
+    lines = [f"uptime {snapshot['uptime_s']}s",
+             "{:<14}{:>10}{:>10}{:>10}{:>10}{:>10}{:>10}".format("stage", "count", "p50 ms", "p95 ms", "p99 ms",
+                                                                  "mean ms", "max ms")]
+    for stage, summary in snapshot["stages"].items():
+        lines.append("{:<14}{:>10}{:>10}{:>10}{:>10}{:>10}{:>10}".format(
+            stage, summary["count"], *(summary.get(key, "-") for key in
+                                       ("p50_ms", "p95_ms", "p99_ms", "mean_ms", "max_ms"))))
+    for name, value in snapshot["counters"].items():
+        lines.append(f"{name} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def write_snapshot(path, snapshot):
+    """
+    Replaces the metrics file in one step, so a reader never sees it half written
+    :param path: JSON file if it ends with .json, plain text otherwise
+    :param snapshot: Result of Metrics.snapshot
+    """
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        if path.endswith(".json"):
+            json.dump(snapshot, f, indent=1)
+        else:
+            f.write(format_text(snapshot))
+    os.replace(tmp_path, path)
+
+
+class MetricsReporter:
+    """
+    Reports the metrics every few seconds from a background thread, so the frame loop never formats or writes them
+    """
+
+    def __init__(self, metrics, interval=5.0, path=None, port=None, print_summary=False):
+        """
+        :param metrics: Metrics to report
+        :param interval: Seconds between two reports
+        :param path: File the metrics are written to, None to not write them
+        :param port: Serves the metrics as text on http://127.0.0.1:port/metrics (JSON on /metrics.json), None to
+                     not serve them
+        :param print_summary: Also prints the metrics table
+        """
+        self.metrics = metrics
+        self.interval = interval
+        self.path = path
+        self.print_summary = print_summary
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="metrics", daemon=True)
+        self.server = None
+        if port is not None:
+            self.server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(metrics))
+            self.server.daemon_threads = True
+            threading.Thread(target=self.server.serve_forever, name="metrics-server", daemon=True).start()
+            print(f"Serving metrics on http://127.0.0.1:{self.server.server_address[1]}/metrics")
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            self.report()
+
+    def report(self):
+        snapshot = self.metrics.snapshot()
+        if self.path is not None:
+            try:
+                write_snapshot(self.path, snapshot)
+            except OSError as e:
+                print(f"Could not write the metrics to {self.path}: {e!r}")
+        if self.print_summary:
+            print(format_text(snapshot) + "-" * 30)
+
+    def stop(self):
+        """
+        Stops reporting, writing the metrics one last time
+        """
+        self.stop_event.set()
+        if self.thread.is_alive():
+            self.thread.join()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+        self.report()
+
+
+def make_handler(metrics):
+    """
+    :param metrics: Metrics to serve
+    :return: Request handler class serving the metrics snapshot
+    """
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path in ("/", "/metrics"):
+                body, content_type = format_text(metrics.snapshot()).encode(), "text/plain; charset=utf-8"
+            elif self.path == "/metrics.json":
+                body, content_type = json.dumps(metrics.snapshot()).encode(), "application/json"
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            # Requests are not worth a line on the console next to the helper's own output
+            pass
+
+    return MetricsHandler
+
+
+def frame_stack(frame, limit=64):
+    """
+    :param frame: Frame from sys._current_frames
+    :param limit: Maximum depth of the stack
+    :return: Stack as "file:function" strings, outermost call first, and the line the innermost call is on
+    """
+    line = f"{os.path.basename(frame.f_code.co_filename)}:{frame.f_code.co_name}:{frame.f_lineno}"
+    stack = []
+    while frame is not None and len(stack) < limit:
+        stack.append(f"{os.path.basename(frame.f_code.co_filename)}:{frame.f_code.co_name}")
+        frame = frame.f_back
+    return stack[::-1], line
+
+
+class SamplingProfiler:
+    """
+    Samples the stacks of every thread for a few seconds when requested, e.g. from a signal handler or hotkey
+    The profile is written in the collapsed stack format ("thread;outer;...;inner count" per line), which
+    flamegraph.pl and speedscope read, followed by the functions that were sampled most often
+    """
+
+    def __init__(self, duration=10.0, interval=0.005, output_dir="profiles"):
+        """
+        :param duration: Seconds to sample for once requested
+        :param interval: Seconds between two samples
+        :param output_dir: Directory the profiles are written to
+        """
+        self.duration = duration
+        self.interval = interval
+        self.output_dir = output_dir
+        self.requested = threading.Event()
+        self.running = False
+        self.thread = threading.Thread(target=self.run, name="profiler", daemon=True)
+        self.thread.start()
+
+    def request(self, *args):
+        """
+        Starts a profile unless one is already running, only sets an event so it is safe to call from a signal handler
+        """
+        self.requested.set()
+
+    def run(self):
+        while True:
+            self.requested.wait()
+            self.running = True
+            try:
+                path = self.profile()
+                print(f"Wrote the profile to {path}")
+            except OSError as e:
+                print(f"Could not write the profile: {e!r}")
+            self.running = False
+            self.requested.clear()
+
+    def profile(self):
+        """
+        Samples for the configured duration and writes the profile
+        :return: Path of the profile
+        """
+        print(f"Profiling for {self.duration}s...")
+        own_id = threading.get_ident()
+        stacks = Counter()
+        lines = Counter()
+        names = {}
+        samples = 0
+        end = perf_counter_ns() + int(self.duration * 1e9)
+        while perf_counter_ns() < end:
+            names.update((thread.ident, thread.name) for thread in threading.enumerate())
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id != own_id:
+                    stack, line = frame_stack(frame)
+                    stacks[(names.get(thread_id, str(thread_id)),) + tuple(stack)] += 1
+                    lines[line] += 1
+            samples += 1
+            sleep(self.interval)
+        os.makedirs(self.output_dir, exist_ok=True)
+        path = os.path.join(self.output_dir, datetime.now().strftime("profile_%Y_%m_%d_%H_%M_%S.txt"))
+        with open(path, "w") as f:
+            for stack, count in stacks.most_common():
+                f.write(";".join(stack) + f" {count}\n")
+        with open(path.replace(".txt", "_top.txt"), "w") as f:
+            f.write(f"{samples} samples every {self.interval * 1000:.1f}ms\n")
+            for location, count in lines.most_common(30):
+                f.write(f"{100 * count / max(1, samples):6.1f}%  {location}\n")
+        return path
+
+
+def install_profiler_signal(profiler):
+    """
+    Starts the profiler on SIGUSR1 (kill -USR1 <pid>), or on Ctrl+Break on Windows
+    :param profiler: SamplingProfiler to start
+    :return: Name of the signal, or None if neither exists
+    """
+    for name in ("SIGUSR1", "SIGBREAK"):
+        if hasattr(signal, name):
+            signal.signal(getattr(signal, name), profiler.request)
+            return name
+    return None
@@ -0,0 +1,131 @@
+from itertools import count
+
+import numpy as np
+
+
+def box_iou(boxes_a, boxes_b):
+    """
+    Computes the IoU between every pair of boxes
+    :param boxes_a: Array of [x0, y0, w, h] rows
+    :param boxes_b: Array of [x0, y0, w, h] rows
+    :return: Array of shape (len(boxes_a), len(boxes_b))
+    """
+    a = np.asarray(boxes_a, dtype=np.float64).reshape(-1, 4)[:, None, :]
+    b = np.asarray(boxes_b, dtype=np.float64).reshape(-1, 4)[None, :, :]
+    w = np.clip(np.minimum(a[..., 0] + a[..., 2], b[..., 0] + b[..., 2]) - np.maximum(a[..., 0], b[..., 0]), 0, None)
+    h = np.clip(np.minimum(a[..., 1] + a[..., 3], b[..., 1] + b[..., 3]) - np.maximum(a[..., 1], b[..., 1]), 0, None)
+    intersection = w * h
+    return intersection / (a[..., 2] * a[..., 3] + b[..., 2] * b[..., 3] - intersection + 1e-9)
+
+
+class Track:
+    """
+    A minion followed across frames
+    """
+
+    def __init__(self, track_id, minion_pos):
+        """
+        :param track_id: Stable ID of the minion
+        :param minion_pos: [x0, y0, w, h, label] of the minion when first detected
+        """
+        self.track_id = track_id
+        self.minion_pos = list(minion_pos)
+        self.velocity = [0.0, 0.0]
+        self.frames_since_detection = 0
+        self.missed = 0
+
+
+class MinionTracker:
+    """
+    Gives detected minions stable IDs and predicts their positions between detections, so the model only has to run
+    every few frames
+    """
+
+    def __init__(self, detect_every, iou_threshold=0.3, max_missed=2):
+        """
+        :param detect_every: Run the model at least every this many frames
+        :param iou_threshold: Minimum IoU between a prediction and a detection to count as the same minion
+        :param max_missed: Detections a track can miss before it is dropped
+        """
+        self.detect_every = max(1, detect_every)
+        self.iou_threshold = iou_threshold
+        self.max_missed = max_missed
+        self.tracks = []
+        self.frames_since_detection = 0
+        self.lost = True
+        self.track_ids = count()
+
+    def needs_detection(self):
+        """
+        :return: If the model should run on this frame, either because it is a keyframe or the tracker lost a minion
+        """
+        return self.lost or self.frames_since_detection + 1 >= self.detect_every
+
+    def update(self, minion_pos_list):
+        """
+        Matches the model's detections to the tracked minions, greedily by IoU with the predicted positions
+        :param minion_pos_list: List of [x0, y0, w, h, label] from the model
+        :return: List of the tracks in the same order as minion_pos_list
+        """
+        for track in self.tracks:
+            track.frames_since_detection += 1
+        predicted = [self.predicted_pos(track) for track in self.tracks]
+        matched_tracks = [None] * len(minion_pos_list)
+        if len(self.tracks) > 0 and len(minion_pos_list) > 0:
+            iou = box_iou([pos[:4] for pos in predicted], [pos[:4] for pos in minion_pos_list])
+            for track_index, pos_index in zip(*np.unravel_index(np.argsort(-iou, axis=None), iou.shape)):
+                if iou[track_index, pos_index] < self.iou_threshold:
+                    break
+                track = self.tracks[track_index]
+                if matched_tracks[pos_index] is not None or track in matched_tracks or \
+                        track.minion_pos[4] != minion_pos_list[pos_index][4]:
+                    continue
+                matched_tracks[pos_index] = track
+
+        for pos_index, minion_pos in enumerate(minion_pos_list):
+            track = matched_tracks[pos_index]
+            if track is None:
+                track = Track(next(self.track_ids), minion_pos)
+                matched_tracks[pos_index] = track
+                self.tracks.append(track)
+            else:
+                # Velocity in pixels per frame since the minion was last seen by the model
+                track.velocity = [(minion_pos[0] - track.minion_pos[0]) / track.frames_since_detection,
+                                  (minion_pos[1] - track.minion_pos[1]) / track.frames_since_detection]
+                track.minion_pos = list(minion_pos)
+            track.frames_since_detection = 0
+            track.missed = 0
+
+        for track in self.tracks:
+            if track not in matched_tracks:
+                track.missed += 1
+        self.tracks = [track for track in self.tracks if track.missed <= self.max_missed]
+        self.frames_since_detection = 0
+        self.lost = False
+        return matched_tracks
+
+    def predict(self):
+        """
+        Moves every tracked minion along its velocity for a frame without a detection
+        :return: List of the tracks seen by the last detection and their predicted [x0, y0, w, h, label]
+        """
+        self.frames_since_detection += 1
+        for track in self.tracks:
+            track.frames_since_detection += 1
+        visible_tracks = [track for track in self.tracks if track.missed == 0]
+        return visible_tracks, [self.predicted_pos(track) for track in visible_tracks]
+
+    def mark_lost(self):
+        """
+        Forces the model to run on the next frame, e.g. when a tracked minion's HP bar disappeared
+        """
+        self.lost = True
+
+    @staticmethod
+    def predicted_pos(track):
+        """
+        :return: [x0, y0, w, h, label] of where the track should be on the current frame
+        """
+        return [track.minion_pos[0] + track.velocity[0] * track.frames_since_detection,
+                track.minion_pos[1] + track.velocity[1] * track.frames_since_detection,
+                track.minion_pos[2], track.minion_pos[3], track.minion_pos[4]]
@@ -0,0 +1,258 @@
+import hashlib
+import os
+import sys
+from time import perf_counter
+
+import numpy as np
+
+DEFAULT_WEIGHTS = "custom-weights/10kv2.pt"
+DEFAULT_CACHE_DIR = "custom-weights/cache"
+HUB_REPO = "ultralytics/yolov5"
+BACKENDS = ["torch", "traced", "onnx"]
+
+
+def weights_hash(weights_path):
+    """
+    :param weights_path: Path to the weights file
+    :return: sha256 hex digest of the weights file, used to key the cached artifacts
+    """
+    sha = hashlib.sha256()
+    with open(weights_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def local_hub_dir():
+    """
+    :return: Directory of the yolov5 repo cached by an earlier torch.hub.load, or None if it was never downloaded
+    """
+    import torch
+    hub_dir = os.path.join(torch.hub.get_dir(), HUB_REPO.replace("/", "_") + "_master")
+    return hub_dir if os.path.isdir(hub_dir) else None
+
+
+def letterbox_shape(screen_width, screen_height, img_size, stride=32):
+    """
+    Computes the model input shape for frames of the configured resolution, like YOLOv5's AutoShape does
+    :param screen_width: Screen width from config
+    :param screen_height: Screen height from config
+    :param img_size: Length of the longer side of the model input
+    :param stride: Model stride the input has to be a multiple of
+    :return: (height, width) of the model input
+    """
+    ratio = img_size / max(screen_width, screen_height)
+    h = int(np.ceil(screen_height * ratio / stride) * stride)
+    w = int(np.ceil(screen_width * ratio / stride) * stride)
+    return h, w
+
+
+def letterbox(frame_arr, input_shape):
+    """
+    Resizes a frame into the model input shape keeping its aspect ratio, padding the rest
+    :param frame_arr: Numpy array (RGB) of the frame
+    :param input_shape: (height, width) of the model input
+    :return: Float32 array of shape (3, height, width) in [0, 1], the resize ratio, and the (x, y) padding
+    """
+    import cv2
+    h, w = frame_arr.shape[:2]
+    ratio = min(input_shape[0] / h, input_shape[1] / w)
+    new_w, new_h = int(round(w * ratio)), int(round(h * ratio))
+    pad_x, pad_y = (input_shape[1] - new_w) // 2, (input_shape[0] - new_h) // 2
+    padded = np.full((input_shape[0], input_shape[1], 3), 114, dtype=np.uint8)
+    padded[pad_y:pad_y + new_h, pad_x:pad_x + new_w] = cv2.resize(frame_arr[..., :3], (new_w, new_h),
+                                                                  interpolation=cv2.INTER_LINEAR)
+    return padded.transpose(2, 0, 1).astype(np.float32) / 255, ratio, (pad_x, pad_y)
+
+
+def non_max_suppression(prediction, conf_thres=0.25, iou_thres=0.45, max_det=1000):
+    """
+    Turns raw YOLOv5 output for one image into detections, like YOLOv5's AutoShape does
+    :param prediction: Array of shape (N, 5 + classes) of [x, y, w, h, objectness, class scores...]
+    :param conf_thres: Minimum objectness * class score
+    :param iou_thres: IoU above which boxes of the same class are merged
+    :param max_det: Maximum number of detections kept
+    :return: Array of [x0, y0, x1, y1, confidence, label] rows
+    """
+    import torch
+    import torchvision
+    prediction = torch.as_tensor(prediction)
+    prediction = prediction[prediction[:, 4] > conf_thres]
+    if len(prediction) == 0:
+        return np.zeros((0, 6), dtype=np.float32)
+    scores = prediction[:, 5:] * prediction[:, 4:5]
+    conf, label = scores.max(1)
+    boxes = torch.cat([prediction[:, :2] - prediction[:, 2:4] / 2, prediction[:, :2] + prediction[:, 2:4] / 2], 1)
+    keep = conf > conf_thres
+    boxes, conf, label = boxes[keep], conf[keep], label[keep]
+    keep = torchvision.ops.batched_nms(boxes, conf, label, iou_thres)[:max_det]
+    return torch.cat([boxes[keep], conf[keep, None], label[keep, None].float()], 1).numpy()
+
+
+def scale_detections(detections, ratio, pad, frame_shape):
+    """
+    Maps detections from the letterboxed model input back onto the frame
+    :param detections: Array of [x0, y0, x1, y1, confidence, label] rows in model input coordinates
+    :param ratio: Resize ratio returned by letterbox
+    :param pad: (x, y) padding returned by letterbox
+    :param frame_shape: Shape of the original frame
+    :return: The detections in frame coordinates
+    """
+    detections[:, [0, 2]] = np.clip((detections[:, [0, 2]] - pad[0]) / ratio, 0, frame_shape[1])
+    detections[:, [1, 3]] = np.clip((detections[:, [1, 3]] - pad[1]) / ratio, 0, frame_shape[0])
+    return detections
+
+
+class Detections:
+    """
+    Minimal stand-in for YOLOv5's Detections so callers can keep using results.xyxy
+    """
+
+    def __init__(self, xyxy):
+        """
+        :param xyxy: List with one tensor of [x0, y0, x1, y1, confidence, label] rows per image
+        """
+        self.xyxy = xyxy
+
+
+class FixedShapeDetector:
+    """
+    Runs a model with a fixed input shape (TorchScript, ONNX, ...) with the same call signature as YOLOv5's AutoShape
+    """
+
+    def __init__(self, forward, input_shape):
+        """
+        :param forward: Function taking a float32 array of shape (batch, 3, height, width) and returning the raw
+                        YOLOv5 prediction array of shape (batch, N, 5 + classes)
+        :param input_shape: (height, width) every image is letterboxed into
+        """
+        self.forward = forward
+        self.input_shape = input_shape
+
+    def __call__(self, imgs, size=None):
+        """
+        :param imgs: Numpy array (RGB) of a frame, or a list of them
+        :param size: Ignored, the input shape is fixed
+        :return: Detections with one xyxy tensor per image
+        """
+        import torch
+        if not isinstance(imgs, (list, tuple)):
+            imgs = [imgs]
+        batch = [letterbox(img, self.input_shape) for img in imgs]
+        prediction = np.asarray(self.forward(np.stack([b[0] for b in batch])))
+        xyxy = []
+        for img, (_, ratio, pad), img_prediction in zip(imgs, batch, prediction):
+            detections = scale_detections(non_max_suppression(img_prediction), ratio, pad, img.shape)
+            xyxy.append(torch.from_numpy(detections))
+        return Detections(xyxy)
+
+    def eval(self):
+        return self
+
+
+def disable_requirement_checks(hub_dir):
+    """
+    Stops yolov5's hubconf from checking its requirements.txt, which can pip install missing packages over the network
+    :param hub_dir: Local yolov5 repo
+    """
+    os.environ["YOLOv5_AUTOINSTALL"] = "False"
+    sys.path.insert(0, hub_dir)
+    try:
+        # hubconf imports check_requirements when the model is created, so it picks up the replacement
+        import utils.general
+        utils.general.check_requirements = lambda *args, **kwargs: None
+    except ImportError:
+        pass
+    finally:
+        sys.path.remove(hub_dir)
+
+
+def load_hub_model(weights_path, hub_dir=None):
+    """
+    Loads the custom YOLOv5 weights from a local copy of the hub repo, without any network access
+    :param weights_path: Path to the weights file
+    :param hub_dir: Local yolov5 repo, defaults to torch.hub's cached copy
+    :return: YOLOv5 AutoShape model
+    :raises FileNotFoundError: If there is no local yolov5 repo
+    """
+    import torch
+    hub_dir = hub_dir or local_hub_dir()
+    if hub_dir is None or not os.path.isfile(os.path.join(hub_dir, "hubconf.py")):
+        raise FileNotFoundError(
+            f"No local yolov5 repo found{f' in {hub_dir}' if hub_dir else ''}. Pass --hub_dir with a clone of "
+            f"https://github.com/{HUB_REPO}, or seed torch.hub's cache in {torch.hub.get_dir()} once with network "
+            f"access (torch.hub.load('{HUB_REPO}', 'custom', path='{weights_path}'))")
+    disable_requirement_checks(hub_dir)
+    model = torch.hub.load(hub_dir, 'custom', path=weights_path, source='local')
+    model.eval()
+    return model
+
+
+def load_traced_model(weights_path, input_shape, cache_dir=DEFAULT_CACHE_DIR, hub_dir=None):
+    """
+    Loads a TorchScript trace of the model for the given input shape, tracing and caching it first if needed
+    :param weights_path: Path to the weights file
+    :param input_shape: (height, width) of the model input
+    :param cache_dir: Directory of the cached traces, keyed by the weights hash and input shape
+    :param hub_dir: Local yolov5 repo, only needed when the trace is not cached yet
+    :return: FixedShapeDetector running the trace
+    """
+    import torch
+    cache_path = os.path.join(cache_dir, f"{weights_hash(weights_path)}_{input_shape[0]}x{input_shape[1]}.torchscript")
+    if os.path.exists(cache_path):
+        traced = torch.jit.load(cache_path, map_location="cpu")
+    else:
+        print(f"Tracing the model into {cache_path}...")
+        inner_model = load_hub_model(weights_path, hub_dir).model.float().eval()
+        with torch.no_grad():
+            traced = torch.jit.trace(inner_model, torch.zeros(1, 3, *input_shape), strict=False)
+        os.makedirs(cache_dir, exist_ok=True)
+        traced.save(cache_path)
+    traced.eval()
+
+    def forward(batch):
+        with torch.no_grad():
+            prediction = traced(torch.from_numpy(batch))
+        return (prediction[0] if isinstance(prediction, (list, tuple)) else prediction).numpy()
+
+    return FixedShapeDetector(forward, input_shape)
+
+
+def load_model(weights_path=DEFAULT_WEIGHTS, screen_width=2560, screen_height=1440, img_size=640, backend="torch",
+               cache_dir=DEFAULT_CACHE_DIR, hub_dir=None, warmup=True, quantization="none", calibration_dir=None):
+    """
+    Loads the model without network access and reports how long each part of the startup took
+    :param weights_path: Path to the weights file
+    :param screen_width: Screen width from config, used for the warm-up frame and the fixed input shape
+    :param screen_height: Screen height from config, used for the warm-up frame and the fixed input shape
+    :param img_size: Length of the longer side of the model input
+    :param backend: One of BACKENDS, "torch" for the eager yolov5 model, "traced" for a cached TorchScript trace,
+                    "onnx" for onnxruntime on the CPU
+    :param cache_dir: Directory of the cached traces and exported models
+    :param hub_dir: Local yolov5 repo, defaults to torch.hub's cached copy
+    :param warmup: Run one frame through the model so the first real frame is not slow
+    :param quantization: INT8 quantization mode for the onnx backend
+    :param calibration_dir: Directory of frames for the static INT8 quantization
+    :return: Model, and a dictionary of the import, load and warm-up times in seconds
+    """
+    timings = {}
+    s = perf_counter()
+    import torch  # noqa: F401
+    timings["import"] = perf_counter() - s
+
+    s = perf_counter()
+    input_shape = letterbox_shape(screen_width, screen_height, img_size)
+    if backend == "traced":
+        model = load_traced_model(weights_path, input_shape, cache_dir, hub_dir)
+    elif backend == "onnx":
+        from OnnxBackend import load_onnx_model
+        model = load_onnx_model(weights_path, input_shape, quantization, calibration_dir, cache_dir, hub_dir)
+    else:
+        model = load_hub_model(weights_path, hub_dir)
+    timings["load"] = perf_counter() - s
+
+    s = perf_counter()
+    if warmup:
+        model(np.zeros((screen_height, screen_width, 3), dtype=np.uint8), size=img_size)
+    timings["warmup"] = perf_counter() - s
+    return model, timings
@@ -0,0 +1,224 @@
+import os
+import threading
+from argparse import ArgumentParser
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from time import perf_counter
+
+import numpy as np
+
+from CSHelperUtils import filter_detections, load_config, minions_hp_counts
+from FrameSources import FRAME_SOURCES, create_frame_source
+from ModelLoader import BACKENDS, DEFAULT_WEIGHTS, load_model
+from Pipeline import FrameQueue, capture_worker
+
+COLUMNS = ["frame", "x0", "y0", "w", "h", "label", "hp_count", "below"]
+
+# HP settings of the worker processes, set once by init_hp_worker instead of being sent with every chunk
+hp_settings = None
+
+
+def read_batch(frame_queue, batch_size):
+    """
+    :param frame_queue: FrameQueue filled by the prefetch worker
+    :param batch_size: Maximum number of frames in the batch
+    :return: List of up to batch_size frames, empty once the source is exhausted
+    """
+    batch = []
+    while len(batch) < batch_size:
+        frame_arr = frame_queue.get()
+        if frame_arr is None:
+            break
+        batch.append(frame_arr)
+    return batch
+
+
+def init_hp_worker(config):
+    global hp_settings
+    hp_settings = (config.hp_search_padding, config.hp_lower, config.hp_upper, config.hp_bar_length)
+
+
+def analyze_chunk(frames, minion_pos_lists):
+    """
+    Reads the HP bars of a chunk of frames, runs in a worker process
+    :param frames: List of frame arrays
+    :param minion_pos_lists: Minion positions of each frame
+    :return: List of the HP pixel counts of each frame
+    """
+    hp_search_padding, hp_lower, hp_upper, hp_bar_length = hp_settings
+    return [minions_hp_counts(minion_pos_list, frame_arr, hp_search_padding, hp_lower, hp_upper, hp_bar_length)
+            for frame_arr, minion_pos_list in zip(frames, minion_pos_lists)]
+
+
+def append_rows(rows, frame_index, minion_pos_list, hp_counts, minion_thresholds):
+    for minion_pos, hp_pixel_count in zip(minion_pos_list, hp_counts):
+        rows["frame"].append(frame_index)
+        for column, value in zip(["x0", "y0", "w", "h", "label"], minion_pos):
+            rows[column].append(value)
+        rows["hp_count"].append(-1 if hp_pixel_count is None else hp_pixel_count)
+        rows["below"].append(hp_pixel_count is not None and hp_pixel_count <= minion_thresholds[minion_pos[4]])
+
+
+def to_columns(rows):
+    """
+    :param rows: Dictionary of column name -> list filled by append_rows
+    :return: Dictionary of column name -> numpy array
+    """
+    return {"frame": np.asarray(rows["frame"], dtype=np.int32),
+            "x0": np.asarray(rows["x0"], dtype=np.float32),
+            "y0": np.asarray(rows["y0"], dtype=np.float32),
+            "w": np.asarray(rows["w"], dtype=np.float32),
+            "h": np.asarray(rows["h"], dtype=np.float32),
+            "label": np.asarray(rows["label"], dtype=np.int8),
+            "hp_count": np.asarray(rows["hp_count"], dtype=np.int16),
+            "below": np.asarray(rows["below"], dtype=bool)}
+
+
+def evaluate(frame_source, model, config, batch_size, workers, img_size=640):
+    """
+    Runs detection and the last-hit decision over every frame of the source
+    The HP bars are read in worker processes, since reading them is mostly Python code holding the GIL. Every model
+    batch is split into one chunk per worker, and the model already runs on the next batch while they read it.
+    Each frame is pickled to its worker, which costs ~12ms for a 2560x1440 frame against ~20ms of HP reading, so the
+    workers only pay off with 3 or more cores
+    :param frame_source: Frame source with read()
+    :param model: Loaded model, called on whole batches of frames
+    :param config: Result of load_config
+    :param batch_size: Number of frames per model call
+    :param workers: Number of processes reading HP bars in parallel, 0 to read them on the calling thread
+    :param img_size: Length of the longer side of the model input
+    :return: Dictionary of column name -> numpy array, one row per minion, and the number of frames
+    """
+    frame_queue = FrameQueue(2 * batch_size, latest_only=False)
+    stop_event = threading.Event()
+    prefetcher = threading.Thread(target=capture_worker, name="prefetch", daemon=True,
+                                  args=(frame_source, frame_queue, stop_event, None))
+    prefetcher.start()
+
+    rows = {column: [] for column in COLUMNS}
+    frame_count = 0
+    executor = ProcessPoolExecutor(workers, initializer=init_hp_worker, initargs=(config,)) if workers > 0 else None
+    if executor is None:
+        init_hp_worker(config)
+    # (first frame index, minion positions, HP counts future or list) of the batches being read, in order
+    pending = deque()
+
+    def finish_oldest():
+        first_frame, minion_pos_lists, chunks = pending.popleft()
+        hp_counts_list = [hp_counts for chunk in chunks
+                          for hp_counts in (chunk.result() if executor is not None else chunk)]
+        for frame_index, (minion_pos_list, hp_counts) in enumerate(zip(minion_pos_lists, hp_counts_list),
+                                                                   first_frame):
+            append_rows(rows, frame_index, minion_pos_list, hp_counts, config.minion_thresholds)
+
+    try:
+        while True:
+            batch = read_batch(frame_queue, batch_size)
+            if len(batch) == 0:
+                break
+            results = model(batch, size=img_size)
+            minion_pos_lists = [filter_detections(detections.cpu().numpy(), config.ui_boxes)
+                                for detections in results.xyxy]
+            if executor is None:
+                chunks = [analyze_chunk(batch, minion_pos_lists)]
+            else:
+                chunk_size = -(-len(batch) // workers)
+                chunks = [executor.submit(analyze_chunk, batch[i:i + chunk_size], minion_pos_lists[i:i + chunk_size])
+                          for i in range(0, len(batch), chunk_size)]
+            pending.append((frame_count, minion_pos_lists, chunks))
+            frame_count += len(batch)
+            # Keep at most two batches in flight, so the frames sent to the workers do not pile up in memory
+            while len(pending) > 1:
+                finish_oldest()
+        while len(pending) > 0:
+            finish_oldest()
+    finally:
+        stop_event.set()
+        prefetcher.join()
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+    return to_columns(rows), frame_count
+
+
+def evaluate_per_frame(frame_source, model, config, max_frames, img_size=640):
+    """
+    Reference for evaluate: the frame loop's own per-frame detection and HP reading, without batching or workers
+    :param frame_source: Frame source with read()
+    :param model: Loaded model
+    :param config: Result of load_config
+    :param max_frames: Number of frames to evaluate
+    :param img_size: Length of the longer side of the model input
+    :return: Dictionary of column name -> numpy array, one row per minion
+    """
+    rows = {column: [] for column in COLUMNS}
+    for frame_index in range(max_frames):
+        frame_arr = frame_source.read()
+        if frame_arr is None:
+            break
+        minion_pos_list = filter_detections(model(frame_arr, size=img_size).xyxy[0].cpu().numpy(), config.ui_boxes)
+        hp_counts = minions_hp_counts(minion_pos_list, frame_arr, config.hp_search_padding, config.hp_lower,
+                                      config.hp_upper, config.hp_bar_length)
+        append_rows(rows, frame_index, minion_pos_list, hp_counts, config.minion_thresholds)
+    return to_columns(rows)
+
+
+def compare_columns(columns, reference, max_frames, atol=1.0):
+    """
+    :param columns: Result of evaluate
+    :param reference: Result of evaluate_per_frame
+    :param max_frames: Number of frames the reference covers
+    :param atol: Pixels the batched boxes may differ from the reference by, batched letterboxing can round differently
+    :return: List of the frames whose rows differ
+    """
+    in_range = columns["frame"] < max_frames
+    mismatched = []
+    for frame_index in np.unique(np.concatenate([columns["frame"][in_range], reference["frame"]])):
+        a, b = columns["frame"] == frame_index, reference["frame"] == frame_index
+        if a.sum() != b.sum() or \
+                not all(np.allclose(columns[c][a], reference[c][b], atol=atol) for c in ["x0", "y0", "w", "h"]) or \
+                not all(np.array_equal(columns[c][a], reference[c][b]) for c in ["label", "hp_count", "below"]):
+            mismatched.append(int(frame_index))
+    return mismatched
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description="Runs detection and the last-hit decision over recorded frames in batches")
+    parser.add_argument("--source", default="video", choices=FRAME_SOURCES[1:], help="Where to read frames from")
+    parser.add_argument("--source_path", required=True, help="Directory or file to read the frames from")
+    parser.add_argument("--output", default="eval_output.npz", help="Where to write the per-minion columns")
+    parser.add_argument("--batch_size", type=int, default=8, help="Number of frames per model call")
+    parser.add_argument("--workers", type=int, default=(os.cpu_count() or 1) if (os.cpu_count() or 1) > 2 else 0,
+                        help="Number of processes reading HP bars in parallel, 0 to read them on the main thread "
+                             "(the default with 2 cores or less, sending the frames to the workers costs more than "
+                             "it saves there)")
+    parser.add_argument("--verify", type=int, default=0,
+                        help="Also runs the per-frame loop over this many frames and checks that the batched results "
+                             "match it")
+    parser.add_argument("--weights", default=DEFAULT_WEIGHTS, help="Path to the model weights")
+    parser.add_argument("--img_size", type=int, default=640, help="Length of the longer side of the model input")
+    parser.add_argument("--backend", default="torch", choices=BACKENDS, help="How to run the model")
+    args = parser.parse_args()
+
+    config = load_config()
+    model, _ = load_model(args.weights, config.screen_width, config.screen_height, args.img_size, args.backend)
+    frame_source = create_frame_source(args.source, args.source_path)
+
+    s = perf_counter()
+    columns, frame_count = evaluate(frame_source, model, config, args.batch_size, args.workers, args.img_size)
+    elapsed = perf_counter() - s
+    frame_source.close()
+
+    np.savez_compressed(args.output, **columns)
+    print(f"Evaluated {frame_count} frames with {len(columns['frame'])} minions in {elapsed:.1f}s "
+          f"({frame_count / max(elapsed, 1e-9):.1f} frames per second)")
+    print(f"Wrote {args.output}")
+
+    if args.verify > 0:
+        frame_source = create_frame_source(args.source, args.source_path)
+        reference = evaluate_per_frame(frame_source, model, config, args.verify, args.img_size)
+        frame_source.close()
+        mismatched = compare_columns(columns, reference, args.verify)
+        if len(mismatched) > 0:
+            print(f"The batched results differ from the per-frame loop on frames {mismatched}")
+            exit(1)
+        print(f"The batched results match the per-frame loop on the first {args.verify} frames")
@@ -0,0 +1,179 @@
+import os
+from argparse import ArgumentParser
+
+import numpy as np
+
+from FrameSources import ImageDirectorySource
+from ModelLoader import DEFAULT_CACHE_DIR, DEFAULT_WEIGHTS, FixedShapeDetector, letterbox, letterbox_shape, \
+    load_hub_model, weights_hash
+from MinionTracker import box_iou
+
+QUANTIZATION_MODES = ["none", "dynamic", "static"]
+
+
+def export_onnx(weights_path, input_shape, cache_dir=DEFAULT_CACHE_DIR, hub_dir=None):
+    """
+    Exports the model to ONNX for the given input shape unless it was already exported
+    :param weights_path: Path to the weights file
+    :param input_shape: (height, width) of the model input
+    :param cache_dir: Directory of the exported models, keyed by the weights hash and input shape
+    :param hub_dir: Local yolov5 repo, only needed when the model is not exported yet
+    :return: Path to the ONNX model
+    """
+    import torch
+    onnx_path = os.path.join(cache_dir, f"{weights_hash(weights_path)}_{input_shape[0]}x{input_shape[1]}.onnx")
+    if not os.path.exists(onnx_path):
+        print(f"Exporting the model to {onnx_path}...")
+        inner_model = load_hub_model(weights_path, hub_dir).model.float().eval()
+        os.makedirs(cache_dir, exist_ok=True)
+        with torch.no_grad():
+            torch.onnx.export(inner_model, torch.zeros(1, 3, *input_shape), onnx_path, opset_version=12,
+                              input_names=["images"], output_names=["output"],
+                              dynamic_axes={"images": {0: "batch"}, "output": {0: "batch"}})
+    return onnx_path
+
+
+class FrameCalibrationReader:
+    """
+    Feeds letterboxed dataset frames to onnxruntime's static quantization calibration
+    """
+
+    def __init__(self, image_dir, input_shape, frame_count):
+        """
+        :param image_dir: Directory of frames, e.g. the images directory of a bootstrap.py dataset
+        :param input_shape: (height, width) of the model input
+        :param frame_count: Number of frames to calibrate on
+        """
+        self.source = ImageDirectorySource(image_dir)
+        self.input_shape = input_shape
+        self.frames_left = frame_count
+
+    def get_next(self):
+        if self.frames_left <= 0:
+            return None
+        frame_arr = self.source.read()
+        if frame_arr is None:
+            return None
+        self.frames_left -= 1
+        return {"images": letterbox(frame_arr, self.input_shape)[0][None]}
+
+
+def quantize_onnx(onnx_path, mode, calibration_dir=None, input_shape=None, calibration_frames=100):
+    """
+    Quantizes the ONNX model to INT8 unless it was already quantized
+    :param onnx_path: Path to the float ONNX model
+    :param mode: "dynamic" to quantize the weights only, "static" to also quantize the activations using ranges
+                 calibrated on dataset frames
+    :param calibration_dir: Directory of frames for the static calibration
+    :param input_shape: (height, width) of the model input, needed for the static calibration
+    :param calibration_frames: Number of frames to calibrate on
+    :return: Path to the quantized ONNX model
+    """
+    from onnxruntime.quantization import QuantType, quantize_dynamic, quantize_static
+    quantized_path = onnx_path.replace(".onnx", f"_int8_{mode}.onnx")
+    if os.path.exists(quantized_path):
+        return quantized_path
+    print(f"Quantizing the model into {quantized_path}...")
+    if mode == "dynamic":
+        quantize_dynamic(onnx_path, quantized_path, weight_type=QuantType.QUInt8)
+    elif mode == "static":
+        if calibration_dir is None:
+            raise ValueError("Static quantization needs a directory of calibration frames")
+        reader = FrameCalibrationReader(calibration_dir, input_shape, calibration_frames)
+        quantize_static(onnx_path, quantized_path, reader, activation_type=QuantType.QUInt8,
+                        weight_type=QuantType.QInt8)
+    else:
+        raise ValueError(f"Unknown quantization mode {mode}")
+    return quantized_path
+
+
+def load_onnx_model(weights_path, input_shape, quantization="none", calibration_dir=None, cache_dir=DEFAULT_CACHE_DIR,
+                    hub_dir=None):
+    """
+    Loads the model into onnxruntime's CPU backend, exporting and quantizing it first if needed
+    :param weights_path: Path to the weights file
+    :param input_shape: (height, width) of the model input
+    :param quantization: One of QUANTIZATION_MODES
+    :param calibration_dir: Directory of frames for the static quantization
+    :param cache_dir: Directory of the exported models
+    :param hub_dir: Local yolov5 repo, only needed when the model is not exported yet
+    :return: FixedShapeDetector running the ONNX model
+    """
+    import onnxruntime
+    onnx_path = export_onnx(weights_path, input_shape, cache_dir, hub_dir)
+    if quantization != "none":
+        onnx_path = quantize_onnx(onnx_path, quantization, calibration_dir, input_shape)
+    options = onnxruntime.SessionOptions()
+    options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+    options.intra_op_num_threads = os.cpu_count() or 1
+    session = onnxruntime.InferenceSession(onnx_path, options, providers=["CPUExecutionProvider"])
+
+    def forward(batch):
+        return session.run(["output"], {"images": batch})[0]
+
+    return FixedShapeDetector(forward, input_shape)
+
+
+def accuracy_drift(reference_model, model, frames, iou_threshold=0.5):
+    """
+    Compares the detections of a model against the reference PyTorch model
+    :param reference_model: Model whose detections are treated as correct
+    :param model: Model to compare
+    :param frames: List of numpy arrays (RGB) of frames
+    :param iou_threshold: Minimum IoU for two detections of the same class to count as the same minion
+    :return: Dictionary with the matched, missing and extra detection counts, and the mean IoU and confidence
+             difference of the matched ones
+    """
+    report = {"reference": 0, "matched": 0, "missing": 0, "extra": 0, "mean_iou": 0.0, "mean_confidence_diff": 0.0}
+    ious, confidence_diffs = [], []
+    for frame_arr in frames:
+        expected = reference_model(frame_arr).xyxy[0].cpu().numpy()
+        found = model(frame_arr).xyxy[0].cpu().numpy()
+        report["reference"] += len(expected)
+        matched_found = set()
+        if len(expected) > 0 and len(found) > 0:
+            expected_boxes = np.column_stack([expected[:, :2], expected[:, 2:4] - expected[:, :2]])
+            found_boxes = np.column_stack([found[:, :2], found[:, 2:4] - found[:, :2]])
+            iou = box_iou(expected_boxes, found_boxes)
+            iou[expected[:, 5][:, None] != found[:, 5][None, :]] = 0
+            for i in range(len(expected)):
+                j = int(np.argmax(iou[i]))
+                if iou[i, j] >= iou_threshold and j not in matched_found:
+                    matched_found.add(j)
+                    ious.append(iou[i, j])
+                    confidence_diffs.append(found[j, 4] - expected[i, 4])
+        report["matched"] += len(matched_found)
+        report["missing"] += len(expected) - len(matched_found)
+        report["extra"] += len(found) - len(matched_found)
+    if len(ious) > 0:
+        report["mean_iou"] = float(np.mean(ious))
+        report["mean_confidence_diff"] = float(np.mean(confidence_diffs))
+    return report
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description="Exports the model to ONNX, optionally quantizes it, and reports its "
+                                        "accuracy drift against the PyTorch model")
+    parser.add_argument("--weights", default=DEFAULT_WEIGHTS, help="Path to the model weights")
+    parser.add_argument("--img_size", type=int, default=640, help="Length of the longer side of the model input")
+    parser.add_argument("--screen_width", type=int, default=2560, help="Width of the frames the model will see")
+    parser.add_argument("--screen_height", type=int, default=1440, help="Height of the frames the model will see")
+    parser.add_argument("--quantize", default="none", choices=QUANTIZATION_MODES, help="INT8 quantization mode")
+    parser.add_argument("--frames", default=None,
+                        help="Directory of frames (e.g. bootstrap.py's output/images) to calibrate and compare on")
+    parser.add_argument("--compare_frames", type=int, default=50, help="Number of frames to compare on")
+    args = parser.parse_args()
+
+    input_shape = letterbox_shape(args.screen_width, args.screen_height, args.img_size)
+    model = load_onnx_model(args.weights, input_shape, args.quantize, args.frames)
+    if args.frames is not None:
+        source = ImageDirectorySource(args.frames)
+        frames = []
+        while len(frames) < args.compare_frames:
+            frame_arr = source.read()
+            if frame_arr is None:
+                break
+            frames.append(frame_arr)
+        drift = accuracy_drift(load_hub_model(args.weights), model, frames)
+        for key, value in drift.items():
+            print(f"{key}: {value}")
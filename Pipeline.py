@@ -0,0 +1,147 @@
+import threading
+from collections import deque
+from queue import Empty
+
+from Metrics import stage_timer
+
+
+class FrameQueue:
+    """
+    Bounded queue between two pipeline stages that can always hand out the newest frame
+    """
+
+    def __init__(self, depth, latest_only, on_drop=None):
+        """
+        :param depth: Maximum number of items waiting in the queue
+        :param latest_only: Drop stale items so the consumer only ever sees the newest one
+        :param on_drop: Called with every item that is dropped without reaching the consumer, e.g. to release its frame
+        """
+        self.depth = max(1, depth)
+        self.latest_only = latest_only
+        self.on_drop = on_drop
+        self.items = deque()
+        self.closed = False
+        self.dropped = 0
+        self.condition = threading.Condition()
+
+    def put(self, item, stop_event=None):
+        """
+        Adds an item, dropping the oldest one when full in latest-only mode, otherwise waiting for room
+        :param item: Item to add
+        :param stop_event: Stops waiting for room once set
+        """
+        with self.condition:
+            while len(self.items) >= self.depth:
+                if self.latest_only:
+                    self.drop(self.items.popleft())
+                elif stop_event is not None and stop_event.is_set():
+                    self.drop(item)
+                    return
+                else:
+                    self.condition.wait(0.1)
+            self.items.append(item)
+            self.condition.notify_all()
+
+    def get(self, timeout=None):
+        """
+        Takes the next item, or the newest one in latest-only mode
+        :param timeout: Seconds to wait for an item
+        :return: The item, or None once the queue is closed and empty
+        :raises Empty: If no item arrived in time
+        """
+        with self.condition:
+            if not self.condition.wait_for(lambda: len(self.items) > 0 or self.closed, timeout):
+                raise Empty
+            if len(self.items) == 0:
+                return None
+            if self.latest_only:
+                item = self.items.pop()
+                while len(self.items) > 0:
+                    self.drop(self.items.popleft())
+            else:
+                item = self.items.popleft()
+            self.condition.notify_all()
+            return item
+
+    def drop(self, item):
+        """
+        Counts an item that will never reach the consumer and hands it to on_drop
+        """
+        self.dropped += 1
+        if self.on_drop is not None:
+            self.on_drop(item)
+
+    def close(self):
+        """
+        Tells the consumer that no more items will arrive
+        """
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+
+def capture_worker(frame_source, frame_queue, stop_event, metrics):
+    """
+    Reads frames from the source into the frame queue until the source runs out or the pipeline stops
+    """
+    try:
+        while not stop_event.is_set():
+            with stage_timer(metrics, "capture"):
+                frame_arr = frame_source.read()
+            if frame_arr is None:
+                break
+            frame_queue.put(frame_arr, stop_event)
+    finally:
+        frame_queue.close()
+
+
+def inference_worker(detect, frame_queue, detection_queue, stop_event):
+    """
+    Runs the model on the newest frames and passes the frames on with their minion positions
+    """
+    try:
+        while not stop_event.is_set():
+            try:
+                frame_arr = frame_queue.get(timeout=0.1)
+            except Empty:
+                continue
+            if frame_arr is None:
+                break
+            minion_pos_list = detect(frame_arr)
+            detection_queue.put((frame_arr, minion_pos_list), stop_event)
+    finally:
+        detection_queue.close()
+
+
+def start_pipeline(frame_source, detect, queue_depth, latest_only, metrics=None):
+    """
+    Starts the capture and inference workers. HP analysis and drawing stay on the calling thread since pygame
+    needs to run on the main thread.
+    :param frame_source: Frame source with read() and release(), the frames the pipeline drops are released, the
+                         caller releases every frame it takes from the detection queue once it is done with it
+    :param detect: Function running the model on a frame and returning the minion positions, only ever called
+                   from the inference worker, it records its own inference and post_filter times
+    :param queue_depth: Maximum number of items waiting between two stages
+    :param latest_only: Drop stale frames so each stage works on the newest one
+    :param metrics: Metrics the capture time is recorded into, None to not time it
+    :return: Frame queue, detection queue of (frame_arr, minion_pos_list), stop event, and the worker threads
+    """
+    stop_event = threading.Event()
+    frame_queue = FrameQueue(queue_depth, latest_only, frame_source.release)
+    detection_queue = FrameQueue(queue_depth, latest_only, lambda detected: frame_source.release(detected[0]))
+    workers = [threading.Thread(target=capture_worker, name="capture", daemon=True,
+                                args=(frame_source, frame_queue, stop_event, metrics)),
+               threading.Thread(target=inference_worker, name="inference", daemon=True,
+                                args=(detect, frame_queue, detection_queue, stop_event))]
+    for worker in workers:
+        worker.start()
+    return frame_queue, detection_queue, stop_event, workers
+
+
+def stop_pipeline(stop_event, workers):
+    """
+    Stops the workers and waits for them to finish their current frame
+    """
+    stop_event.set()
+    for worker in workers:
+        worker.join()
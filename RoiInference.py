@@ -0,0 +1,138 @@
+import numpy as np
+
+from CSHelperUtils import filter_detections
+from Metrics import stage_timer
+
+ROI_MODES = ["off", "mask", "tile"]
+
+
+def ui_overlap(box, ui_list):
+    """
+    Finds the parts of the UI that overlap a box
+    :param box: [x0, y0, x1, y1]
+    :param ui_list: From the config, list of [x0, y0, x1, y1] positions of the UI elements on the screen
+    :return: List of [x0, y0, x1, y1] overlaps relative to the box
+    """
+    overlaps = []
+    for ui_pos in ui_list:
+        x0, y0 = max(box[0], ui_pos[0]), max(box[1], ui_pos[1])
+        x1, y1 = min(box[2], ui_pos[2]), min(box[3], ui_pos[3])
+        if x0 < x1 and y0 < y1:
+            overlaps.append([x0 - box[0], y0 - box[1], x1 - box[0], y1 - box[1]])
+    return overlaps
+
+
+def make_tiles(screen_width, screen_height, tile_size, tile_overlap, ui_list):
+    """
+    Splits the screen into overlapping model-sized tiles, leaving out tiles that only contain UI
+    :param screen_width: Screen width from config
+    :param screen_height: Screen height from config
+    :param tile_size: Width and height of a tile, ideally the model's input size
+    :param tile_overlap: Pixels neighboring tiles share, so a minion is always fully inside one tile
+    :param ui_list: From the config, list of [x0, y0, x1, y1] positions of the UI elements on the screen
+    :return: List of [x0, y0, x1, y1] tiles
+    """
+    stride = max(1, tile_size - tile_overlap)
+    xs = list(range(0, max(1, screen_width - tile_size), stride)) + [max(0, screen_width - tile_size)]
+    ys = list(range(0, max(1, screen_height - tile_size), stride)) + [max(0, screen_height - tile_size)]
+    tiles = []
+    for y0 in sorted(set(ys)):
+        for x0 in sorted(set(xs)):
+            tile = [x0, y0, min(screen_width, x0 + tile_size), min(screen_height, y0 + tile_size)]
+            tile_area = (tile[2] - tile[0]) * (tile[3] - tile[1])
+            # UI rectangles from the config do not overlap each other, so their areas can be summed
+            ui_area = sum((o[2] - o[0]) * (o[3] - o[1]) for o in ui_overlap(tile, ui_list))
+            if ui_area < tile_area:
+                tiles.append(tile)
+    return tiles
+
+
+def mask_ui(frame_arr, ui_list, box=None):
+    """
+    Blacks out the UI so the model does not spend effort on it
+    :param frame_arr: Numpy array from the frame
+    :param ui_list: From the config, list of [x0, y0, x1, y1] positions of the UI elements on the screen
+    :param box: [x0, y0, x1, y1] to crop from the frame first, the whole frame if None
+    :return: Masked copy of the frame (or crop), or a view if nothing needed masking
+    """
+    if box is None:
+        box = [0, 0, frame_arr.shape[1], frame_arr.shape[0]]
+    crop = frame_arr[box[1]:box[3], box[0]:box[2]]
+    overlaps = ui_overlap(box, ui_list)
+    if len(overlaps) > 0:
+        crop = crop.copy()
+        for o in overlaps:
+            crop[o[1]:o[3], o[0]:o[2]] = 0
+    return crop
+
+
+def non_max_suppression(detections, iou_threshold):
+    """
+    Removes duplicate detections of the same minion, e.g. from overlapping tiles
+    Like YOLOv5's NMS it works per class, so a minion never suppresses an overlapping minion of another type
+    :param detections: Array of [x0, y0, x1, y1, confidence, label] rows
+    :param iou_threshold: Boxes overlapping a more confident box of the same label by more than this are dropped
+    :return: Array of the kept detections
+    """
+    if len(detections) == 0:
+        return detections
+    # Offsetting the boxes by their label puts every label in its own region, so boxes of different labels never overlap
+    boxes = detections[:, :4] + detections[:, 5:6] * (np.abs(detections[:, :4]).max() + 1)
+    order = np.argsort(-detections[:, 4])
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    keep = []
+    while len(order) > 0:
+        i = order[0]
+        keep.append(i)
+        rest = order[1:]
+        w = np.clip(np.minimum(boxes[i, 2], boxes[rest, 2]) - np.maximum(boxes[i, 0], boxes[rest, 0]), 0, None)
+        h = np.clip(np.minimum(boxes[i, 3], boxes[rest, 3]) - np.maximum(boxes[i, 1], boxes[rest, 1]), 0, None)
+        intersection = w * h
+        iou = intersection / (areas[i] + areas[rest] - intersection + 1e-9)
+        order = rest[iou <= iou_threshold]
+    return detections[keep]
+
+
+def detect_minions_roi(model, frame_arr, ui_list, roi_mode, tiles=None, tile_size=640, iou_threshold=0.5,
+                       metrics=None, size=None):
+    """
+    Runs the model on only the playable part of the frame and keeps the usable minion detections
+    :param model: Loaded YOLOv5 model
+    :param frame_arr: Numpy array from the frame
+    :param ui_list: From the config, list of [x0, y0, x1, y1] positions of the UI elements on the screen
+    :param roi_mode: "mask" to black out the UI before the model, "tile" to also run the model on tiles of the
+                     playable area at its native input size
+    :param tiles: Result of make_tiles, needed for the "tile" mode
+    :param tile_size: Model input size used for the tiles
+    :param iou_threshold: IoU above which detections from overlapping tiles are merged
+    :param metrics: Metrics the inference and post_filter times are recorded into, None to not time them
+    :param size: Model input size for the "mask" mode, None for the model's default
+    :return: List of [x0, y0, w, h, label] of the minions in screen coordinates
+    """
+    with stage_timer(metrics, "inference"):
+        all_detected_objs = run_roi_model(model, frame_arr, ui_list, roi_mode, tiles, tile_size, iou_threshold, size)
+    with stage_timer(metrics, "post_filter"):
+        return filter_detections(all_detected_objs, ui_list)
+
+
+def run_roi_model(model, frame_arr, ui_list, roi_mode, tiles, tile_size, iou_threshold, size=None):
+    """
+    :return: Model output rows of [x0, y0, x1, y1, confidence, label] in screen coordinates, see detect_minions_roi
+    """
+    if roi_mode == "tile":
+        if len(tiles) == 0:
+            return np.zeros((0, 6), dtype=np.float32)
+        crops = [mask_ui(frame_arr, ui_list, tile) for tile in tiles]
+        results = model(crops, size=tile_size)
+        all_detected_objs = []
+        for tile, tile_detections in zip(tiles, results.xyxy):
+            tile_detections = tile_detections.cpu().numpy().copy()
+            tile_detections[:, [0, 2]] += tile[0]
+            tile_detections[:, [1, 3]] += tile[1]
+            all_detected_objs.append(tile_detections)
+        all_detected_objs = non_max_suppression(np.concatenate(all_detected_objs), iou_threshold)
+    else:
+        masked = mask_ui(frame_arr, ui_list)
+        results = model(masked) if size is None else model(masked, size=size)
+        all_detected_objs = results.xyxy[0].cpu().numpy()
+    return all_detected_objs
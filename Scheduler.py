@@ -0,0 +1,145 @@
+import json
+from time import perf_counter
+
+import numpy as np
+
+
+def build_ladder(img_size, min_img_size=320, size_step=64, detect_every=1, max_detect_every=4, max_hp_every=3):
+    """
+    Builds the quality levels the scheduler moves between, from full quality to the cheapest
+    Each level lowers one knob from the previous one, taking turns: detect less often, shrink the model input, then
+    read the HP bars less often
+    :param img_size: Model input size at full quality
+    :param min_img_size: Smallest model input size, equal to img_size to never change it
+    :param size_step: Pixels the model input shrinks by per level
+    :param detect_every: Detection cadence at full quality
+    :param max_detect_every: Longest detection cadence, in frames
+    :param max_hp_every: Longest HP analysis cadence, in frames
+    :return: List of (img_size, detect_every, hp_every) levels
+    """
+    level = [img_size, detect_every, 1]
+    ladder = [tuple(level)]
+    knobs = [(1, 1, max(detect_every, max_detect_every)), (0, -size_step, min(img_size, min_img_size)),
+             (2, 1, max_hp_every)]
+    while True:
+        changed = False
+        for knob, step, limit in knobs:
+            if (step > 0 and level[knob] < limit) or (step < 0 and level[knob] > limit):
+                level[knob] = min(level[knob] + step, limit) if step > 0 else max(level[knob] + step, limit)
+                ladder.append(tuple(level))
+                changed = True
+        if not changed:
+            return ladder
+
+
+class AdaptiveScheduler:
+    """
+    Keeps the frame time within a budget by trading detection quality for speed, and back again once there is room
+    The overlay is drawn every frame at every level, only the work feeding it is done less often or at a lower
+    resolution
+    """
+
+    def __init__(self, budget_ms, ladder, window=30, headroom=0.75, upgrade_windows=3, log_path=None):
+        """
+        :param budget_ms: Target work time per frame in milliseconds
+        :param ladder: Result of build_ladder
+        :param window: Number of frames measured before each decision
+        :param headroom: Moves back up a level only while the frames take less than this fraction of the budget
+        :param upgrade_windows: Number of windows in a row that must have room before moving back up
+        :param log_path: Appends every decision to this file as a JSON line, None to only print them
+        """
+        self.budget_ms = budget_ms
+        self.ladder = ladder
+        self.window = window
+        self.headroom = headroom
+        self.upgrade_windows = upgrade_windows
+        self.log_path = log_path
+        self.level = 0
+        self.frame_times = np.zeros(window, dtype=np.float64)
+        self.frame_count = 0
+        self.frames = 0
+        self.windows_with_room = 0
+        self.frames_since_hp = 0
+        self.warned_cheapest = False
+        self.started = perf_counter()
+
+    @property
+    def img_size(self):
+        return self.ladder[self.level][0]
+
+    @property
+    def detect_every(self):
+        return self.ladder[self.level][1]
+
+    @property
+    def hp_every(self):
+        return self.ladder[self.level][2]
+
+    def run_hp_analysis(self):
+        """
+        Call once per frame
+        :return: If the HP bars should be read on this frame, otherwise the last readings are reused
+        """
+        self.frames_since_hp += 1
+        if self.frames_since_hp >= self.hp_every:
+            self.frames_since_hp = 0
+            return True
+        return False
+
+    def observe(self, frame_ns):
+        """
+        Records the work time of a frame, and moves to another level once a full window has been measured
+        :param frame_ns: Time spent on the frame in nanoseconds, without the wait for the fps cap
+        :return: True if the level changed
+        """
+        self.frames += 1
+        self.frame_times[self.frame_count] = frame_ns / 1e6
+        self.frame_count += 1
+        if self.frame_count < self.window:
+            return False
+        self.frame_count = 0
+        # The mean decides since keyframes are expected to be slower than the tracked frames in between
+        mean_ms = float(self.frame_times.mean())
+        p95_ms = float(np.percentile(self.frame_times, 95))
+        if mean_ms > self.budget_ms:
+            self.windows_with_room = 0
+            if self.level + 1 < len(self.ladder):
+                self.change_level(self.level + 1, "over budget", mean_ms, p95_ms)
+                return True
+            if not self.warned_cheapest:
+                self.warned_cheapest = True
+                self.log("over budget at the cheapest level", mean_ms, p95_ms)
+            return False
+        self.warned_cheapest = False
+        if mean_ms < self.headroom * self.budget_ms and self.level > 0:
+            self.windows_with_room += 1
+            if self.windows_with_room >= self.upgrade_windows:
+                self.windows_with_room = 0
+                self.change_level(self.level - 1, "under budget", mean_ms, p95_ms)
+                return True
+        else:
+            self.windows_with_room = 0
+        return False
+
+    def change_level(self, level, reason, mean_ms, p95_ms):
+        previous = self.ladder[self.level]
+        self.level = level
+        self.log(reason, mean_ms, p95_ms, previous)
+
+    def log(self, reason, mean_ms, p95_ms, previous=None):
+        """
+        Prints the decision and appends it to the log file
+        """
+        img_size, detect_every, hp_every = self.ladder[self.level]
+        print(f"Scheduler: {reason} (mean {mean_ms:.1f}ms, p95 {p95_ms:.1f}ms, budget {self.budget_ms:.1f}ms), "
+              f"level {self.level}/{len(self.ladder) - 1}: img_size {img_size}, detect every {detect_every}, "
+              f"HP every {hp_every}")
+        if self.log_path is None:
+            return
+        entry = {"t": round(perf_counter() - self.started, 3), "frame": self.frames, "reason": reason,
+                 "mean_ms": round(mean_ms, 3), "p95_ms": round(p95_ms, 3), "budget_ms": self.budget_ms,
+                 "level": self.level, "img_size": img_size, "detect_every": detect_every, "hp_every": hp_every}
+        if previous is not None:
+            entry["previous"] = dict(zip(("img_size", "detect_every", "hp_every"), previous))
+        with open(self.log_path, "a") as f:
+            f.write(json.dumps(entry) + "\n")
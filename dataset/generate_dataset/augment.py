@@ -0,0 +1,231 @@
+# Augments a dataset generated by bootstrap.py in batches: every op works on a stack of samples at once
+# Needs Opencv and numpy: python -m pip install opencv-python numpy
+import os
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+
+import cv2
+import numpy as np
+
+####### Params ############
+# Dataset to augment, either a bootstrap.py output directory (images and labels) or one containing its shards
+input_dir = "output"
+# Where the augmented dataset is written, with the same layout as the input
+output_dir = "output_augmented"
+# Number of augmented copies of every sample
+copies = 1
+# Number of samples augmented at once (a batch of 2560x1440 samples takes ~45MB per sample while it is processed)
+batch_size = 4
+# Number of threads decoding and encoding the images
+workers = os.cpu_count() or 1
+# Seed of the augmentation (None uses a random seed)
+seed = None
+# Mirror the sample horizontally with this probability
+flip_probability = 0.5
+# Random zoom and shift: scale in [1 - scale_jitter, 1 + scale_jitter], shift of up to translate_jitter of the size
+affine_probability = 0.5
+scale_jitter = 0.15
+translate_jitter = 0.05
+# Boxes that keep less than this fraction of their area inside the image are dropped
+min_box_visibility = 0.5
+# Color jitter: brightness offset in [-brightness, brightness], contrast and saturation factors in [1 - x, 1 + x]
+color_probability = 0.8
+brightness = 20
+contrast = 0.2
+saturation = 0.3
+# Shift of the HP bar color (pixels within hp_lower - hp_margin and hp_upper + hp_margin, same values as config.ini)
+# in [-hp_shift, hp_shift] per channel so the model does not rely on one exact shade
+hp_probability = 0.3
+hp_lower = (205, 90, 90)
+hp_upper = (210, 95, 95)
+hp_margin = 10
+hp_shift = 8
+# Gaussian noise with a standard deviation of up to noise_sigma
+noise_probability = 0.3
+noise_sigma = 6.0
+# Gaussian blur with a sigma of up to blur_sigma
+blur_probability = 0.2
+blur_sigma = 1.4
+# JPEG quality of every sample is drawn from this range
+jpeg_quality = (60, 95)
+#####################################################
+"""
+This function finds every directory with the darknet layout (images and labels) below the given directory
+"""
+
+
+def dataset_dirs(root):
+    found = []
+    for dir_path, dir_names, _ in os.walk(root):
+        if "images" in dir_names and "labels" in dir_names:
+            found.append(os.path.relpath(dir_path, root))
+    return sorted(found)
+
+
+"""
+This function reads the labels file of a sample
+Returns the object classes and an array of [x_center, y_center, w, h] rows relative to the image size
+"""
+
+
+def read_labels(labels_path):
+    classes, boxes = [], []
+    if os.path.exists(labels_path):
+        with open(labels_path) as f:
+            for line in f:
+                values = line.split()
+                if len(values) == 5:
+                    classes.append(int(values[0]))
+                    boxes.append([float(v) for v in values[1:]])
+    return np.asarray(classes, dtype=np.int64), np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+
+
+"""
+This function applies the geometric transforms to the batch in place and moves the boxes along
+images: uint8 array of shape (batch, height, width, 3), boxes_list: list of (classes, boxes) per sample
+"""
+
+
+def augment_geometry(images, boxes_list, rng):
+    n, h, w = images.shape[:3]
+    flip = rng.random(n) < flip_probability
+    images[flip] = images[flip, :, ::-1]
+    affine = rng.random(n) < affine_probability
+    scales = np.where(affine, rng.uniform(1 - scale_jitter, 1 + scale_jitter, n), 1.0)
+    shifts = np.where(affine[:, None], rng.uniform(-translate_jitter, translate_jitter, (n, 2)), 0.0)
+    for i in np.flatnonzero(affine):
+        # Zoom around the image center, then shift
+        matrix = np.array([[scales[i], 0, (1 - scales[i]) * w / 2 + shifts[i, 0] * w],
+                           [0, scales[i], (1 - scales[i]) * h / 2 + shifts[i, 1] * h]])
+        images[i] = cv2.warpAffine(images[i], matrix, (w, h), flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_CONSTANT)
+    for i, (classes, boxes) in enumerate(boxes_list):
+        if len(boxes) == 0:
+            continue
+        boxes = boxes.copy()
+        if flip[i]:
+            boxes[:, 0] = 1 - boxes[:, 0]
+        boxes[:, :2] = (boxes[:, :2] - 0.5) * scales[i] + 0.5 + shifts[i]
+        boxes[:, 2:] *= scales[i]
+        # Clip the boxes to the image and drop the ones that are mostly outside of it
+        x0, y0 = np.clip(boxes[:, 0] - boxes[:, 2] / 2, 0, 1), np.clip(boxes[:, 1] - boxes[:, 3] / 2, 0, 1)
+        x1, y1 = np.clip(boxes[:, 0] + boxes[:, 2] / 2, 0, 1), np.clip(boxes[:, 1] + boxes[:, 3] / 2, 0, 1)
+        visible = (x1 - x0) * (y1 - y0) >= min_box_visibility * boxes[:, 2] * boxes[:, 3]
+        clipped = np.column_stack([(x0 + x1) / 2, (y0 + y1) / 2, x1 - x0, y1 - y0])
+        boxes_list[i] = (classes[visible], clipped[visible])
+
+
+"""
+This function applies the HP bar color shift, color jitter and noise to the batch in place
+The parameters are drawn for the whole batch at once and the jitter of every sample is folded into one 3x4 color
+matrix, so each sample is only passed over once per op, in uint8
+"""
+
+
+def augment_color(images, rng):
+    n = len(images)
+    hp = np.flatnonzero(rng.random(n) < hp_probability)
+    hp_shifts = rng.uniform(-hp_shift, hp_shift, (len(hp), 3))
+    lower = np.clip(np.asarray(hp_lower) - hp_margin, 0, 255)
+    upper = np.clip(np.asarray(hp_upper) + hp_margin, 0, 255)
+    for i, shift in zip(hp, hp_shifts):
+        mask = cv2.inRange(images[i], lower, upper).view(bool)
+        images[i][mask] = np.clip(np.rint(images[i][mask] + shift), 0, 255)
+    # Saturation mixes each pixel with its gray value: x' = s * x + (1 - s) * gray(x)
+    # Contrast scales around the mean gray value and brightness adds an offset
+    color = np.flatnonzero(rng.random(n) < color_probability)
+    offsets = rng.uniform(-brightness, brightness, len(color))
+    contrasts = rng.uniform(1 - contrast, 1 + contrast, len(color))
+    saturations = rng.uniform(1 - saturation, 1 + saturation, len(color))
+    gray_weights = np.array([0.299, 0.587, 0.114])
+    means = np.array([cv2.mean(images[i])[:3] for i in color]).reshape(-1, 3) @ gray_weights
+    mix = saturations[:, None, None] * np.eye(3) + (1 - saturations)[:, None, None] * gray_weights[None, None, :]
+    matrices = np.concatenate([contrasts[:, None, None] * mix,
+                               np.repeat(((1 - contrasts) * means + offsets)[:, None, None], 3, axis=1)], axis=2)
+    for i, matrix in zip(color, matrices):
+        cv2.transform(images[i], matrix, dst=images[i])
+    noisy = np.flatnonzero(rng.random(n) < noise_probability)
+    if len(noisy) > 0:
+        cv2.setRNGSeed(int(rng.integers(2 ** 31)))
+        noise = np.empty(images.shape[1:], dtype=np.int16)
+        for i, sigma in zip(noisy, rng.uniform(0, noise_sigma, len(noisy))):
+            cv2.randn(noise, 0, sigma)
+            cv2.add(images[i], noise, dst=images[i], dtype=cv2.CV_8U)
+
+
+"""
+This function blurs part of the batch in place
+"""
+
+
+def augment_blur(images, rng):
+    n = len(images)
+    blurred = np.flatnonzero(rng.random(n) < blur_probability)
+    for i, sigma in zip(blurred, rng.uniform(0.3, blur_sigma, len(blurred))):
+        cv2.GaussianBlur(images[i], (0, 0), sigma, dst=images[i])
+
+
+"""
+This function augments a batch of samples
+images: uint8 RGB array of shape (batch, height, width, 3), changed in place
+boxes_list: list of (classes, boxes) per sample, boxes as [x_center, y_center, w, h] rows relative to the image size
+Returns the boxes after the geometric transforms and the JPEG quality to encode every sample with
+"""
+
+
+def augment_batch(images, boxes_list, rng):
+    boxes_list = list(boxes_list)
+    augment_geometry(images, boxes_list, rng)
+    augment_color(images, rng)
+    augment_blur(images, rng)
+    qualities = rng.integers(jpeg_quality[0], jpeg_quality[1], len(images), endpoint=True)
+    return boxes_list, qualities
+
+
+def load_sample(sample):
+    image_path, labels_path = sample
+    return cv2.imread(image_path)[..., ::-1], read_labels(labels_path)
+
+
+def save_sample(image_path, labels_path, image, classes, boxes, quality):
+    cv2.imwrite(image_path, np.ascontiguousarray(image[..., ::-1]), [cv2.IMWRITE_JPEG_QUALITY, int(quality)])
+    with open(labels_path, "w") as f:
+        f.write("".join("{} {} {} {} {}\n".format(c, *box) for c, box in zip(classes, boxes)))
+
+
+########### Main function ######################
+if __name__ == '__main__':
+    rng = np.random.default_rng(seed)
+    samples = []
+    for rel_dir in dataset_dirs(input_dir):
+        os.makedirs(os.path.join(output_dir, rel_dir, "images"), exist_ok=True)
+        os.makedirs(os.path.join(output_dir, rel_dir, "labels"), exist_ok=True)
+        for f in sorted(os.listdir(os.path.join(input_dir, rel_dir, "images"))):
+            name = os.path.splitext(f)[0]
+            samples.append((os.path.join(input_dir, rel_dir, "images", f),
+                            os.path.join(input_dir, rel_dir, "labels", name + ".txt"), rel_dir, name))
+    print("Augmenting {} samples {} times".format(len(samples), copies))
+    start = perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending_writes = []
+        for batch_start in range(0, len(samples), batch_size):
+            batch = samples[batch_start:batch_start + batch_size]
+            loaded = list(executor.map(load_sample, [(s[0], s[1]) for s in batch]))
+            for copy in range(copies):
+                images = np.stack([image for image, _ in loaded])
+                boxes_list, qualities = augment_batch(images, [labels for _, labels in loaded], rng)
+                # Wait for the previous batch to be written before queueing this one, to bound the memory use
+                for future in pending_writes:
+                    future.result()
+                pending_writes = []
+                for (_, _, rel_dir, name), image, (classes, boxes), quality in zip(batch, images, boxes_list,
+                                                                                   qualities):
+                    out_name = name if copies == 1 else "{}_{}".format(name, copy)
+                    pending_writes.append(executor.submit(
+                        save_sample, os.path.join(output_dir, rel_dir, "images", out_name + ".jpg"),
+                        os.path.join(output_dir, rel_dir, "labels", out_name + ".txt"), image, classes, boxes,
+                        quality))
+        for future in pending_writes:
+            future.result()
+    elapsed = perf_counter() - start
+    print("Augmented {} samples in {:.1f}s ({:.1f}s per thousand)".format(
+        len(samples) * copies, elapsed, 1000 * elapsed / max(1, len(samples) * copies)))
@@ -1,13 +1,21 @@
 # Copyright 2019 Oliver Struckmeier
 # Licensed under the GNU General Public License, version 3.0. See LICENSE for details
 
+import os
+import io
 import random
+from collections import OrderedDict
+from functools import partial
+from multiprocessing import Pool
 from os import listdir
+from time import perf_counter
 
 import numpy as np
 from PIL import Image
 from PIL import ImageFilter
 
+from packed_dataset import ShardWriter, parse_labels, shard_path
+
 ####### Object Classes ####
 # 2: Red Canon
 # 1: Red Caster
@@ -37,6 +45,14 @@ output_dir = "output"
 print_box = False
 # Size of the datasets the program should generate
 dataset_size = 10000
+# Number of processes generating samples in parallel
+workers = os.cpu_count() or 1
+# Number of samples per shard, each shard is a subdirectory of output_dir with its own images and labels directories
+# (e.g. output/shard_000/images), 0 writes all samples to output_dir/images and output_dir/labels
+shard_size = 1000
+# "files" for the darknet images/labels layout, "packed" to write each shard as one output_dir/shard_NNN.pack file
+# (see packed_dataset.py, which also converts between the two)
+output_layout = "files"
 # Beginning index for naming output files
 start_index = 0
 # How many minons should be added minimum/maximum to each sample
@@ -57,6 +73,9 @@ bias_strength = 220  # 220 is good, dont select too large or the objects will be
 sampling_method = Image.BILINEAR  # IMO the best but use both to have more different methods
 # Add random noise to pixels
 noise = (0, 0, 0)
+# Format and quality the samples are encoded with (each sample is encoded once, after all objects are placed)
+output_format = "JPEG"  # "JPEG" or "PNG"
+output_quality = 75  # JPEG quality 1-95, ignored for PNG
 # Blur the image
 blur = False
 blur_strength = 1.4  # 0.6 is a good value
@@ -69,165 +88,233 @@ cursor_random = 0.2
 cursor_path = "../src_data/cursor"
 # Padding for the bias point (to keep the clustering of the minions from spawning minions outside of the image
 padding = 400
+# Memory limit of the decoded map backgrounds kept in memory by each worker (one 2560x1440 background is ~15MB)
+background_cache_mb = 512
+# Number of rotated and scaled minion/cursor images kept in memory by each worker, 0 to transform every object anew
+# When it is used the rotation and scale are rounded to the steps below so transformed images can be reused
+variant_cache_size = 0
+variant_angle_step = 1.0
+variant_scale_step = 0.02
+# Base seed, every sample is generated from seed + its index so the dataset does not depend on the number of workers
+# (None picks a random base seed and prints it)
+seed = None
+# Names of the minion subdirectories and their object classes
+minion_classes = {"red_cannon": 2, "red_caster": 1, "red_melee": 0}
 ########### Helper functions ###################
 """
-This funciton applies random noise to the rgb values of a pixel (R,G,B)
+Decoded images used to build the samples, indexed once per worker so the generation does not list directories or
+decode the same images again for every sample
 """
 
 
-def apply_noise(pixel):
-    R = max(0, min(255, pixel[0] + random.randint(-noise[0], noise[0])))
-    G = max(0, min(255, pixel[1] + random.randint(-noise[1], noise[1])))
-    B = max(0, min(255, pixel[2] + random.randint(-noise[2], noise[2])))
-    A = pixel[3]
-    return (R, G, B, A)
+class AssetCache:
+    def __init__(self):
+        # The minion and cursor images are small, so all of them are decoded up front as RGBA arrays
+        self.minion_dirs = sorted(listdir(masked_minions))
+        self.minion_files = {minions_dir: sorted(listdir(masked_minions + "/" + minions_dir))
+                             for minions_dir in self.minion_dirs if minions_dir in minion_classes}
+        self.cursor_files = sorted(listdir(cursor_path)) if cursors_max > 0 else []
+        self.sprites = {}
+        for minions_dir, files in self.minion_files.items():
+            for f in files:
+                self.sprites[masked_minions + "/" + minions_dir + "/" + f] = self.load(
+                    masked_minions + "/" + minions_dir + "/" + f)
+        for f in self.cursor_files:
+            self.sprites[cursor_path + "/" + f] = self.load(cursor_path + "/" + f)
+        # The backgrounds are large, so only the most recently used ones are kept
+        self.maps = sorted(listdir(map_images_dir))
+        self.backgrounds = OrderedDict()
+        self.background_bytes = 0
+        self.variants = OrderedDict()
+
+    @staticmethod
+    def load(path):
+        with Image.open(path) as image:
+            data = np.array(image.convert("RGBA"))
+        data.flags.writeable = False
+        return data
+
+    def background(self, path):
+        # Returns a writeable copy of the background since the objects are drawn onto it
+        if path in self.backgrounds:
+            self.backgrounds.move_to_end(path)
+            return self.backgrounds[path].copy()
+        data = self.load(path)
+        self.backgrounds[path] = data
+        self.background_bytes += data.nbytes
+        while self.background_bytes > background_cache_mb * 2 ** 20 and len(self.backgrounds) > 1:
+            _, evicted = self.backgrounds.popitem(last=False)
+            self.background_bytes -= evicted.nbytes
+        return data.copy()
+
+    def sprite(self, path, angle, scale_factor):
+        # Returns the RGBA array of the object rotated by angle (None for no rotation) and scaled by scale_factor
+        if variant_cache_size > 0:
+            angle = None if angle is None else round(angle / variant_angle_step) * variant_angle_step
+            scale_factor = round(scale_factor / variant_scale_step) * variant_scale_step
+            key = (path, angle, scale_factor)
+            if key in self.variants:
+                self.variants.move_to_end(key)
+                return self.variants[key]
+        obj = Image.fromarray(self.sprites[path])
+        if angle is not None:
+            obj = obj.rotate(angle, expand=True)
+        obj_w, obj_h = obj.size
+        obj = obj.resize((int(obj_w * scale_factor), int(obj_h * scale_factor)), resample=sampling_method)
+        data = np.array(obj)
+        if variant_cache_size > 0:
+            data.flags.writeable = False
+            self.variants[key] = data
+            if len(self.variants) > variant_cache_size:
+                self.variants.popitem(last=False)
+        return data
+
 
+# Assets of the current worker process, created by init_assets
+assets = None
 
+
+def init_assets():
+    global assets
+    assets = AssetCache()
+
+
+"""
+This funciton applies random noise to the rgb values of all pixels (R,G,B) of an RGBA image array
 """
-This function places a masked image with a given path onto a map fragment
+
+
+def apply_noise(data, np_rng):
+    rgb = data[..., :3].astype(np.int16)
+    for c in range(3):
+        rgb[..., c] += np_rng.integers(-noise[c], noise[c], size=rgb.shape[:2], endpoint=True, dtype=np.int16)
+    data[..., :3] = np.clip(rgb, 0, 255)
+    return data
+
+
+"""
+This function places a masked image with a given path onto the RGBA array of a map fragment, in place
 Passing -1 to the object class allows you to set objects like the UI that are not affected by rotations bias etc.
+rng and np_rng are the random.Random and numpy Generator of the current sample
+Returns the labels line of the object, or None if the object class is -1
 """
 
 
-def add_object(path, cur_image_path, object_class, bias_point, last):
-    # Set up the map data
-    map_image = Image.open(cur_image_path)
-    map_image = map_image.convert("RGBA")
-    # Cut the image to the desired output image size
-    map_data = map_image.getdata()
-    w, h = map_image.size
+def add_object(path, out_data, object_class, bias_point, rng, np_rng):
+    h, w = out_data.shape[:2]
     if verbose:
         print("Adding object: ", path)
-    # Read the image file of the current object to add
-    obj = Image.open(path)
+    angle = None
     if object_class >= 0:
         # Randomly rotate the image, but make the normal orientation most likely using a normal distribution
-        obj = obj.rotate(np.random.normal(loc=0.0, scale=rotate), expand=True)
-    obj = obj.convert("RGBA")
-    obj_w, obj_h = obj.size
+        angle = np_rng.normal(loc=0.0, scale=rotate)
     # Rescale the image based on the scale factor
     if object_class == 0 or object_class == 1 or object_class == 2:  # red canon minion
-        scale_factor = random.uniform(scale_minions - random_scale_minions, scale_minions + random_scale_minions)
-        size = int(obj_w * scale_factor), int(obj_h * scale_factor)
+        scale_factor = rng.uniform(scale_minions - random_scale_minions, scale_minions + random_scale_minions)
     elif object_class == -1:  # Cursor
-        scale_factor = random.uniform(cursor_scale - cursor_random, cursor_scale + cursor_random)
-        size = int(obj_w * scale_factor), int(obj_h * scale_factor)
+        scale_factor = rng.uniform(cursor_scale - cursor_random, cursor_scale + cursor_random)
     else:
-        size = int(obj_w), int(obj_h)
+        scale_factor = 1
 
     # Compute the position of minions based on the bias point. Normally distribute the mininons around 
     # a central point to create clusters of objects for more realistic screenshot fakes
     # Champions and structures are uniformly distributed
     if object_class == -1:  # Champion or structure or cursor
-        obj_pos_center = (random.randint(0, w - 1), random.randint(0, h - 1))
+        obj_pos_center = (rng.randint(0, w - 1), rng.randint(0, h - 1))
     else:
-        x_coord = np.random.normal(loc=bias_point[0], scale=bias_strength)
-        y_coord = np.random.normal(loc=bias_point[1], scale=bias_strength)
+        x_coord = np_rng.normal(loc=bias_point[0], scale=bias_strength)
+        y_coord = np_rng.normal(loc=bias_point[1], scale=bias_strength)
         obj_pos_center = (int(x_coord), int(y_coord))
 
-    # Resize the image based on the scaling above
-    obj = obj.resize(size, resample=sampling_method)
-    obj_w, obj_h = obj.size
+    # Rotate and resize the image based on the values above
+    obj_data = assets.sprite(path, angle, scale_factor)
+    obj_h, obj_w = obj_data.shape[:2]
 
     if verbose:
         print("Placing at : {}|{}".format(obj_pos_center[0], obj_pos_center[1]))
-    # Extract the image data
-    obj_data = obj.getdata()
-    out_data = np.array(map_image)
-    last_pixel = 0
     # Compute the object corners
     min_x = int(min(w, max(0, obj_pos_center[0] - obj_w / 2 - 2)))
     max_x = int(min(w, max(0, obj_pos_center[0] + obj_w / 2 + 2)))
     min_y = int(min(h, max(0, obj_pos_center[1] - obj_h / 2 - 2)))
     max_y = int(min(h, max(0, obj_pos_center[1] + obj_h / 2 + 2)))
+    # Top left corner of the object and the part of it that is inside the image
+    obj_x0 = obj_pos_center[0] - int(obj_w / 2)
+    obj_y0 = obj_pos_center[1] - int(obj_h / 2)
+    x0, x1 = max(min_x, obj_x0), min(max_x, obj_x0 + obj_w)
+    y0, y1 = max(min_y, obj_y0), min(max_y, obj_y0 + obj_h)
     # Place the images
-    for y in range(min_y, max_y):
-        for x in range(min_x, max_x):
-            pixel = (0, 0, 0, 0)
-            # Compute the pixel index in the map fragment
-            map_index = x + w * y
-            # print("x: ", x, " y: ", y)
-            # If we want to print the box around the object, set the pixel to red
-            if print_box is True and y == obj_pos_center[1] - int(obj_h / 2) and \
-                    obj_pos_center[0] - int(obj_w / 2) < x < obj_pos_center[0] + int(obj_w / 2):
-                pixel = (255, 0, 0, 255)
-            elif print_box is True and y == obj_pos_center[1] + int(obj_h / 2) and \
-                    obj_pos_center[0] - int(obj_w / 2) < x < obj_pos_center[0] + int(obj_w / 2):
-                pixel = (255, 0, 0, 255)
-            elif print_box is True and x == obj_pos_center[0] - int(obj_w / 2) and \
-                    obj_pos_center[1] - int(obj_h / 2) < y < obj_pos_center[1] + int(obj_h / 2):
-                pixel = (255, 0, 0, 255)
-            elif print_box is True and x == obj_pos_center[0] + int(obj_w / 2) and \
-                    obj_pos_center[1] - int(obj_h / 2) < y < obj_pos_center[1] + int(obj_h / 2):
-                pixel = (255, 0, 0, 255)
-            else:
-                # Replace the old input image pixels with the object to add pixels
-                if obj_pos_center[0] - int(obj_w / 2) <= x <= obj_pos_center[0] + int(obj_w / 2) \
-                        and obj_pos_center[1] - int(obj_h / 2) <= y <= obj_pos_center[1] + int(obj_h / 2):
-                    obj_x = x - obj_pos_center[0] - int(obj_w / 2) - 1
-                    obj_y = y - obj_pos_center[1] - int(obj_h / 2) - 1
-                    object_index = (obj_x + obj_w * obj_y)
-                    # Check the alpha channel of the object to add
-                    # If it is smaller 150, the pixel is invisible, 255: fully visible, 150: seethrough (brush simulation)
-                    # Then use the original images pixel value
-                    # Else use the object to adds pixel value
-                    if obj_data[object_index][3] == 255:
-                        pixel = (obj_data[object_index][0], obj_data[object_index][1], obj_data[object_index][2], 255)
-                        last_pixel += 1
-                    elif obj_data[object_index][3] == 0:
-                        pixel = (map_data[map_index][0], map_data[map_index][1], map_data[map_index][2], 255)
-                else:
-                    pixel = (
-                        map_data[map_index][0], map_data[map_index][1], map_data[map_index][2], map_data[map_index][3])
-            out_data[y, x] = pixel
-    if last and (noise[0] > 0 or noise[1] > 0 or noise[2] > 0):
-        for y in range(0, h):
-            for x in range(0, w):
-                # Compute the pixel index in the map fragment
-                map_index = x + w * y
-                out_data[y, x] = apply_noise(out_data[y, x])
-    # Save the image
-    map_image = Image.fromarray(np.array(out_data))
-    if blur and last:
-        map_image = map_image.filter(ImageFilter.GaussianBlur(radius=blur_strength))
-    map_image = map_image.convert("RGB")
-    map_image.save(output_dir + "/images/" + filename + ".jpg", "JPEG")
-    # Append the bounding box data to the labels file if the object class is not -1
+    if x0 < x1 and y0 < y1:
+        obj_crop = obj_data[y0 - obj_y0:y1 - obj_y0, x0 - obj_x0:x1 - obj_x0]
+        region = out_data[y0:y1, x0:x1]
+        alpha = obj_crop[..., 3]
+        # Check the alpha channel of the object to add
+        # If it is 0, the pixel is invisible, 255: fully visible, anything else: seethrough (brush simulation)
+        # Then use the original images pixel value, the object to adds pixel value, or leave the pixel empty
+        region[alpha == 255] = obj_crop[alpha == 255]
+        region[alpha == 0, 3] = 255
+        region[(alpha > 0) & (alpha < 255)] = 0
+    # If we want to print the box around the object, set the pixels on its border to red
+    if print_box is True:
+        half_w, half_h = int(obj_w / 2), int(obj_h / 2)
+        for y in (obj_pos_center[1] - half_h, obj_pos_center[1] + half_h):
+            if min_y <= y < max_y:
+                out_data[y, max(min_x, obj_pos_center[0] - half_w + 1):min(max_x, obj_pos_center[0] + half_w)] = \
+                    (255, 0, 0, 255)
+        for x in (obj_pos_center[0] - half_w, obj_pos_center[0] + half_w):
+            if min_x <= x < max_x:
+                out_data[max(min_y, obj_pos_center[1] - half_h + 1):min(max_y, obj_pos_center[1] + half_h), x] = \
+                    (255, 0, 0, 255)
+    # Return the bounding box data for the labels file if the object class is not -1
     if object_class >= 0:
-        with open(output_dir + "/labels/" + filename + ".txt", "a") as f:
-            # Write the position of the object and its bounding box data to the labels file
-            # All values are relative to the whole image size
-            # Format: class, x_pos, y_pos, width, height
-            f.write("" + str(object_class) + " " + str(float(obj_pos_center[0] / w)) + " " + str(
-                float(obj_pos_center[1] / h)) + " " + str(float(obj_w / w)) + " " + str(float(obj_h / h)) + "\n")
+        # The position of the object and its bounding box data, all values are relative to the whole image size
+        # Format: class, x_pos, y_pos, width, height
+        return "" + str(object_class) + " " + str(float(obj_pos_center[0] / w)) + " " + str(
+            float(obj_pos_center[1] / h)) + " " + str(float(obj_w / w)) + " " + str(float(obj_h / h)) + "\n"
+    return None
 
 
-########### Main function ######################
-maps = sorted(listdir(map_images_dir))
+image_extension = ".png" if output_format == "PNG" else ".jpg"
+
+"""
+This function returns the directory a sample is written to, following the darknet layout (images and labels)
+"""
+
+
+def sample_dir(index):
+    if shard_size <= 0:
+        return output_dir
+    return output_dir + "/shard_{:03d}".format(index // shard_size)
+
+
+"""
+This function generates and writes the sample with the given index
+Its random state only depends on the base seed and the index, so it is the same whatever process generates it
+Returns the time the sample took in seconds, and for the packed layout the sample's name, encoded image and labels
+"""
+
 
-for dataset in range(0, dataset_size):
-    filename = str(dataset + start_index)
-    print("Dataset: ", dataset, " / ", dataset_size, " : ", filename)
+def generate_sample(index, base_seed):
+    sample_start = perf_counter()
+    rng = random.Random(base_seed + index)
+    np_rng = np.random.default_rng(base_seed + index)
+    filename = str(index)
+    sample_output_dir = sample_dir(index)
+    if verbose:
+        print("Dataset: ", index - start_index, " / ", dataset_size, " : ", filename)
     # Randomly select a map background
-    mp_fnam = map_images_dir + "/" + random.choice(maps)
+    mp_fnam = map_images_dir + "/" + rng.choice(assets.maps)
     if verbose:
         print("Using map fragment: ", mp_fnam)
 
     # Randomly add 0-12 minions to the image
     # TODO change classification for blue and superminions
     minions = []
-    for i in range(0, random.randint(minions_min, minions_max)):
+    for i in range(0, rng.randint(minions_min, minions_max)):
         # Select a random subdirectory because the minions are sorted in subdirectories
-        minions_dir = random.choice(sorted(listdir(masked_minions)))
-        if minions_dir == "red_cannon":
-            minions.append([masked_minions + "/" + minions_dir + "/" + random.choice(
-                sorted(listdir(masked_minions + "/" + minions_dir))), 2])
-        elif minions_dir == "red_caster":
-            minions.append([masked_minions + "/" + minions_dir + "/" + random.choice(
-                sorted(listdir(masked_minions + "/" + minions_dir))), 1])
-        elif minions_dir == "red_melee":
-            minions.append([masked_minions + "/" + minions_dir + "/" + random.choice(
-                sorted(listdir(masked_minions + "/" + minions_dir))), 0])
+        minions_dir = rng.choice(assets.minion_dirs)
+        if minions_dir in minion_classes:
+            minions.append([masked_minions + "/" + minions_dir + "/" + rng.choice(assets.minion_files[minions_dir]),
+                            minion_classes[minions_dir]])
         else:
             print("Error: This folder: ", minions_dir,
                   " was not specified to contain masked images. Skipping. Atention! Dataset might be broken!")
@@ -236,19 +323,17 @@ for dataset in range(0, dataset_size):
 
     # Now figure out the order in which we want to add the objects (So that sometimes objects will overlap)
     objects_to_add = minions
-    random.shuffle(objects_to_add)
-    # Read in the current map background as image
-    map_image = Image.open(mp_fnam)
-    w, h = map_image.size
+    rng.shuffle(objects_to_add)
+    # Read in the current map background, the whole sample is composed in memory
+    out_data = assets.background(mp_fnam)
+    h, w = out_data.shape[:2]
     # Make sure the image is 2560x1440 (otherwise the overlay might not fit properly)
     assert (w == 2560 and h == 1440), "Error image has to be 2560x1440"
+    labels = []
 
-    map_image.save(output_dir + "/images/" + filename + ".jpg", "JPEG")
-    cur_image_path = output_dir + "/images/" + filename + ".jpg"
     # Iterate through all objects in the order we want them to be added and add them to the background
-    # Note this function also saves the image already
     # Point around which the objects will be clustered
-    bias_point = (random.randint(padding, w - 1 - padding), random.randint(padding, h - 1 - padding))
+    bias_point = (rng.randint(padding, w - 1 - padding), rng.randint(padding, h - 1 - padding))
     gui_areas = [[2000, 700, 2560, 1440], [750, 1250, 1600, 1440]]
     in_gui = True
 
@@ -261,20 +346,73 @@ for dataset in range(0, dataset_size):
             else:
                 in_gui = False
         if in_gui:
-            bias_point = (random.randint(padding, w - 1 - padding), random.randint(padding, h - 1 - padding))
+            bias_point = (rng.randint(padding, w - 1 - padding), rng.randint(padding, h - 1 - padding))
 
     for i in range(0, len(objects_to_add)):
         o = objects_to_add.pop()
-        if len(objects_to_add) == 0:
-            add_object(o[0], cur_image_path, o[1], bias_point, True)  # Set last to true to apply the possible noise
-        else:
-            add_object(o[0], cur_image_path, o[1], bias_point, False)
+        labels.append(add_object(o[0], out_data, o[1], bias_point, rng, np_rng))
+    # Apply the possible noise and blur after the last minion
+    if noise[0] > 0 or noise[1] > 0 or noise[2] > 0:
+        out_data = apply_noise(out_data, np_rng)
+    if blur:
+        out_data = np.array(Image.fromarray(out_data).filter(ImageFilter.GaussianBlur(radius=blur_strength)))
     # Lastly add a cursor
-    for i in range(cursors_min, random.randint(cursors_min, cursors_max)):
-        cursor = cursor_path + "/" + random.choice(sorted(listdir(cursor_path)))
-        add_object(cursor, cur_image_path, -1, bias_point, False)
-        # If no objects were added we still have to create an empty txt file
-    with open(output_dir + "/labels/" + filename + ".txt", "a") as f:
-        f.write("")
+    for i in range(cursors_min, rng.randint(cursors_min, cursors_max)):
+        cursor = cursor_path + "/" + rng.choice(assets.cursor_files)
+        add_object(cursor, out_data, -1, bias_point, rng, np_rng)
+    # Encode the image and write the labels once, if no objects were added the txt file is still created (empty)
+    map_image = Image.fromarray(out_data).convert("RGB")
+    labels_text = "".join(label for label in labels if label is not None)
+    if output_layout == "packed":
+        # The main process writes the sample into its shard
+        encoded = io.BytesIO()
+        if output_format == "PNG":
+            map_image.save(encoded, "PNG")
+        else:
+            map_image.save(encoded, "JPEG", quality=output_quality)
+        return perf_counter() - sample_start, (filename, encoded.getvalue(), labels_text)
+    if output_format == "PNG":
+        map_image.save(sample_output_dir + "/images/" + filename + image_extension, "PNG")
+    else:
+        map_image.save(sample_output_dir + "/images/" + filename + image_extension, "JPEG", quality=output_quality)
+    with open(sample_output_dir + "/labels/" + filename + ".txt", "w") as f:
+        f.write(labels_text)
     if verbose:
         print("=======================================")
+    return perf_counter() - sample_start, None
+
+
+########### Main function ######################
+if __name__ == '__main__':
+    if seed is None:
+        seed = random.SystemRandom().randrange(2 ** 31)
+    print("Generating {} samples with {} workers, base seed {}".format(dataset_size, workers, seed))
+    indices = range(start_index, start_index + dataset_size)
+    if output_layout == "packed":
+        os.makedirs(output_dir, exist_ok=True)
+    else:
+        for shard_dir in sorted(set(sample_dir(index) for index in indices)):
+            os.makedirs(shard_dir + "/images", exist_ok=True)
+            os.makedirs(shard_dir + "/labels", exist_ok=True)
+    start = perf_counter()
+    sample_times = []
+    writer, writer_shard = None, None
+    with Pool(workers, initializer=init_assets) as pool:
+        # Samples are printed (and packed) in index order as they finish
+        for index, (sample_time, packed) in zip(indices, pool.imap(
+                partial(generate_sample, base_seed=seed), indices,
+                chunksize=max(1, min(16, dataset_size // (4 * workers))))):
+            if packed is not None:
+                shard = index // shard_size if shard_size > 0 else 0
+                if shard != writer_shard:
+                    if writer is not None:
+                        writer.close()
+                    writer, writer_shard = ShardWriter(shard_path(output_dir, shard)), shard
+                writer.add(packed[0], packed[1], parse_labels(packed[2]), image_extension)
+            print("Sample {} took {:.1f}ms".format(index, sample_time * 1000))
+            sample_times.append(sample_time)
+    if writer is not None:
+        writer.close()
+    elapsed = perf_counter() - start
+    print("Generated {} samples in {:.1f}s ({:.1f} samples per second, {:.1f}ms per sample)".format(
+        dataset_size, elapsed, dataset_size / max(elapsed, 1e-9), 1000 * sum(sample_times) / max(1, dataset_size)))
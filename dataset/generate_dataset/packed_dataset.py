@@ -0,0 +1,281 @@
+# Packs a dataset generated by bootstrap.py into a few large shard files instead of one image and one labels file per
+# sample, and reads them back with random access or as a stream
+#
+# Layout of a shard file (little endian):
+# - header (HEADER_DTYPE), padded to ALIGNMENT bytes
+# - the encoded images (JPEG/PNG bytes as written by bootstrap.py), one after another
+# - the index (INDEX_DTYPE), one row per sample with the byte offset and length of its image and its rows in the labels
+# - the labels table (LABEL_DTYPE), one row per object, in sample order
+# The index and the labels table are memory-mapped by the reader, so opening a shard does not read the samples
+import io
+import mmap
+import os
+from argparse import ArgumentParser
+
+import numpy as np
+from PIL import Image
+
+MAGIC = b"LCSPACK1"
+VERSION = 1
+ALIGNMENT = 64
+SHARD_EXTENSION = ".pack"
+HEADER_DTYPE = np.dtype([("magic", "S8"), ("version", "<u4"), ("reserved", "<u4"), ("samples", "<u8"),
+                         ("labels", "<u8"), ("index_offset", "<u8"), ("labels_offset", "<u8")])
+INDEX_DTYPE = np.dtype([("offset", "<u8"), ("length", "<u8"), ("label_start", "<u8"), ("label_count", "<u4"),
+                        ("extension", "S4"), ("name", "S48")])
+# Same columns as the darknet labels files: class, x_center, y_center, w, h relative to the image size
+LABEL_DTYPE = np.dtype([("cls", "<i4"), ("x", "<f8"), ("y", "<f8"), ("w", "<f8"), ("h", "<f8")])
+
+
+def aligned(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def parse_labels(text):
+    """
+    :param text: Contents of a darknet labels file
+    :return: LABEL_DTYPE array with one row per object
+    """
+    rows = [tuple([int(values[0])] + [float(v) for v in values[1:]])
+            for values in (line.split() for line in text.splitlines()) if len(values) == 5]
+    return np.array(rows, dtype=LABEL_DTYPE)
+
+
+def format_labels(labels):
+    """
+    :param labels: LABEL_DTYPE array
+    :return: Contents of the darknet labels file, in the same format bootstrap.py writes
+    """
+    return "".join("{} {} {} {} {}\n".format(int(row["cls"]), float(row["x"]), float(row["y"]), float(row["w"]),
+                                             float(row["h"])) for row in labels)
+
+
+class ShardWriter:
+    """
+    Writes samples into one shard file, the images are streamed to disk and the index is written on close
+    """
+
+    def __init__(self, path):
+        """
+        :param path: Path of the shard file
+        """
+        self.path = path
+        self.file = open(path, "wb")
+        self.file.write(b"\0" * ALIGNMENT)
+        self.index = []
+        self.labels = []
+        self.label_count = 0
+
+    def add(self, name, image_bytes, labels, extension=".jpg"):
+        """
+        :param name: Sample name, the file name without extension in the images/labels layout
+        :param image_bytes: Encoded image
+        :param labels: LABEL_DTYPE array of the objects in the image
+        :param extension: Extension of the encoded image
+        """
+        if len(name.encode()) > INDEX_DTYPE["name"].itemsize:
+            raise ValueError(f"Sample name {name} is too long for the index")
+        offset = self.file.tell()
+        self.file.write(image_bytes)
+        self.index.append((offset, len(image_bytes), self.label_count, len(labels), extension.lstrip(".").encode(),
+                           name.encode()))
+        self.labels.append(labels)
+        self.label_count += len(labels)
+
+    def close(self):
+        index = np.array(self.index, dtype=INDEX_DTYPE)
+        labels = np.concatenate(self.labels) if len(self.labels) > 0 else np.zeros(0, dtype=LABEL_DTYPE)
+        index_offset = aligned(self.file.tell())
+        labels_offset = aligned(index_offset + index.nbytes)
+        self.file.write(b"\0" * (index_offset - self.file.tell()))
+        self.file.write(index.tobytes())
+        self.file.write(b"\0" * (labels_offset - self.file.tell()))
+        self.file.write(labels.tobytes())
+        header = np.array([(MAGIC, VERSION, 0, len(index), len(labels), index_offset, labels_offset)],
+                          dtype=HEADER_DTYPE)
+        self.file.seek(0)
+        self.file.write(header.tobytes())
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ShardReader:
+    """
+    Memory-maps one shard file
+    """
+
+    def __init__(self, path):
+        """
+        :param path: Path of the shard file
+        """
+        self.path = path
+        header = np.fromfile(path, dtype=HEADER_DTYPE, count=1)[0]
+        if header["magic"] != MAGIC or header["version"] != VERSION:
+            raise ValueError(f"{path} is not a version {VERSION} packed dataset shard")
+        self.index = np.memmap(path, dtype=INDEX_DTYPE, mode="r", offset=int(header["index_offset"]),
+                               shape=(int(header["samples"]),))
+        self.labels_table = np.memmap(path, dtype=LABEL_DTYPE, mode="r", offset=int(header["labels_offset"]),
+                                      shape=(int(header["labels"]),))
+        self.file = open(path, "rb")
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __len__(self):
+        return len(self.index)
+
+    def name(self, i):
+        return self.index[i]["name"].decode()
+
+    def image_bytes(self, i):
+        """
+        :return: Encoded image of sample i
+        """
+        row = self.index[i]
+        return self.data[int(row["offset"]):int(row["offset"] + row["length"])]
+
+    def image(self, i):
+        """
+        :return: Numpy array (RGB) of sample i
+        """
+        with Image.open(io.BytesIO(self.image_bytes(i))) as image:
+            return np.asarray(image.convert("RGB"))
+
+    def labels(self, i):
+        """
+        :return: LABEL_DTYPE rows of sample i, a view of the memory-mapped labels table
+        """
+        row = self.index[i]
+        return self.labels_table[int(row["label_start"]):int(row["label_start"] + row["label_count"])]
+
+    def __getitem__(self, i):
+        return self.image(i), self.labels(i)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def close(self):
+        # The index and labels memory maps are released once no views of them are left
+        self.data.close()
+        self.file.close()
+
+
+class PackedDataset:
+    """
+    All shards of a packed dataset as one sequence of samples
+    """
+
+    def __init__(self, pack_dir):
+        """
+        :param pack_dir: Directory of the shard files
+        """
+        self.shards = [ShardReader(os.path.join(pack_dir, f)) for f in sorted(os.listdir(pack_dir))
+                       if f.endswith(SHARD_EXTENSION)]
+        if len(self.shards) == 0:
+            raise ValueError(f"No shards found in {pack_dir}")
+        self.starts = np.cumsum([0] + [len(shard) for shard in self.shards])
+
+    def __len__(self):
+        return int(self.starts[-1])
+
+    def locate(self, i):
+        """
+        :return: The shard holding sample i and the index of the sample in it
+        """
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        shard = int(np.searchsorted(self.starts, i, side="right")) - 1
+        return self.shards[shard], i - int(self.starts[shard])
+
+    def __getitem__(self, i):
+        shard, j = self.locate(i)
+        return shard[j]
+
+    def __iter__(self):
+        # Streams the shards one after another, which reads each file sequentially
+        for shard in self.shards:
+            yield from shard
+
+    def close(self):
+        for shard in self.shards:
+            shard.close()
+
+
+def shard_path(pack_dir, shard):
+    return os.path.join(pack_dir, "shard_{:03d}{}".format(shard, SHARD_EXTENSION))
+
+
+def pack(dataset_dir, pack_dir, samples_per_shard=1000):
+    """
+    Converts the images/labels layout (a bootstrap.py output directory, or one containing its shards) into shard files
+    :param dataset_dir: Directory to convert
+    :param pack_dir: Directory the shard files are written to
+    :param samples_per_shard: Number of samples per shard file
+    :return: Number of samples packed
+    """
+    samples = []
+    for dir_path, dir_names, _ in sorted(os.walk(dataset_dir)):
+        if "images" in dir_names and "labels" in dir_names:
+            for f in sorted(os.listdir(os.path.join(dir_path, "images"))):
+                samples.append((os.path.join(dir_path, "images", f),
+                                os.path.join(dir_path, "labels", os.path.splitext(f)[0] + ".txt")))
+    os.makedirs(pack_dir, exist_ok=True)
+    writer = None
+    for i, (image_path, labels_path) in enumerate(samples):
+        if i % samples_per_shard == 0:
+            if writer is not None:
+                writer.close()
+            writer = ShardWriter(shard_path(pack_dir, i // samples_per_shard))
+        with open(image_path, "rb") as f:
+            image_bytes = f.read()
+        text = ""
+        if os.path.exists(labels_path):
+            with open(labels_path) as f:
+                text = f.read()
+        name, extension = os.path.splitext(os.path.basename(image_path))
+        writer.add(name, image_bytes, parse_labels(text), extension)
+    if writer is not None:
+        writer.close()
+    return len(samples)
+
+
+def unpack(pack_dir, dataset_dir):
+    """
+    Converts shard files back into the images/labels layout, the images are copied without re-encoding them
+    :param pack_dir: Directory of the shard files
+    :param dataset_dir: Directory the images and labels directories are written to
+    :return: Number of samples unpacked
+    """
+    dataset = PackedDataset(pack_dir)
+    os.makedirs(os.path.join(dataset_dir, "images"), exist_ok=True)
+    os.makedirs(os.path.join(dataset_dir, "labels"), exist_ok=True)
+    for shard in dataset.shards:
+        for i in range(len(shard)):
+            name, extension = shard.name(i), shard.index[i]["extension"].decode()
+            with open(os.path.join(dataset_dir, "images", name + "." + extension), "wb") as f:
+                f.write(shard.image_bytes(i))
+            with open(os.path.join(dataset_dir, "labels", name + ".txt"), "w") as f:
+                f.write(format_labels(shard.labels(i)))
+    count = len(dataset)
+    dataset.close()
+    return count
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description="Converts a dataset between the images/labels layout and packed shard files")
+    parser.add_argument("mode", choices=["pack", "unpack"], help="pack: images/labels -> shards, unpack: the reverse")
+    parser.add_argument("input", help="Dataset directory to pack, or directory of shards to unpack")
+    parser.add_argument("output", help="Directory to write the shards or the images/labels layout to")
+    parser.add_argument("--samples_per_shard", type=int, default=1000, help="Number of samples per shard file")
+    args = parser.parse_args()
+
+    if args.mode == "pack":
+        print("Packed {} samples into {}".format(pack(args.input, args.output, args.samples_per_shard), args.output))
+    else:
+        print("Unpacked {} samples into {}".format(unpack(args.input, args.output), args.output))
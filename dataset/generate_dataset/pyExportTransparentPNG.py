@@ -1,8 +1,13 @@
+import hashlib
+import json
+import os
+from multiprocessing import Pool
 from os import listdir
 
-from PIL import Image, ImageFilter
+import numpy as np
+from PIL import Image
 
-# - There was an error with tile out of range
+# - There was an error with tile out of range (failing files are now reported and retried on the next run)
 
 ################# Parameters ########################
 # Input directory of images
@@ -32,122 +37,159 @@ tolerance_offset_2 = 0.74  # Greenscreen: 0.74
 tolerance_offset_3 = 2.5  # Teemo viewer: 2.5
 # Remove the outline of the images in case there are any masking artifacts, set the number of layers to be removed
 remove_outline = 1
+# Number of processes exporting images in parallel
+workers = os.cpu_count() or 1
+# The manifest in the output directory records what every input was exported to, so only new or changed inputs
+# are exported again. Inputs are compared by size and modification time, or by size and content hash if this is True
+manifest_hash = False
+manifest_path = output_dir + "/manifest.json"
 #####################################################
 """
-This function applies a filter to a masked image and can either remove 
-or add differntly colored borders around objects
+This function removes the outer layers of pixels of a masked image, in place
+Every visible pixel that touches a transparent pixel or the image border is made transparent, once per layer
 """
 
 
-def modify_outline(f, thickness):
-    image = Image.open(output_dir + "/" + f + ".png")
-    image = image.convert("RGBA")
+def modify_outline(data, thickness):
     for t in range(thickness):
-        mask = image.filter(ImageFilter.FIND_EDGES)
-        mask_data = mask.getdata()
-        image_data = image.getdata()
-        w, h = mask_data.size
-
-        out_data = []
-        for y in range(0, h):
-            for x in range(0, w):
-                index = x + w * y
-                pixel = (0, 0, 0, 0)
-                if mask_data[index][3] > 0:
-                    pixel = (255, 255, 255, 0)
-                else:
-                    pixel = (image_data[index][0], image_data[index][1], image_data[index][2], image_data[index][3])
-                out_data.append(pixel)
-        image.putdata(out_data)
-    image.save(output_dir + "/" + f + ".png", "PNG")
-
-
-def get_min_max_x(newData, w, h):
-    min_value = 0
-    max_value = 0
-    for x in range(w - 1, 0, -1):
-        for y in range(0, h - 1):
-            data_index = x + w * y
-            if newData[data_index][3] != 0:
-                max_value = x
-                break
-        else:
-            continue
-        break
-    for x in range(0, w - 1):
-        for y in range(0, h - 1):
-            data_index = x + w * y
-            if newData[data_index][3] != 0:
-                min_value = x
-                break
-        else:
-            continue
-        break
-    return min_value, max_value
-
-
-def get_min_max(newData, w, h):
-    min_value = 0
-    max_value = 0
-    for y in range(h - 1, 0, -1):
-        for x in range(0, w - 1):
-            data_index = x + w * y
-            if newData[data_index][3] != 0:
-                max_value = y
-                break
-        else:
-            continue
-        break
-    for y in range(0, h - 1):
-        for x in range(0, w - 1):
-            data_index = x + w * y
-            if newData[data_index][3] != 0:
-                min_value = y
-                break
-        else:
-            continue
-        break
-    return min_value, max_value
-
-
-# Get list of files in the input directory
-files = sorted(listdir(input_dir))
-
-for f in files:
-    # Remove the jpg ending
-    fname = f.split(".")[0]
-    print(fname)
-    img = Image.open(input_dir + "/" + fname + ".jpg")
-    # Add alpha channel
-    img = img.convert("RGBA")
+        visible = np.zeros((data.shape[0] + 2, data.shape[1] + 2), dtype=bool)
+        visible[1:-1, 1:-1] = data[..., 3] > 0
+        # A pixel stays visible only if all 8 neighbours are visible too
+        inner = visible[1:-1, 1:-1].copy()
+        for dy in range(3):
+            for dx in range(3):
+                inner &= visible[dy:dy + data.shape[0], dx:dx + data.shape[1]]
+        data[visible[1:-1, 1:-1] & ~inner] = (255, 255, 255, 0)
+    return data
+
+
+"""
+This function masks out the background color
+Returns an RGBA array of the image where the background pixels are (255, 255, 255, 0) and all others are opaque
+"""
+
+
+def chroma_key(rgb):
+    bg = np.asarray(background, dtype=np.float32)
+    offsets = np.array([tolerance_offset_1, tolerance_offset_2, tolerance_offset_3], dtype=np.float32) * tolerance
+    key = np.all((rgb > bg - offsets) & (rgb < bg + offsets), axis=2)
+    data = np.empty(rgb.shape[:2] + (4,), dtype=np.uint8)
+    data[..., :3] = rgb
+    data[..., 3] = 255
+    data[key] = (255, 255, 255, 0)
+    return data
+
+
+"""
+This function finds the tight bounding box of the visible pixels
+Returns (min_x, min_y, max_x, max_y) with exclusive maximums, or None if no pixel is visible
+"""
+
+
+def get_bounding_box(data):
+    visible = data[..., 3] != 0
+    cols = np.flatnonzero(visible.any(axis=0))
+    rows = np.flatnonzero(visible.any(axis=1))
+    if len(cols) == 0:
+        return None
+    return cols[0], rows[0], cols[-1] + 1, rows[-1] + 1
+
+
+"""
+This function extracts the sprite from a full RGB frame
+Returns the RGBA array of the masked and cropped sprite, or None if the frame does not contain an object
+"""
+
 
+def extract_sprite(rgb):
     # Pre crop to save runtime
-    cropped = img.crop(area)
-    datas = cropped.getdata()
-    newData = []
-    for item in datas:
-        if item[0] > background[0] - tolerance_offset_1 * tolerance and item[0] < background[
-            0] + tolerance_offset_1 * tolerance \
-                and item[1] > background[1] - tolerance * tolerance_offset_2 and item[1] < background[
-            1] + tolerance_offset_2 * tolerance \
-                and item[2] > background[2] - tolerance_offset_3 * tolerance and item[2] < background[
-            2] + tolerance_offset_3 * tolerance:
-            newData.append((255, 255, 255, 0))
-        else:
-            newData.append((item[0], item[1], item[2], 255))
-
-    # Save new image data
-    cropped.putdata(newData)
-    w, h = cropped.size
+    data = chroma_key(rgb[area[1]:area[3], area[0]:area[2]])
     # Crop image to pixel content
-    min_y, max_y = get_min_max(newData, w, h)
-    # Trick: rotate the image by 9 degrees and apply the same functions
-    temp = cropped.rotate(90)
-    temp_w, temp_h = temp.size
-    tempData = temp.getdata()
-    min_x, max_x = get_min_max_x(newData, w, h)
-    # Save output image as png
-    cropped = cropped.crop((min_x, min_y, max_x, max_y))
-    cropped.save(output_dir + "/" + fname + ".png", "PNG")
+    box = get_bounding_box(data)
+    if box is None:
+        return None
+    min_x, min_y, max_x, max_y = box
     # Remove the outer layer of pixels to remove artifacts from cropping
-    modify_outline(fname, remove_outline)
+    return modify_outline(data[min_y:max_y, min_x:max_x], remove_outline)
+
+
+"""
+This function returns what the manifest compares an input file by
+"""
+
+
+def file_signature(path):
+    stat = os.stat(path)
+    if not manifest_hash:
+        return {"size": stat.st_size, "mtime": stat.st_mtime_ns}
+    with open(path, "rb") as f:
+        return {"size": stat.st_size, "sha256": hashlib.sha256(f.read()).hexdigest()}
+
+
+"""
+This function exports the sprite of one input file
+Returns the file name, its manifest entry and an error message (None if it was exported)
+"""
+
+
+def export_file(f):
+    entry = file_signature(input_dir + "/" + f)
+    try:
+        with Image.open(input_dir + "/" + f) as img:
+            sprite = extract_sprite(np.asarray(img.convert("RGB")))
+        if sprite is None:
+            entry["output"] = None
+            return f, entry, None
+        entry["output"] = f.split(".")[0] + ".png"
+        # Save output image as png
+        Image.fromarray(sprite).save(output_dir + "/" + entry["output"], "PNG")
+        return f, entry, None
+    except Exception as e:
+        return f, entry, "{}: {}".format(type(e).__name__, e)
+
+
+########### Main function ######################
+if __name__ == '__main__':
+    os.makedirs(output_dir, exist_ok=True)
+    # Changing any of the masking settings invalidates the whole manifest
+    settings = {"area": list(area), "background": list(background), "tolerance": tolerance,
+                "tolerance_offsets": [tolerance_offset_1, tolerance_offset_2, tolerance_offset_3],
+                "remove_outline": remove_outline}
+    manifest = {"settings": settings, "files": {}}
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            previous = json.load(f)
+        if previous.get("settings") == settings:
+            manifest = previous
+
+    # Get list of files in the input directory, skipping the ones that are exported already and did not change
+    files = []
+    for f in sorted(listdir(input_dir)):
+        entry = manifest["files"].get(f)
+        if entry is not None and (entry["output"] is None or os.path.exists(output_dir + "/" + entry["output"])):
+            signature = file_signature(input_dir + "/" + f)
+            if all(entry.get(key) == value for key, value in signature.items()):
+                continue
+        files.append(f)
+    print("Exporting {} new or changed files with {} workers".format(len(files), workers))
+
+    failed = []
+    try:
+        with Pool(workers) as pool:
+            for f, entry, error in pool.imap_unordered(export_file, files, chunksize=8):
+                if error is not None:
+                    print("Failed to export {}: {}".format(f, error))
+                    failed.append(f)
+                    manifest["files"].pop(f, None)
+                    continue
+                if entry["output"] is None:
+                    print("No object found in {}".format(f))
+                else:
+                    print(f)
+                manifest["files"][f] = entry
+    finally:
+        with open(manifest_path, "w") as f:
+            json.dump(manifest, f, indent=1)
+    print("Exported {} files, {} failed".format(len(files) - len(failed), len(failed)))
+    for f in failed:
+        print("  " + f)
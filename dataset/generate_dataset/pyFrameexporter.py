@@ -1,66 +1,171 @@
 # This script just needs Opencv to run
 # Install opencv using pip: python -m pip install opencv-python
 # See this link for more information: https://www.scivision.co/install-opencv-python-windows/
+# Run it without arguments to be asked for the settings, or pass them on the command line, e.g.
+# python pyFrameexporter.py capture.mp4 --skip 5 --sprites
 import datetime
 import os
+from argparse import ArgumentParser
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
 
 import cv2
 
-# ======================= Get parameters =========================
-print("Welcome to Frameexporter, a tool that reads from a video file and exports every X frames into JPG images")
-SOURCE_FILENAME = input("Please enter the filename:\n")
-try:
-    SKIP_FRAMES = int(
-        input("Enter number of frames to skip between each export (0 means every frame will be exported)\n")) + 1
-except Exception:
-    SKIP_FRAMES = 1
-    print("Nothing entered, saving all frames!")
 
-OUT_FILE_PREFIX = input(
-    "Enter a file prefix (for example out-). Entering nothing will just number the output in ascending order.\n")
-source = cv2.VideoCapture(SOURCE_FILENAME)
-t = datetime.datetime.now()
-timestamp = t.strftime('%Y_%m_%d_%H_%M_%S')
-output_directory = os.path.dirname(os.path.realpath(__file__)) + '/' + timestamp + "-export/"
-print("Creating new directory for output: {}".format(output_directory))
-if not os.path.exists(output_directory):
-    os.makedirs(output_directory)
-else:
-    print("error")
+def ask_settings():
+    """
+    Asks for the export settings interactively
+    :return: Source filename, frames to skip, file prefix and output resolution (None for native)
+    """
+    print("Welcome to Frameexporter, a tool that reads from a video file and exports every X frames into JPG images")
+    source_filename = input("Please enter the filename:\n")
+    try:
+        skip_frames = int(
+            input("Enter number of frames to skip between each export (0 means every frame will be exported)\n"))
+    except Exception:
+        skip_frames = 0
+        print("Nothing entered, saving all frames!")
 
-# ====================== Resize output =========================
-resize = True
-try:
-    x_pixel = int(input("Enter the output resolution X-axis in pixels. None means native resolution.\n"))
-except Exception:
-    resize = False
-    print("No resolution entered, using native resolution")
-if resize:
+    out_file_prefix = input(
+        "Enter a file prefix (for example out-). Entering nothing will just number the output in ascending order.\n")
+    # ====================== Resize output =========================
+    size = None
     try:
-        y_pixel = int(input("Enter the output resolution Y-axis in pixels. None means native resolution.\n"))
+        x_pixel = int(input("Enter the output resolution X-axis in pixels. None means native resolution.\n"))
+        try:
+            y_pixel = int(input("Enter the output resolution Y-axis in pixels. None means native resolution.\n"))
+            size = (x_pixel, y_pixel)
+        except Exception:
+            print("No y resolutoin entered, using native resolution")
     except Exception:
-        print("No y resolutoin entered, using native resolution")
-        resize = False
+        print("No resolution entered, using native resolution")
+    return source_filename, skip_frames, out_file_prefix, size
+
+
+def write_frame(output_filename, frame, size):
+    """
+    Resizes and writes one exported frame, runs on the encoder pool
+    :param output_filename: Path of the JPG image
+    :param frame: BGR frame
+    :param size: (width, height) to resize to, None for native resolution
+    """
+    if size is not None:
+        frame = cv2.resize(frame, size)
+    cv2.imwrite(output_filename, frame)
+
 
-# ===============================================================
-print("Starting export, cancel the process by pressing ctrl+c. All images that are already exported will be saved!")
-if (source.isOpened() == False):
-    print('Error opening video stream')
-else:
+def write_sprite(output_filename, frame, size):
+    """
+    Extracts the chroma-keyed sprite from one exported frame and writes it, runs on the encoder pool
+    :param output_filename: Path of the PNG sprite
+    :param frame: BGR frame
+    :param size: (width, height) to resize to before extracting, None for native resolution
+    :return: False if the frame did not contain an object
+    """
+    from PIL import Image
+    from pyExportTransparentPNG import extract_sprite
+    if size is not None:
+        frame = cv2.resize(frame, size)
+    sprite = extract_sprite(frame[..., ::-1])
+    if sprite is None:
+        return False
+    Image.fromarray(sprite).save(output_filename, "PNG")
+    return True
+
+
+def export_frames(source, output_directory, skip_frames, out_file_prefix="", size=None, sprites=False, workers=4,
+                  seek_threshold=30):
+    """
+    Streams the video and exports every (skip_frames + 1)th frame, the kept ones are encoded on a thread pool
+    Skipped frames are grabbed, which still decodes them with FFmpeg but skips the conversion to a BGR image, so
+    long skips seek to the next exported frame instead (a seek decodes from the keyframe before it)
+    :param source: Opened cv2.VideoCapture
+    :param output_directory: Directory the images are written to
+    :param skip_frames: Number of frames to skip between each export
+    :param out_file_prefix: Prefix of the output file names
+    :param size: (width, height) to resize the frames to, None for native resolution
+    :param sprites: Write the chroma-keyed sprite of each frame (like pyExportTransparentPNG.py) instead of the frame
+    :param workers: Number of encoder threads
+    :param seek_threshold: Seeks instead of grabbing when at least this many frames are skipped at once
+    :return: Number of frames passed over and number of images written
+    """
+    write = write_sprite if sprites else write_frame
+    extension = ".png" if sprites else ".jpg"
+    step = skip_frames + 1
+    seek = skip_frames >= seek_threshold
     frame_count = 0
     output_counter = 0
-    while (source.isOpened()):
-        ret, frame = source.read()
-        if ret:
-            if frame_count % SKIP_FRAMES == 0:
-                # Write to file
-                output_filename = output_directory + OUT_FILE_PREFIX + str(output_counter) + ".jpg"
-                output_counter = output_counter + 1
-                if resize:
-                    frame = cv2.resize((frame), (x_pixel, y_pixel))
-                cv2.imwrite(output_filename, frame)
+    written = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # Bound the frames waiting for the encoders so a slow disk does not buffer the whole video in memory
+        pending = deque()
+        while source.grab():
+            if frame_count % step == 0:
+                ret, frame = source.retrieve()
+                if ret:
+                    output_filename = output_directory + out_file_prefix + str(output_counter) + extension
+                    output_counter = output_counter + 1
+                    pending.append(executor.submit(write, output_filename, frame, size))
+                    while len(pending) > 2 * workers:
+                        written += pending.popleft().result() is not False
+            if seek and frame_count % step == 0:
+                # Fall back to grabbing the skipped frames if the backend cannot seek
+                seek = source.set(cv2.CAP_PROP_POS_FRAMES, frame_count + step)
+                if seek:
+                    frame_count = frame_count + step
+                    continue
             frame_count = frame_count + 1
+        while len(pending) > 0:
+            written += pending.popleft().result() is not False
+    return frame_count, written
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description="Exports every X frames of a video into JPG images, or straight into "
+                                        "chroma-keyed sprites")
+    parser.add_argument("source", nargs="?", default=None,
+                        help="Video file, leave it out to be asked for all settings interactively")
+    parser.add_argument("--skip", type=int, default=0,
+                        help="Number of frames to skip between each export (0 means every frame will be exported)")
+    parser.add_argument("--prefix", default="", help="Prefix of the output file names")
+    parser.add_argument("--width", type=int, default=None, help="Output resolution X-axis in pixels")
+    parser.add_argument("--height", type=int, default=None, help="Output resolution Y-axis in pixels")
+    parser.add_argument("--output_dir", default=None, help="Output directory, defaults to a new timestamped one")
+    parser.add_argument("--sprites", action="store_true",
+                        help="Extract the sprites with pyExportTransparentPNG.py's settings in memory instead of "
+                             "writing the frames")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Number of encoder threads")
+    parser.add_argument("--seek_threshold", type=int, default=30,
+                        help="Seek to the next exported frame instead of grabbing the skipped ones when --skip is at "
+                             "least this large")
+    args = parser.parse_args()
+
+    if args.source is None:
+        SOURCE_FILENAME, SKIP_FRAMES, OUT_FILE_PREFIX, SIZE = ask_settings()
+    else:
+        SOURCE_FILENAME, SKIP_FRAMES, OUT_FILE_PREFIX = args.source, args.skip, args.prefix
+        SIZE = (args.width, args.height) if args.width is not None and args.height is not None else None
+    source = cv2.VideoCapture(SOURCE_FILENAME)
+    if args.output_dir is None:
+        t = datetime.datetime.now()
+        timestamp = t.strftime('%Y_%m_%d_%H_%M_%S')
+        output_directory = os.path.dirname(os.path.realpath(__file__)) + '/' + timestamp + "-export/"
+    else:
+        output_directory = os.path.join(args.output_dir, "")
+    print("Creating new directory for output: {}".format(output_directory))
+    os.makedirs(output_directory, exist_ok=True)
 
-        else:
-            print('File Processed!')
-            break
+    # ===============================================================
+    print("Starting export, cancel the process by pressing ctrl+c. All images that are already exported will be "
+          "saved!")
+    if not source.isOpened():
+        print('Error opening video stream')
+    else:
+        s = perf_counter()
+        frame_count, written = export_frames(source, output_directory, SKIP_FRAMES, OUT_FILE_PREFIX, SIZE,
+                                             args.sprites, args.workers, args.seek_threshold)
+        source.release()
+        elapsed = perf_counter() - s
+        print('File Processed! Wrote {} images from {} frames in {:.1f}s ({:.1f} frames per second)'.format(
+            written, frame_count, elapsed, frame_count / max(elapsed, 1e-9)))
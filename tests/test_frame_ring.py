@@ -0,0 +1,76 @@
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from CaptureBuffers import FrameRing
+from Pipeline import start_pipeline, stop_pipeline
+
+
+class CountingSource:
+    """
+    Frame source writing frames filled with their index into a ring, like the sources with --capture_ring
+    """
+
+    def __init__(self, frame_count, slots):
+        self.frame_count = frame_count
+        self.index = 0
+        self.ring = FrameRing(8, 8, slots=slots)
+
+    def read(self):
+        if self.index >= self.frame_count:
+            return None
+        self.index += 1
+        time.sleep(0.002)
+        return self.ring.write(np.full((8, 8, 3), self.index % 256, dtype=np.uint8))
+
+    def release(self, frame_arr):
+        self.ring.release(frame_arr)
+
+    def close(self):
+        self.ring.close()
+
+
+def test_held_frame_is_not_overwritten():
+    ring = FrameRing(8, 8, slots=2)
+    first = ring.write(np.full((8, 8, 3), 1, dtype=np.uint8))
+    ring.write(np.full((8, 8, 3), 2, dtype=np.uint8))
+    # Every buffer is in use, the next frame must not land in one of them
+    third = ring.write(np.full((8, 8, 3), 3, dtype=np.uint8))
+    assert (first == 1).all()
+    assert (third == 3).all()
+    assert ring.slot_index(third) is None
+    assert ring.fallbacks == 1
+    ring.release(first[..., ::-1])
+    fourth = ring.write(np.full((8, 8, 3), 4, dtype=np.uint8))
+    assert ring.slot_index(fourth) == 0
+    ring.close()
+
+
+def test_latest_frame_only_consumer_sees_stable_frames():
+    source = CountingSource(200, slots=5)
+
+    def detect(frame_arr):
+        seen = int(frame_arr[0, 0, 0])
+        time.sleep(0.01)
+        return seen
+
+    frame_queue, detection_queue, stop_event, workers = start_pipeline(source, detect, 1, True)
+    changed = total = 0
+    while True:
+        detected = detection_queue.get(timeout=10)
+        if detected is None:
+            break
+        frame_arr, seen = detected
+        # The capture keeps running while the consumer draws the frame
+        time.sleep(0.005)
+        total += 1
+        changed += int((frame_arr != seen).any())
+        source.release(frame_arr)
+    stop_pipeline(stop_event, workers)
+    source.close()
+    assert total > 5
+    assert changed == 0
@@ -0,0 +1,173 @@
+import contextlib
+import io
+import math
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Benchmark import make_fixture_frame
+from CSHelperUtils import find_hp_bars, minions_below_threshold
+
+HP_LOWER = [205, 90, 90]
+HP_UPPER = [210, 95, 95]
+HP_BAR_LENGTH = 71
+HP_SEARCH_PADDING = 25
+MINION_THRESHOLDS = [20, 30, 40]
+
+
+def is_hp(pixel, hp_lower, hp_upper):
+    return hp_lower[0] <= pixel[0] <= hp_upper[0] and \
+           hp_lower[1] <= pixel[1] <= hp_upper[1] and \
+           hp_lower[2] <= pixel[2] <= hp_upper[2]
+
+
+def old_below_threshold(minion_pos, frame_arr, hp_search_padding, hp_lower, hp_upper, hp_bar_length,
+                        minion_thresholds):
+    """
+    The per-minion, per-pixel search minions_below_threshold replaced, kept as the reference it must match
+    """
+    try:
+        search_box = []
+        if int(minion_pos[0]) > hp_search_padding:
+            search_box.append(int(minion_pos[0]) - hp_search_padding)
+        else:
+            search_box.append(int(minion_pos[0]))
+        if int(minion_pos[1]) > hp_search_padding:
+            search_box.append(int(minion_pos[1]) - hp_search_padding)
+        else:
+            search_box.append(int(minion_pos[1]))
+        if int(minion_pos[0] + minion_pos[2]) + hp_search_padding < frame_arr.shape[1] - 1:
+            search_box.append(int(minion_pos[0] + minion_pos[2]) + hp_search_padding)
+        else:
+            search_box.append(int(minion_pos[0] + minion_pos[2]))
+        search_box.append(int(minion_pos[1] + minion_pos[2] / 2))
+
+        found_hp_y_list = []
+        found_hp_x_list = []
+        half_hp_bar_length = int(hp_bar_length / 2)
+        for y in range(search_box[1], search_box[3]):
+            for x in range(search_box[0], search_box[2]):
+                pixel = frame_arr[y][x]
+                if is_hp(pixel, hp_lower, hp_upper) and y not in found_hp_y_list and x + half_hp_bar_length <= \
+                        search_box[2]:
+                    if x - 1 >= 0:
+                        if not is_hp(frame_arr[y][x - 1], hp_lower, hp_upper):
+                            found_hp_y_list.append(y)
+                            found_hp_x_list.append(x)
+                    else:
+                        found_hp_y_list.append(y)
+                        found_hp_x_list.append(x)
+
+        if len(found_hp_y_list) == 0:
+            raise Exception("Could not find HP!")
+
+        if len(found_hp_y_list) > 1:
+            closest_to_center_index = -1
+            closest_to_center_val = 10000
+            minion_center_x = int(minion_pos[0] + minion_pos[2] / 2)
+            for found_hp_index, found_hp_x in enumerate(found_hp_x_list):
+                center = found_hp_x + half_hp_bar_length
+                dx = abs(center - minion_center_x)
+                dy = abs(found_hp_y_list[found_hp_index] - minion_pos[1])
+                dist_to_minion = math.sqrt(dx ** 2 + dy ** 2)
+                if dist_to_minion < closest_to_center_val:
+                    closest_to_center_val = dist_to_minion
+                    closest_to_center_index = found_hp_index
+            starting_pixel = [found_hp_x_list[closest_to_center_index], found_hp_y_list[closest_to_center_index]]
+        else:
+            starting_pixel = [found_hp_x_list[0], found_hp_y_list[0]]
+
+        hp_pixel_count = 0
+        for _ in range(80):
+            pixel = frame_arr[starting_pixel[1], starting_pixel[0]]
+            if is_hp(pixel, hp_lower, hp_upper):
+                hp_pixel_count += 1
+                starting_pixel[0] += 1
+            else:
+                break
+
+        return hp_pixel_count <= minion_thresholds[minion_pos[4]]
+    except Exception:
+        return False
+
+
+def compare(minion_pos_list, frame_arr):
+    with contextlib.redirect_stdout(io.StringIO()):
+        new = minions_below_threshold(minion_pos_list, frame_arr, HP_SEARCH_PADDING, np.array(HP_LOWER, np.uint8),
+                                      np.array(HP_UPPER, np.uint8), HP_BAR_LENGTH, MINION_THRESHOLDS)
+    old = [old_below_threshold(minion_pos, frame_arr, HP_SEARCH_PADDING, HP_LOWER, HP_UPPER, HP_BAR_LENGTH,
+                               MINION_THRESHOLDS) for minion_pos in minion_pos_list]
+    mismatched = [(minion_pos, o, n) for minion_pos, o, n in zip(minion_pos_list, old, new) if o != n]
+    assert mismatched == []
+    return new
+
+
+def draw_bars(frame_arr, rng, count, max_x, max_y):
+    for _ in range(count):
+        y = int(rng.integers(0, max_y))
+        x = int(rng.integers(0, max_x))
+        frame_arr[y, x:min(x + int(rng.integers(1, 90)), max_x)] = rng.integers(HP_LOWER, np.add(HP_UPPER, 1))
+
+
+def test_fixture_frames_match_old_loop():
+    for seed, minion_count in enumerate((1, 5, 12)):
+        frame_arr, detections, hp_counts = make_fixture_frame(640, 360, minion_count, seed, HP_LOWER, HP_UPPER,
+                                                              HP_BAR_LENGTH)
+        minion_pos_list = [[x0, y0, x1 - x0, y1 - y0, int(label)] for x0, y0, x1, y1, _, label in detections]
+        below = compare(minion_pos_list, frame_arr)
+        assert below == [hp <= MINION_THRESHOLDS[pos[4]] for pos, hp in zip(minion_pos_list, hp_counts)]
+
+
+def test_boxes_at_bottom_and_right_edges_match_old_loop():
+    rng = np.random.default_rng(1)
+    height, width = 120, 200
+    for _ in range(300):
+        frame_arr = rng.integers(0, 80, size=(height, width, 3), dtype=np.uint8)
+        draw_bars(frame_arr, rng, int(rng.integers(1, 8)), width, height)
+        # Bars running into the right edge of the frame
+        frame_arr[int(rng.integers(0, height)), width - int(rng.integers(1, 40)):] = HP_LOWER
+        minion_pos_list = [[float(rng.uniform(0, width + 10)), float(rng.uniform(0, height + 10)),
+                            float(rng.uniform(5, 90)), float(rng.uniform(5, 90)), int(rng.integers(0, 3))]
+                           for _ in range(6)]
+        compare(minion_pos_list, frame_arr)
+
+
+def test_boxes_at_top_and_left_edges_match_old_loop():
+    # The old loop indexed past the top and left edges with negative coordinates, which wrapped around to the
+    # opposite edges, so keep the HP bars away from them for the results to be comparable
+    rng = np.random.default_rng(2)
+    height, width = 200, 300
+    for _ in range(300):
+        frame_arr = rng.integers(0, 80, size=(height, width, 3), dtype=np.uint8)
+        draw_bars(frame_arr, rng, int(rng.integers(1, 8)), 160, 100)
+        minion_pos_list = [[float(rng.uniform(-60, 120)), float(rng.uniform(-60, 80)), float(rng.uniform(5, 90)),
+                            float(rng.uniform(5, 90)), int(rng.integers(0, 3))] for _ in range(6)]
+        compare(minion_pos_list, frame_arr)
+
+
+def test_boxes_past_top_left_edge_ignore_opposite_edges():
+    # A short bar in the bottom right corner, which the old loop found at row -1 and column -10 for this box
+    frame_arr = np.zeros((100, 200, 3), dtype=np.uint8)
+    frame_arr[99, 190:200] = HP_LOWER
+    assert old_below_threshold([-40.0, -20.0, 80.0, 40.0, 0], frame_arr, HP_SEARCH_PADDING, HP_LOWER, HP_UPPER,
+                               HP_BAR_LENGTH, MINION_THRESHOLDS)
+    with contextlib.redirect_stdout(io.StringIO()):
+        below = minions_below_threshold([[-40.0, -20.0, 80.0, 40.0, 0]], frame_arr, HP_SEARCH_PADDING,
+                                        np.array(HP_LOWER, np.uint8), np.array(HP_UPPER, np.uint8), HP_BAR_LENGTH,
+                                        MINION_THRESHOLDS)
+    assert below == [False]
+
+
+def test_find_hp_bars_splits_runs_at_row_ends():
+    frame_arr = np.zeros((3, 10, 3), dtype=np.uint8)
+    frame_arr[0, 7:] = HP_LOWER
+    frame_arr[1, :4] = HP_UPPER
+    frame_arr[2, 2:5] = HP_LOWER
+    frame_arr[2, 6] = HP_LOWER
+    bar_x, bar_y, bar_len = find_hp_bars(frame_arr, np.array(HP_LOWER, np.uint8), np.array(HP_UPPER, np.uint8))
+    assert bar_x.tolist() == [7, 0, 2, 6]
+    assert bar_y.tolist() == [0, 1, 2, 2]
+    assert bar_len.tolist() == [3, 4, 3, 1]
@@ -0,0 +1,65 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from HpPrediction import HpHistory, HpPredictor
+from MinionTracker import Track
+
+
+def test_history_wraps_around_and_measures_the_window():
+    history = HpHistory(4)
+    # 60 HP at 0.0s, then 2 HP lost every 0.1s until 1.0s, then 10 HP lost every 0.1s
+    readings = [(i / 10, 60 - 2 * i) for i in range(11)] + [(1.0 + i / 10, 40 - 10 * i) for i in range(1, 4)]
+    for t, hp_pixel_count in readings:
+        history.add(t, hp_pixel_count)
+    assert history.count == 4
+    assert history.oldest() == (1.0, 40)
+    assert history.newest() == (1.3, 10)
+    # Only the 4 newest readings are in the window, the slow damage before them no longer counts
+    assert history.damage_rate() == pytest.approx(100.0)
+    assert history.predicted_hp(1.35) == pytest.approx(5.0)
+
+
+def test_history_partially_filled():
+    history = HpHistory(8)
+    assert history.damage_rate() == 0.0
+    history.add(0.0, 50)
+    assert history.damage_rate() == 0.0
+    assert history.predicted_hp(1.0) == 50
+    history.add(0.5, 45)
+    assert history.oldest() == (0.0, 50)
+    assert history.damage_rate() == pytest.approx(10.0)
+
+
+def test_healing_is_not_a_negative_damage_rate():
+    history = HpHistory(3)
+    for t, hp_pixel_count in [(0.0, 20), (0.1, 25), (0.2, 30)]:
+        history.add(t, hp_pixel_count)
+    assert history.damage_rate() == 0.0
+    assert history.predicted_hp(5.0) == 30
+
+
+def test_predictor_flags_minions_within_the_lead_time():
+    predictor = HpPredictor(lead_time=0.5, history_size=4)
+    falling = Track(0, [0, 0, 40, 40, 0])
+    steady = Track(1, [100, 0, 40, 40, 1])
+    thresholds = [20, 30, 40]
+    for i in range(6):
+        predictor.update([falling, steady], [60 - 4 * i, 50], i / 10)
+    # 40 HP now, losing 40 HP per second, so 20 HP is reached within the lead time
+    assert predictor.should_attack(falling, thresholds, 0.5)
+    assert not predictor.should_attack(steady, thresholds, 0.5)
+    assert not predictor.should_attack(Track(2, [0, 0, 40, 40, 0]), thresholds, 0.5)
+
+
+def test_predictor_skips_missing_readings_and_forgets_old_tracks():
+    predictor = HpPredictor(lead_time=0.1)
+    tracks = [Track(i, [0, 0, 40, 40, 0]) for i in range(20)]
+    predictor.update(tracks, [None] + [50] * 19, 0.0)
+    assert 0 not in predictor.histories
+    assert len(predictor.histories) == 19
+    predictor.update(tracks[:1], [50], 0.1)
+    assert list(predictor.histories) == [0]
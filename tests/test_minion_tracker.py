@@ -0,0 +1,81 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from MinionTracker import MinionTracker, box_iou
+
+
+def test_box_iou():
+    iou = box_iou([[0, 0, 10, 10]], [[0, 0, 10, 10], [5, 0, 10, 10], [20, 20, 5, 5]])
+    assert iou.shape == (1, 3)
+    assert np.allclose(iou, [[1.0, 50 / 150, 0.0]])
+
+
+def test_matches_moving_minions_across_frames():
+    tracker = MinionTracker(detect_every=1)
+    first = tracker.update([[100, 100, 40, 40, 0], [300, 100, 40, 40, 1]])
+    second = tracker.update([[305, 102, 40, 40, 1], [104, 100, 40, 40, 0]])
+    assert [track.track_id for track in second] == [first[1].track_id, first[0].track_id]
+    assert second[1].velocity == [4.0, 0.0]
+    assert second[1].minion_pos == [104, 100, 40, 40, 0]
+
+
+def test_label_change_creates_new_track():
+    tracker = MinionTracker(detect_every=1)
+    first = tracker.update([[100, 100, 40, 40, 0]])
+    second = tracker.update([[100, 100, 40, 40, 2]])
+    assert second[0].track_id != first[0].track_id
+    assert len(tracker.tracks) == 2
+
+
+def test_creates_and_expires_tracks():
+    tracker = MinionTracker(detect_every=1, max_missed=2)
+    first = tracker.update([[100, 100, 40, 40, 0]])
+    tracker.update([[100, 100, 40, 40, 0], [400, 300, 40, 40, 1]])
+    assert len(tracker.tracks) == 2
+    for _ in range(2):
+        tracker.update([[400, 300, 40, 40, 1]])
+        assert first[0] in tracker.tracks
+    tracker.update([[400, 300, 40, 40, 1]])
+    assert first[0] not in tracker.tracks
+    assert len(tracker.tracks) == 1
+
+
+def test_predicts_positions_on_skipped_frames():
+    tracker = MinionTracker(detect_every=3)
+    assert tracker.needs_detection()
+    tracker.update([[100, 100, 40, 40, 0]])
+    tracker.update([[110, 95, 40, 40, 0]])
+    assert not tracker.needs_detection()
+    tracks, predicted = tracker.predict()
+    assert predicted == [[120, 90, 40, 40, 0]]
+    assert not tracker.needs_detection()
+    _, predicted = tracker.predict()
+    assert predicted == [[130, 85, 40, 40, 0]]
+    assert tracker.needs_detection()
+    # The next detection matches the prediction and measures the velocity over the skipped frames
+    matched = tracker.update([[140, 80, 40, 40, 0]])
+    assert matched[0] is tracks[0]
+    assert matched[0].velocity == [10.0, -5.0]
+
+
+def test_missed_tracks_are_not_predicted():
+    tracker = MinionTracker(detect_every=4)
+    tracker.update([[100, 100, 40, 40, 0], [300, 300, 40, 40, 1]])
+    tracker.update([[100, 100, 40, 40, 0]])
+    tracks, predicted = tracker.predict()
+    assert len(tracks) == 1
+    assert predicted == [[100, 100, 40, 40, 0]]
+
+
+def test_mark_lost_forces_detection():
+    tracker = MinionTracker(detect_every=5)
+    tracker.update([[100, 100, 40, 40, 0]])
+    assert not tracker.needs_detection()
+    tracker.mark_lost()
+    assert tracker.needs_detection()
+    tracker.update([[100, 100, 40, 40, 0]])
+    assert not tracker.needs_detection()
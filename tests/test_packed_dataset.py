@@ -0,0 +1,92 @@
+import io
+import os
+import sys
+
+import numpy as np
+import pytest
+from PIL import Image
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "dataset",
+                                "generate_dataset"))
+
+from packed_dataset import PackedDataset, ShardReader, ShardWriter, pack, parse_labels, shard_path, unpack
+
+
+def make_dataset(dataset_dir):
+    """
+    Writes 5 samples in two bootstrap.py shard directories, one of them without any objects
+    :return: Dictionary of relative path in the unpacked layout -> file contents
+    """
+    rng = np.random.default_rng(0)
+    files = {}
+    for i in range(5):
+        sample_dir = os.path.join(dataset_dir, "shard_{:03d}".format(i // 3))
+        os.makedirs(os.path.join(sample_dir, "images"), exist_ok=True)
+        os.makedirs(os.path.join(sample_dir, "labels"), exist_ok=True)
+        image_format, extension = ("PNG", ".png") if i == 4 else ("JPEG", ".jpg")
+        encoded = io.BytesIO()
+        Image.fromarray(rng.integers(0, 255, size=(24, 32, 3), dtype=np.uint8)).save(encoded, image_format)
+        # Written the way bootstrap.py writes the labels, sample 2 has no objects
+        labels_text = "".join(str(int(rng.integers(0, 3))) + " " + " ".join(str(float(v)) for v in rng.random(4)) +
+                              "\n" for _ in range(0 if i == 2 else i + 1))
+        name = "sample{}".format(i)
+        files[os.path.join("images", name + extension)] = encoded.getvalue()
+        files[os.path.join("labels", name + ".txt")] = labels_text.encode()
+        with open(os.path.join(sample_dir, "images", name + extension), "wb") as f:
+            f.write(encoded.getvalue())
+        with open(os.path.join(sample_dir, "labels", name + ".txt"), "w") as f:
+            f.write(labels_text)
+    return files
+
+
+def test_pack_unpack_round_trip_is_byte_identical(tmp_path):
+    files = make_dataset(str(tmp_path / "dataset"))
+    assert pack(str(tmp_path / "dataset"), str(tmp_path / "packed"), samples_per_shard=2) == 5
+    assert sorted(os.listdir(tmp_path / "packed")) == ["shard_000.pack", "shard_001.pack", "shard_002.pack"]
+    assert unpack(str(tmp_path / "packed"), str(tmp_path / "unpacked")) == 5
+    unpacked = {}
+    for sub_dir in ("images", "labels"):
+        for f in os.listdir(tmp_path / "unpacked" / sub_dir):
+            unpacked[os.path.join(sub_dir, f)] = (tmp_path / "unpacked" / sub_dir / f).read_bytes()
+    assert unpacked == files
+
+
+def test_sample_without_labels(tmp_path):
+    make_dataset(str(tmp_path / "dataset"))
+    pack(str(tmp_path / "dataset"), str(tmp_path / "packed"), samples_per_shard=2)
+    dataset = PackedDataset(str(tmp_path / "packed"))
+    image, labels = dataset[2]
+    assert image.shape == (24, 32, 3)
+    assert len(labels) == 0
+    assert labels.dtype == parse_labels("").dtype
+    assert [len(labels) for _, labels in dataset] == [1, 2, 0, 4, 5]
+    dataset.close()
+
+
+def test_shard_of_only_empty_samples(tmp_path):
+    with ShardWriter(shard_path(str(tmp_path), 0)) as writer:
+        writer.add("empty", b"not an image", parse_labels(""), ".jpg")
+    reader = ShardReader(shard_path(str(tmp_path), 0))
+    assert len(reader) == 1
+    assert reader.name(0) == "empty"
+    assert reader.image_bytes(0) == b"not an image"
+    assert len(reader.labels(0)) == 0
+    reader.close()
+
+
+def test_locate_at_shard_boundaries(tmp_path):
+    make_dataset(str(tmp_path / "dataset"))
+    pack(str(tmp_path / "dataset"), str(tmp_path / "packed"), samples_per_shard=2)
+    dataset = PackedDataset(str(tmp_path / "packed"))
+    assert len(dataset) == 5
+    expected = [(0, 0), (0, 1), (1, 0), (1, 1), (2, 0)]
+    for i, (shard, j) in enumerate(expected):
+        for index in (i, i - 5):
+            located_shard, located_j = dataset.locate(index)
+            assert located_shard is dataset.shards[shard]
+            assert located_j == j
+            assert located_shard.name(located_j) == "sample{}".format(i)
+    for index in (5, -6):
+        with pytest.raises(IndexError):
+            dataset.locate(index)
+    dataset.close()
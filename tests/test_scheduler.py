@@ -0,0 +1,79 @@
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Scheduler import AdaptiveScheduler, build_ladder
+
+
+def observe_window(scheduler, frame_ms):
+    """
+    :return: Results of observe for one full window of frames taking frame_ms each
+    """
+    return [scheduler.observe(int(frame_ms * 1e6)) for _ in range(scheduler.window)]
+
+
+def test_ladder_order_and_limits():
+    ladder = build_ladder(640, 320, size_step=64, detect_every=1, max_detect_every=4, max_hp_every=3)
+    assert ladder[0] == (640, 1, 1)
+    assert ladder[-1] == (320, 4, 3)
+    assert ladder[1:4] == [(640, 2, 1), (576, 2, 1), (576, 2, 2)]
+    for previous, level in zip(ladder, ladder[1:]):
+        changed = [i for i in range(3) if previous[i] != level[i]]
+        # Exactly one knob changes per level, always towards the cheaper setting
+        assert len(changed) == 1
+        assert level[0] <= previous[0] and level[1] >= previous[1] and level[2] >= previous[2]
+    for img_size, detect_every, hp_every in ladder:
+        assert 320 <= img_size <= 640 and 1 <= detect_every <= 4 and 1 <= hp_every <= 3
+
+
+def test_ladder_keeps_fixed_input_size():
+    ladder = build_ladder(640, 640, detect_every=2, max_detect_every=3, max_hp_every=2)
+    assert ladder == [(640, 2, 1), (640, 3, 1), (640, 3, 2)]
+    assert build_ladder(640, 640, max_detect_every=1, max_hp_every=1) == [(640, 1, 1)]
+
+
+def test_steps_down_on_an_over_budget_window():
+    scheduler = AdaptiveScheduler(10.0, build_ladder(640, 320), window=5)
+    assert observe_window(scheduler, 15.0) == [False] * 4 + [True]
+    assert scheduler.level == 1
+    assert (scheduler.img_size, scheduler.detect_every, scheduler.hp_every) == scheduler.ladder[1]
+    # A window within the budget but without enough room stays put
+    assert not any(observe_window(scheduler, 9.0))
+    assert scheduler.level == 1
+
+
+def test_stays_at_the_cheapest_level():
+    ladder = build_ladder(640, 640, max_detect_every=2, max_hp_every=1)
+    scheduler = AdaptiveScheduler(10.0, ladder, window=5)
+    for _ in range(3):
+        observe_window(scheduler, 20.0)
+    assert scheduler.level == len(ladder) - 1
+
+
+def test_steps_up_after_three_windows_with_room(tmp_path):
+    log_path = str(tmp_path / "scheduler.jsonl")
+    scheduler = AdaptiveScheduler(10.0, build_ladder(640, 320), window=5, log_path=log_path)
+    observe_window(scheduler, 15.0)
+    observe_window(scheduler, 15.0)
+    assert scheduler.level == 2
+    # Two windows under 75% of the budget, then one above it resets the count
+    assert not any(observe_window(scheduler, 7.0))
+    assert not any(observe_window(scheduler, 7.0))
+    assert not any(observe_window(scheduler, 8.0))
+    assert scheduler.level == 2
+    assert not any(observe_window(scheduler, 7.0))
+    assert not any(observe_window(scheduler, 7.0))
+    assert observe_window(scheduler, 7.0)[-1]
+    assert scheduler.level == 1
+    with open(log_path) as f:
+        entries = [json.loads(line) for line in f]
+    assert [entry["reason"] for entry in entries] == ["over budget", "over budget", "under budget"]
+    assert [entry["level"] for entry in entries] == [1, 2, 1]
+    assert entries[-1]["previous"] == dict(zip(("img_size", "detect_every", "hp_every"), scheduler.ladder[2]))
+
+
+def test_hp_analysis_cadence():
+    scheduler = AdaptiveScheduler(10.0, [(640, 1, 3)], window=5)
+    assert [scheduler.run_hp_analysis() for _ in range(6)] == [False, False, True, False, False, True]